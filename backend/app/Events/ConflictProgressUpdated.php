@@ -0,0 +1,66 @@
+<?php
+
+namespace App\Events;
+
+use Illuminate\Broadcasting\Channel;
+use Illuminate\Broadcasting\InteractsWithSockets;
+use Illuminate\Contracts\Broadcasting\ShouldBroadcast;
+use Illuminate\Foundation\Events\Dispatchable;
+use Illuminate\Queue\SerializesModels;
+
+class ConflictProgressUpdated implements ShouldBroadcast
+{
+    use Dispatchable, InteractsWithSockets, SerializesModels;
+
+    public int $projectId;
+    public string $jobId;
+    public string $type;
+    public array $data;
+
+    /**
+     * Create a new event instance.
+     *
+     * @param string $type started | stage | batch | cluster | done | error
+     * @param array $data Event payload as sent by the LLM service
+     */
+    public function __construct(
+        int $projectId,
+        string $jobId,
+        string $type,
+        array $data = []
+    ) {
+        $this->projectId = $projectId;
+        $this->jobId = $jobId;
+        $this->type = $type;
+        $this->data = $data;
+    }
+
+    /**
+     * Get the channels the event should broadcast on.
+     */
+    public function broadcastOn(): Channel
+    {
+        return new Channel('project.' . $this->projectId);
+    }
+
+    /**
+     * The event's broadcast name.
+     */
+    public function broadcastAs(): string
+    {
+        return 'conflict.progress';
+    }
+
+    /**
+     * Get the data to broadcast.
+     */
+    public function broadcastWith(): array
+    {
+        return [
+            'project_id' => $this->projectId,
+            'job_id' => $this->jobId,
+            'type' => $this->type,
+            'data' => $this->data,
+        ];
+    }
+}
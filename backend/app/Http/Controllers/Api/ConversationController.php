@@ -67,6 +67,7 @@ public function index($projectId)
     public function store(ConversationRequest $request)
     {
         $new_conversation = $this->conversationService->createConversation($request->validated());
+        $this->prefetchAfterResponse($new_conversation->id);
         return response()->json($new_conversation, 201);
     }
 
@@ -76,8 +77,22 @@ public function store(ConversationRequest $request)
     public function show(string $id)
     {
         $messages = $this->conversationService->getMessages($id);
+        // Opening a conversation: have its project KB ready for the first message
+        $this->prefetchAfterResponse($id);
         return response()->json(['messages' => $messages]);
     }
+
+    /**
+     * Warm the project KB once the response has been sent, so the client
+     * never waits for the LLM service (which may still be loading its model).
+     */
+    protected function prefetchAfterResponse($conversationId): void
+    {
+        $conversationService = $this->conversationService;
+        dispatch(function () use ($conversationService, $conversationId) {
+            $conversationService->prefetchKnowledgeBase($conversationId);
+        })->afterResponse();
+    }
     
     public function sendMessage(MessageRequest $request, string $conversationId)
     {
@@ -173,6 +188,8 @@ public function update(ConversationRequest $request, string $id)
         // Only update the fields that are provided and validated
         $validatedData = $request->validated();
         $conversation->update($validatedData);
+        // The service session was built from the old conversation; start a fresh one
+        $this->llmService->forgetChatSession($id);
         
         return response()->json([
             'message' => 'Conversation updated successfully',
@@ -201,6 +218,7 @@ public function destroy(string $id)
         }
         
         $conversation->delete();
+        $this->llmService->forgetChatSession($id);
         return response()->json(['message' => 'Conversation deleted successfully']);
     }
 }
@@ -22,7 +22,9 @@ class ProcessDocumentJob implements ShouldQueue, ShouldBeUnique
     public int $documentId;
     public int $tries = 3;
     public array $backoff = [10, 30, 90];
-    public int $timeout = 180;
+    // Above LLMService's largest extraction timeout (services.llm.extract_max_timeout);
+    // the queue connection's retry_after must be larger still
+    public int $timeout = 1260;
 
     public function __construct(int $documentId)
     {
@@ -85,17 +87,8 @@ public function handle(LLMService $llmService, TextCommons $textCommons): void
                 'cleaned_length' => mb_strlen($content, 'UTF-8')
             ]);
 
-            // Truncate if too long (keep more content for better extraction)
-            // Adjust based on content complexity
-            $maxLength = 10000; // Reduced to ensure LLM response fits within token limits
-            
-            if (mb_strlen($content, 'UTF-8') > $maxLength) {
-                $content = mb_substr($content, 0, $maxLength, 'UTF-8') . "\n... [Document truncated for processing]";
-                Log::info('ProcessDocumentJob: Content truncated', [
-                    'document_id' => $document->id,
-                    'final_length' => mb_strlen($content, 'UTF-8')
-                ]);
-            }
+            // No truncation: the LLM service splits long documents by section
+            // and extracts the chunks concurrently (map-reduce extraction)
 
             // Call LLM service to extract requirements
             Log::info('ProcessDocumentJob: Calling LLM service', [
@@ -153,6 +146,23 @@ public function handle(LLMService $llmService, TextCommons $textCommons): void
                 'requirements_count' => count($result['requirements'] ?? [])
             ]);
 
+            // Some sections failed even after the service's own retry: their
+            // requirements are missing, so retry the job while attempts remain
+            if (!empty($result['partial'])) {
+                $failedChunks = $result['failed_chunks'] ?? [];
+                if ($this->attempts() < $this->tries) {
+                    throw new \RuntimeException(
+                        'Extraction incomplete: ' . count($failedChunks) . ' section(s) failed'
+                    );
+                }
+
+                Log::warning('ProcessDocumentJob: Saving partial extraction after final attempt', [
+                    'document_id' => $document->id,
+                    'failed_chunks' => $failedChunks,
+                    'chunks_processed' => $result['chunks_processed'] ?? null,
+                ]);
+            }
+
             // Clear previous extracted requirements if re-running
             if ($existingCount > 0) {
                 Log::info('ProcessDocumentJob: Clearing previous requirements', [
@@ -0,0 +1,104 @@
+<?php
+
+namespace App\Jobs;
+
+use App\Events\ConflictProgressUpdated;
+use Illuminate\Bus\Queueable;
+use Illuminate\Contracts\Queue\ShouldQueue;
+use Illuminate\Foundation\Bus\Dispatchable;
+use Illuminate\Queue\InteractsWithQueue;
+use Illuminate\Queue\SerializesModels;
+use Illuminate\Support\Facades\Http;
+use Illuminate\Support\Facades\Log;
+
+/**
+ * Follows the LLM service's Server-Sent Events for one conflict detection run
+ * (GET /api/conflicts/events/{jobId}) and re-broadcasts every event to the
+ * project channel as ConflictProgressUpdated.
+ */
+class RelayConflictProgressJob implements ShouldQueue
+{
+    use Dispatchable, InteractsWithQueue, Queueable, SerializesModels;
+
+    public int $projectId;
+    public string $jobId;
+
+    public int $tries = 1;
+
+    public int $timeout = 330;
+
+    public function __construct(int $projectId, string $jobId)
+    {
+        $this->projectId = $projectId;
+        $this->jobId = $jobId;
+    }
+
+    public function handle(): void
+    {
+        $baseUrl = env('LLM_API_URL', 'http://localhost:8000');
+
+        try {
+            $response = Http::withHeaders([
+                'X-API-Key' => env('LLM_API_KEY', 'dev-secret-key-12345'),
+                'Accept' => 'text/event-stream',
+            ])->withOptions(['stream' => true])
+                ->timeout(320)
+                ->get("{$baseUrl}/api/conflicts/events/{$this->jobId}");
+
+            $body = $response->toPsrResponse()->getBody();
+            $buffer = '';
+
+            while (! $body->eof()) {
+                $buffer .= $body->read(8192);
+
+                // SSE frames are separated by a blank line
+                while (($pos = strpos($buffer, "\n\n")) !== false) {
+                    $frame = substr($buffer, 0, $pos);
+                    $buffer = substr($buffer, $pos + 2);
+
+                    $event = $this->parseFrame($frame);
+                    if ($event === null) {
+                        continue; // keep-alive comment
+                    }
+
+                    broadcast(new ConflictProgressUpdated(
+                        $this->projectId,
+                        $this->jobId,
+                        $event['type'] ?? 'unknown',
+                        $event
+                    ));
+
+                    if (in_array($event['type'] ?? null, ['done', 'error'], true)) {
+                        return;
+                    }
+                }
+            }
+        } catch (\Exception $e) {
+            Log::warning('RelayConflictProgressJob: event stream failed', [
+                'project_id' => $this->projectId,
+                'job_id' => $this->jobId,
+                'error' => $e->getMessage(),
+            ]);
+        }
+    }
+
+    /**
+     * Decode the JSON "data:" lines of one SSE frame, or null for comments.
+     */
+    private function parseFrame(string $frame): ?array
+    {
+        $data = '';
+        foreach (explode("\n", $frame) as $line) {
+            if (str_starts_with($line, 'data:')) {
+                $data .= ltrim(substr($line, 5));
+            }
+        }
+
+        if ($data === '') {
+            return null;
+        }
+
+        $event = json_decode($data, true);
+        return is_array($event) ? $event : null;
+    }
+}
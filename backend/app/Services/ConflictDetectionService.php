@@ -2,6 +2,7 @@
 
 namespace App\Services;
 
+use App\Jobs\RelayConflictProgressJob;
 use App\Models\Project;
 use App\Models\Requirement;
 use App\Models\RequirementConflict;
@@ -51,6 +52,11 @@ public function detectConflictsForProject(int $projectId): array
             'count' => count($formattedRequirements)
         ]);
 
+        // Progress (stage timings, per-cluster completion, conflicts per batch) is
+        // streamed by the LLM service under this id and relayed to the project channel
+        $jobId = 'conflicts_' . $projectId . '_' . uniqid();
+        RelayConflictProgressJob::dispatch($projectId, $jobId);
+
         // Call LLM API to detect conflicts
         try {
             $response = Http::withHeaders([
@@ -61,6 +67,7 @@ public function detectConflictsForProject(int $projectId): array
                 'requirements' => $formattedRequirements,
                 'min_cluster_size' => 2,
                 'max_batch_size' => 30,
+                'job_id' => $jobId,
             ]);
 
             if (!$response->successful()) {
@@ -105,6 +112,7 @@ public function detectConflictsForProject(int $projectId): array
                 }
                 
                 return [
+                    'job_id' => $jobId,
                     'status' => 'completed',
                     'conflicts' => $conflicts,
                     'conflicts_saved' => $saved,
@@ -120,6 +128,7 @@ public function detectConflictsForProject(int $projectId): array
             ]);
 
             return [
+                'job_id' => $jobId,
                 'status' => 'completed',
                 'conflicts' => [],
                 'conflicts_saved' => 0,
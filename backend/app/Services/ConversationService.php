@@ -37,6 +37,23 @@ public function getMessages($conversationId)
         return Message::where('conversation_id', $conversationId)->get();
     }
 
+    /**
+     * Warm the LLM service's cache of the conversation's project KB, so the
+     * first chat message does not wait for the index to load.
+     */
+    public function prefetchKnowledgeBase($conversationId): void
+    {
+        $conversation = Conversation::find($conversationId);
+        if (!$conversation || !$conversation->project_id) {
+            return;
+        }
+
+        $kb = KnowledgeBase::where('project_id', $conversation->project_id)->first();
+        if ($kb && $kb->isReady()) {
+            $this->llmService->prefetchKB($conversation->project_id);
+        }
+    }
+
     public function sendMessage($conversationId, $messageData)
     {
         // Clean the incoming message content
@@ -75,7 +92,8 @@ public function sendMessage($conversationId, $messageData)
             
         // Prepare conversation history for LLM
         $history = [];
-        $recentMessages = $messages->take(-6);
+        // The LLM service picks recent + relevant turns within its token budget
+        $recentMessages = $messages->take(-config('services.llm.chat_history_messages', 40));
         foreach ($recentMessages as $msg) {
             if ($msg->role && $msg->content) {
                 $content = $this->textCommons->cleanUtf8Content($msg->content);
@@ -91,82 +109,14 @@ public function sendMessage($conversationId, $messageData)
         }
             
         $documentContext = '';
-        $kbContext = '';
         
-        // Check if conversation has a project with ready KB
+        // The LLM service retrieves from the project's knowledge base itself
+        $kbProjectId = null;
         if ($conversation->project_id) {
             $kb = KnowledgeBase::where('project_id', $conversation->project_id)->first();
             
             if ($kb && $kb->isReady()) {
-                try {
-                    Log::info('Querying KB for context', [
-                        'conversation_id' => $conversationId,
-                        'project_id' => $conversation->project_id,
-                        'query' => mb_substr($displayMessage, 0, 100)
-                    ]);
-                    
-                    // Query KB for relevant chunks
-                    $kbResults = $this->llmService->queryKB($conversation->project_id, $displayMessage, 5);
-                    
-                    Log::info('KB query results', [
-                        'results_count' => count($kbResults['results'] ?? []),
-                        'raw_response' => $kbResults
-                    ]);
-                    
-                    if (!empty($kbResults['results']) && is_array($kbResults['results'])) {
-                        $kbContext = "\n\n=== KNOWLEDGE BASE CONTEXT (Relevant Requirements) ===\n";
-                        
-                        foreach ($kbResults['results'] as $index => $result) {
-                            $score = $kbResults['scores'][$index] ?? 0;
-                            
-                            // Handle result format - could be string or array
-                            if (is_array($result)) {
-                                $content = $result['content'] ?? $result['text'] ?? json_encode($result);
-                                $metadata = $result['metadata'] ?? $result['meta'] ?? [];
-                            } else {
-                                $content = (string)$result;
-                                $metadata = [];
-                            }
-                            
-                            $kbContext .= sprintf(
-                                "\n[Chunk %d - Relevance: %.2f]\n%s\n",
-                                $index + 1,
-                                $score,
-                                $content
-                            );
-                            
-                            // Add metadata if available
-                            if (!empty($metadata)) {
-                                if (isset($metadata['filename'])) {
-                                    $kbContext .= "  Source: " . $metadata['filename'] . "\n";
-                                }
-                                if (isset($metadata['type'])) {
-                                    $kbContext .= "  Type: " . $metadata['type'] . "\n";
-                                }
-                            }
-                        }
-                        
-                        $kbContext .= "\n=== END KNOWLEDGE BASE CONTEXT ===\n";
-                        
-                        Log::info('KB context added to conversation', [
-                            'conversation_id' => $conversationId,
-                            'project_id' => $conversation->project_id,
-                            'chunks_found' => count($kbResults['results']),
-                            'context_length' => strlen($kbContext)
-                        ]);
-                    } else {
-                        Log::warning('KB query returned no results', [
-                            'conversation_id' => $conversationId,
-                            'project_id' => $conversation->project_id
-                        ]);
-                    }
-                } catch (\Exception $e) {
-                    Log::warning('Failed to query KB, falling back to document context', [
-                        'error' => $e->getMessage(),
-                        'trace' => $e->getTraceAsString(),
-                        'project_id' => $conversation->project_id,
-                    ]);
-                }
+                $kbProjectId = $conversation->project_id;
             } else {
                 Log::info('KB not ready for project', [
                     'project_id' => $conversation->project_id,
@@ -175,8 +125,8 @@ public function sendMessage($conversationId, $messageData)
             }
         }
         
-        // Fallback to uploaded documents if KB context is empty
-        if (empty($kbContext) && $conversation->documents->count() > 0) {
+        // Fallback to uploaded documents if the project has no ready KB
+        if (!$kbProjectId && $conversation->documents->count() > 0) {
             $documentContext = "\n\n=== UPLOADED DOCUMENTS CONTEXT ===\n";
             $totalTokens = 0;
             $maxDocumentTokens = 6000;
@@ -210,8 +160,8 @@ public function sendMessage($conversationId, $messageData)
         $enhancedContext = 'You are helping with requirements engineering and software development.';
         
         // Prioritize KB context if available
-        if (!empty($kbContext)) {
-            $enhancedContext .= ' The following are relevant requirements from the project knowledge base. Use these to provide accurate, context-aware answers.' . $kbContext;
+        if ($kbProjectId) {
+            $enhancedContext .= ' The project knowledge base excerpts that best match each message are provided with it. Use these to provide accurate, context-aware answers.';
         } elseif (!empty($documentContext)) {
             $enhancedContext .= ' The user has uploaded documents in this conversation. Use the document contents provided in the context to answer questions and provide relevant assistance.' . $documentContext;
         }
@@ -257,7 +207,9 @@ public function sendMessage($conversationId, $messageData)
             $aiContextMessage, 
             $history,
             $enhancedContext,
-            $personaData  // NEW: Pass persona data
+            $personaData,  // NEW: Pass persona data
+            (string) $conversationId,
+            $kbProjectId
         );
 
         // Save the AI response (with persona_id if used)
@@ -311,7 +263,8 @@ public function sendMessageStream($conversationId, $messageData)
         $messages = $this->getMessages($conversationId);
             
         $history = [];
-        $recentMessages = $messages->take(-6);
+        // The LLM service picks recent + relevant turns within its token budget
+        $recentMessages = $messages->take(-config('services.llm.chat_history_messages', 40));
         foreach ($recentMessages as $msg) {
             if ($msg->role && $msg->content) {
                 $content = $this->textCommons->cleanUtf8Content($msg->content);
@@ -327,54 +280,24 @@ public function sendMessageStream($conversationId, $messageData)
         }
             
         $documentContext = '';
-        $kbContext = '';
         
-        // Check KB context (same as sendMessage)
+        // The LLM service retrieves from the project's knowledge base itself
+        $kbProjectId = null;
         if ($conversation->project_id) {
             $kb = KnowledgeBase::where('project_id', $conversation->project_id)->first();
             
             if ($kb && $kb->isReady()) {
-                try {
-                    $kbResults = $this->llmService->queryKB($conversation->project_id, $displayMessage, 5);
-                    
-                    if (!empty($kbResults['results']) && is_array($kbResults['results'])) {
-                        $kbContext = "\n\n=== KNOWLEDGE BASE CONTEXT (Relevant Requirements) ===\n";
-                        
-                        foreach ($kbResults['results'] as $index => $result) {
-                            $score = $kbResults['scores'][$index] ?? 0;
-                            
-                            if (is_array($result)) {
-                                $content = $result['content'] ?? $result['text'] ?? json_encode($result);
-                                $metadata = $result['metadata'] ?? $result['meta'] ?? [];
-                            } else {
-                                $content = (string)$result;
-                                $metadata = [];
-                            }
-                            
-                            $kbContext .= sprintf(
-                                "\n[Chunk %d - Relevance: %.2f]\n%s\n",
-                                $index + 1,
-                                $score,
-                                $content
-                            );
-                            
-                            if (!empty($metadata)) {
-                                if (isset($metadata['filename'])) {
-                                    $kbContext .= "  Source: " . $metadata['filename'] . "\n";
-                                }
-                            }
-                        }
-                        
-                        $kbContext .= "\n=== END KNOWLEDGE BASE CONTEXT ===\n";
-                    }
-                } catch (\Exception $e) {
-                    Log::warning('Failed to query KB for streaming', ['error' => $e->getMessage()]);
-                }
+                $kbProjectId = $conversation->project_id;
+            } else {
+                Log::info('KB not ready for project', [
+                    'project_id' => $conversation->project_id,
+                    'kb_status' => $kb ? $kb->status : 'not_found'
+                ]);
             }
         }
         
-        // Fallback to documents if no KB context
-        if (empty($kbContext) && $conversation->documents->count() > 0) {
+        // Fallback to documents if the project has no ready KB
+        if (!$kbProjectId && $conversation->documents->count() > 0) {
             $documentContext = "\n\n=== UPLOADED DOCUMENTS CONTEXT ===\n";
             $totalTokens = 0;
             $maxDocumentTokens = 6000;
@@ -405,8 +328,8 @@ public function sendMessageStream($conversationId, $messageData)
 
         $enhancedContext = 'You are helping with requirements engineering and software development.';
         
-        if (!empty($kbContext)) {
-            $enhancedContext .= ' The following are relevant requirements from the project knowledge base.' . $kbContext;
+        if ($kbProjectId) {
+            $enhancedContext .= ' The project knowledge base excerpts that best match each message are provided with it.';
         } elseif (!empty($documentContext)) {
             $enhancedContext .= ' The user has uploaded documents in this conversation.' . $documentContext;
         }
@@ -471,7 +394,9 @@ function($chunk) use ($conversationId, $tempMessageId) {
                     $chunk,
                     false
                 ))->toOthers();
-            }
+            },
+            (string) $conversationId,
+            $kbProjectId
         );
 
         // Save the complete AI response
@@ -2,13 +2,16 @@
 
 namespace App\Services;
 
+use Illuminate\Support\Facades\Cache;
 use Illuminate\Support\Facades\Http;
 use Illuminate\Support\Facades\Log;
+use Illuminate\Support\Str;
 
 class LLMService
 {
     private string $baseUrl;
     private string $apiKey;
+    private ?string $requestId = null;
 
     public function __construct()
     {
@@ -24,17 +27,35 @@ private function getHeaders(): array
         return [
             'X-API-Key' => $this->apiKey,
             'Content-Type' => 'application/json',
-        ];
+        ] + $this->traceHeaders();
+    }
+
+    /**
+     * Request id sent to the LLM service with every call made through this
+     * service instance. The service logs its stage timings under the same id, and
+     * it is added to this request's log context so both sides can be matched.
+     */
+    private function traceHeaders(): array
+    {
+        if ($this->requestId === null) {
+            $this->requestId = (string) Str::uuid();
+            Log::withContext(['llm_request_id' => $this->requestId]);
+        }
+
+        return ['X-Request-ID' => $this->requestId];
     }
 
     /**
      * Extract requirements from text
+     *
+     * The service extracts long documents section by section; a response with
+     * 'partial' => true lists the chunks that failed in 'failed_chunks'.
      */
     public function extractRequirements(string $text, string $documentType = 'meeting_notes'): array
     {
         try {
             $response = Http::withHeaders($this->getHeaders())
-                ->timeout(90)
+                ->timeout($this->extractionTimeout($text))
                 ->post("{$this->baseUrl}/api/extract", [
                     'text' => $text,
                     'document_type' => $documentType,
@@ -52,15 +73,44 @@ public function extractRequirements(string $text, string $documentType = 'meetin
     }
 
     /**
-     * Chat with AI (with optional persona context)
+     * HTTP timeout for extracting a document of this size.
+     *
+     * The service runs chunks of about extract_chunk_chars characters in
+     * waves of extract_concurrency, then retries failed chunks once, so the
+     * time grows with the number of waves rather than being fixed.
      */
-    public function chat(string $message, array $history = [], ?string $context = null, ?array $personaData = null): array
+    public function extractionTimeout(string $text): int
     {
+        $chunkChars = max(1, (int) config('services.llm.extract_chunk_chars', 10000));
+        $concurrency = max(1, (int) config('services.llm.extract_concurrency', 4));
+        $chunks = max(1, (int) ceil(mb_strlen($text, 'UTF-8') / $chunkChars));
+        $waves = (int) ceil($chunks / $concurrency) + 1;
+
+        return min(
+            (int) config('services.llm.extract_max_timeout', 1200),
+            30 + $waves * (int) config('services.llm.extract_wave_seconds', 90)
+        );
+    }
+
+    /**
+     * Chat with AI (with optional persona context)
+     */
+    public function chat(
+        string $message,
+        array $history = [],
+        ?string $context = null,
+        ?array $personaData = null,
+        ?string $conversationId = null,
+        ?int $projectId = null
+    ): array {
         try {
             $payload = [
                 'message' => $message,
                 'conversation_history' => $history,
                 'context' => $context,
+                'conversation_id' => $conversationId,
+                // Retrieve from this project's knowledge base
+                'project_id' => $projectId,
             ];
             
             // Add persona data if provided
@@ -69,7 +119,7 @@ public function chat(string $message, array $history = [], ?string $context = nu
                 $payload['persona_data'] = $personaData;
             }
             
-            $response = Http::timeout(60)->post("{$this->baseUrl}/api/chat", $payload);
+            $response = $this->postChat($payload, $conversationId, 60);
 
             if ($response->successful()) {
                 return $response->json();
@@ -91,13 +141,17 @@ public function chatStream(
         array $history = [], 
         ?string $context = null, 
         ?array $personaData = null,
-        ?callable $onChunk = null
+        ?callable $onChunk = null,
+        ?string $conversationId = null,
+        ?int $projectId = null
     ): array {
         try {
             $payload = [
                 'message' => $message,
                 'conversation_history' => $history,
                 'context' => $context,
+                'conversation_id' => $conversationId,
+                'project_id' => $projectId,
             ];
             
             // Add persona data if provided
@@ -107,7 +161,7 @@ public function chatStream(
             }
             
             // Get full response from LLM
-            $response = Http::timeout(120)->post("{$this->baseUrl}/api/chat", $payload);
+            $response = $this->postChat($payload, $conversationId, 120);
 
             if ($response->successful()) {
                 $data = $response->json();
@@ -128,13 +182,76 @@ public function chatStream(
         }
     }
 
+    /**
+     * POST /api/chat, using the service's conversation session when possible.
+     *
+     * After the first turn the service returns a session_version; while it is
+     * cached, only the new message is sent, with the context replaced by its
+     * SHA-256 (the service keeps the context of the session). A 409 (session
+     * expired or stale, or the context changed) falls back to the full
+     * payload, which re-seeds the session.
+     */
+    private function postChat(array $payload, ?string $conversationId, int $timeout)
+    {
+        $cacheKey = $conversationId ? "llm_chat_session_{$conversationId}" : null;
+        $sessionVersion = $cacheKey && config('services.llm.chat_sessions', true)
+            ? Cache::get($cacheKey)
+            : null;
+
+        if ($sessionVersion) {
+            $context = $payload['context'] ?? null;
+            $response = Http::withHeaders($this->traceHeaders())->timeout($timeout)->post("{$this->baseUrl}/api/chat", [
+                'message' => $payload['message'],
+                'context_hash' => ($context !== null && $context !== '') ? hash('sha256', $context) : null,
+                'persona_id' => $payload['persona_id'] ?? null,
+                'project_id' => $payload['project_id'] ?? null,
+                'conversation_id' => $conversationId,
+                'session_version' => $sessionVersion,
+            ]);
+
+            if ($response->status() !== 409) {
+                $this->rememberChatSession($cacheKey, $response);
+                return $response;
+            }
+
+            Cache::forget($cacheKey);
+        }
+
+        $response = Http::withHeaders($this->traceHeaders())->timeout($timeout)->post("{$this->baseUrl}/api/chat", $payload);
+        $this->rememberChatSession($cacheKey, $response);
+
+        return $response;
+    }
+
+    private function rememberChatSession(?string $cacheKey, $response): void
+    {
+        if (!$cacheKey || !$response->successful()) {
+            return;
+        }
+
+        $version = $response->json('session_version');
+        if ($version) {
+            // Expire before the service's session TTL (1 hour by default)
+            Cache::put($cacheKey, $version, now()->addMinutes(50));
+        }
+    }
+
+    /**
+     * Forget the service session of a conversation (e.g. after messages were
+     * edited or deleted), so the next turn sends the full history again.
+     */
+    public function forgetChatSession(string $conversationId): void
+    {
+        Cache::forget("llm_chat_session_{$conversationId}");
+    }
+
     /**
      * Generate persona-specific view
      */
     public function generatePersonaView(string $requirementText, string $personaName, string $personaPrompt): array
     {
         try {
-            $response = Http::timeout(60)->post("{$this->baseUrl}/api/persona/generate", [
+            $response = Http::withHeaders($this->traceHeaders())->timeout(60)->post("{$this->baseUrl}/api/persona/generate", [
                 'requirement_text' => $requirementText,
                 'persona_name' => $personaName,
                 'persona_prompt' => $personaPrompt,
@@ -151,13 +268,58 @@ public function generatePersonaView(string $requirementText, string $personaName
         }
     }
 
+    /**
+     * Generate persona views for many requirements x personas in one call.
+     *
+     * @param array $requirements [['id' => 1, 'text' => '...'], ...]
+     * @param array $personas Persona profiles (as sent to chat as persona_data)
+     * @return array Views keyed by "{requirement_id}:{persona_id}", plus any errors
+     */
+    public function generatePersonaViewsBatch(array $requirements, array $personas): array
+    {
+        try {
+            $response = Http::withHeaders($this->traceHeaders())->timeout(600)->post("{$this->baseUrl}/api/persona/generate_batch", [
+                'requirements' => $requirements,
+                'personas' => $personas,
+            ]);
+
+            if (!$response->successful()) {
+                throw new \Exception('Batch persona generation failed: ' . $response->body());
+            }
+
+            // The service streams NDJSON; each line is one result
+            $views = [];
+            $errors = [];
+            $summary = null;
+            foreach (preg_split('/\r?\n/', trim($response->body())) as $line) {
+                $item = json_decode($line, true);
+                if (!is_array($item)) {
+                    continue;
+                }
+                $type = $item['type'] ?? null;
+                if ($type === 'view') {
+                    $views["{$item['requirement_id']}:{$item['persona_id']}"] = $item['persona_view'];
+                } elseif ($type === 'error') {
+                    $errors["{$item['requirement_id']}:{$item['persona_id']}"] = $item['error'];
+                } elseif ($type === 'summary') {
+                    $summary = $item;
+                }
+            }
+
+            return ['views' => $views, 'errors' => $errors, 'summary' => $summary];
+        } catch (\Exception $e) {
+            Log::error('Batch persona generation failed', ['error' => $e->getMessage()]);
+            throw $e;
+        }
+    }
+
     /**
      * Test connection to LLM service
      */
     public function testConnection(): bool
     {
         try {
-            $response = Http::timeout(10)->get("{$this->baseUrl}/health");
+            $response = Http::withHeaders($this->traceHeaders())->timeout(10)->get("{$this->baseUrl}/health");
             return $response->successful();
         } catch (\Exception $e) {
             return false;
@@ -196,6 +358,23 @@ public function buildKnowledgeBase(int $projectId, array $documents, string $mod
         }
     }
 
+    /**
+     * Ask the LLM service to load a project's KB index into its cache.
+     *
+     * @param int $projectId
+     */
+    public function prefetchKB(int $projectId): void
+    {
+        try {
+            Http::withHeaders($this->getHeaders())
+                ->timeout(5)
+                ->post("{$this->baseUrl}/kb/prefetch/{$projectId}");
+        } catch (\Exception $e) {
+            // Only a cache warm-up; the first chat message loads the KB anyway
+            Log::warning('KB prefetch failed', ['project_id' => $projectId, 'error' => $e->getMessage()]);
+        }
+    }
+
     /**
      * Query the knowledge base for relevant chunks.
      *
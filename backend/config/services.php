@@ -38,6 +38,17 @@
     'llm' => [
         'url' => env('LLM_SERVICE_URL', 'http://localhost:8000'),
         'api_key' => env('LLM_API_KEY', 'dev-secret-key-12345'),
+        // Messages sent per chat turn; the LLM service selects what fits its budget
+        'chat_history_messages' => (int) env('LLM_CHAT_HISTORY_MESSAGES', 40),
+        // Send only the new message while the service still holds the conversation
+        'chat_sessions' => (bool) env('LLM_CHAT_SESSIONS', true),
+        // Document extraction timeout: one wave of extract_concurrency chunks
+        // (about extract_chunk_chars each, matching the service's
+        // EXTRACTION_CHUNK_TOKENS / EXTRACTION_MAX_CONCURRENCY) per wave_seconds
+        'extract_chunk_chars' => (int) env('LLM_EXTRACT_CHUNK_CHARS', 10000),
+        'extract_concurrency' => (int) env('LLM_EXTRACT_CONCURRENCY', 4),
+        'extract_wave_seconds' => (int) env('LLM_EXTRACT_WAVE_SECONDS', 90),
+        'extract_max_timeout' => (int) env('LLM_EXTRACT_MAX_TIMEOUT', 1200),
     ],
 
 ];
@@ -0,0 +1,100 @@
+"""
+bench_dedupe.py
+Benchmark near-duplicate removal on synthetic embeddings.
+
+Compares the vectorized/ANN implementation in dedupe.py with the original
+pairwise Python loop (only for sizes where the loop finishes in reasonable
+time). Runs offline: no embedding model or API key is needed.
+
+Usage:
+    python bench_dedupe.py --sizes 1000 10000 100000 --output bench_dedupe.json
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+import dedupe
+
+
+def make_embeddings(n: int, dim: int, dup_ratio: float, seed: int = 42) -> np.ndarray:
+    """Random unit vectors where `dup_ratio` of the rows are noisy copies of others."""
+    rng = np.random.default_rng(seed)
+    n_dups = int(n * dup_ratio)
+    base = rng.standard_normal((n - n_dups, dim)).astype("float32")
+    sources = rng.integers(0, len(base), n_dups)
+    dups = base[sources] + 0.05 * rng.standard_normal((n_dups, dim)).astype("float32")
+    vectors = np.vstack([base, dups])
+    vectors = vectors[rng.permutation(n)]
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def legacy_remove(embeddings: np.ndarray, threshold: float):
+    """The pairwise loop previously used in main.py."""
+    sim_matrix = embeddings @ embeddings.T
+    to_keep = set(range(len(embeddings)))
+    for i in range(len(embeddings)):
+        if i not in to_keep:
+            continue
+        for j in range(i + 1, len(embeddings)):
+            if j in to_keep and sim_matrix[i, j] > threshold:
+                to_keep.discard(j)
+    return sorted(to_keep)
+
+
+def run(sizes, dim: int, dup_ratio: float, threshold: float, legacy_max: int):
+    results = []
+    for n in sizes:
+        embeddings = make_embeddings(n, dim, dup_ratio)
+        if n <= dedupe.DENSE_LIMIT:
+            path = "dense"
+        elif dedupe.faiss is not None and n > dedupe.IVF_LIMIT:
+            path = "faiss_ivf"
+        else:
+            path = "exact_blocks"
+
+        start = time.perf_counter()
+        kept, groups = dedupe.find_near_duplicates(embeddings, threshold)
+        elapsed = time.perf_counter() - start
+
+        row = {
+            "n": n,
+            "path": path,
+            "seconds": round(elapsed, 4),
+            "kept": len(kept),
+            "removed": n - len(kept),
+            "groups": len(groups),
+        }
+
+        if n <= legacy_max:
+            start = time.perf_counter()
+            legacy_kept = legacy_remove(embeddings, threshold)
+            row["legacy_seconds"] = round(time.perf_counter() - start, 4)
+            row["speedup"] = round(row["legacy_seconds"] / max(elapsed, 1e-9), 1)
+            row["matches_legacy"] = legacy_kept == kept
+
+        print(json.dumps(row))
+        results.append(row)
+    return results
+
+
+def main(args):
+    results = run(args.sizes, args.dim, args.dup_ratio, args.threshold, args.legacy_max)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"threshold": args.threshold, "dim": args.dim, "results": results}, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark near-duplicate removal')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--dim', type=int, default=384, help='Embedding dimension (MiniLM = 384)')
+    parser.add_argument('--dup-ratio', type=float, default=0.1, help='Fraction of rows that are noisy copies')
+    parser.add_argument('--threshold', type=float, default=0.95)
+    parser.add_argument('--legacy-max', type=int, default=2000, help='Largest size to also time the old loop on')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,334 @@
+"""
+bench_rag.py
+Benchmark the RagManager hot paths on the real requirements CSV and on
+synthetic corpora.
+
+Timed operations, per corpus:
+    embed_texts          batches of --embed-batch texts
+    build_faiss_index    full index build + write
+    load_index_and_meta  index read + metadata unpickle
+    incremental_add      --add-batches calls adding --add-size new chunks each
+    query                single-query embed + search (top_k=5)
+
+Each operation reports calls, throughput (items/s), p50/p99 latency per
+call and the peak RSS while it ran. Results are written as JSON; pass an
+earlier file with --compare to print p50/throughput ratios against it.
+
+Runs offline: Hugging Face downloads are disabled and no Groq key is
+needed. With --embedder auto the SentenceTransformer model is used if it
+is in the local cache, otherwise a deterministic hashing encoder of the
+same dimension stands in (the "embedder" field of the results says
+which). Corpora larger than --embed-max are embedded for a sample only;
+the remaining index vectors are perturbed copies of the sample, so index
+operations still run at full size.
+
+Usage:
+    python bench_rag.py --sizes 1000 10000 100000 --output bench_rag.json
+    python bench_rag.py --sizes 1000 --compare bench_rag.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import numpy as np
+import pandas as pd
+
+import rag
+from rag import RagManager
+
+DEFAULT_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "enriched_requirements.csv")
+
+ACTORS = ["system", "application", "administrator", "user", "mobile client", "payment service", "report engine", "API"]
+VERBS = ["shall display", "shall store", "shall encrypt", "shall export", "shall validate", "shall notify",
+         "shall synchronize", "shall archive", "shall authenticate", "shall log"]
+OBJECTS = ["customer records", "invoices", "audit events", "session tokens", "usage reports", "sensor readings",
+           "user preferences", "order history", "access requests", "backup snapshots"]
+QUALIFIERS = ["within 2 seconds", "at least once per day", "using AES-256", "for 7 years", "on every login",
+              "in under 500 ms", "for up to 10,000 concurrent users", "in CSV and PDF formats",
+              "according to GDPR", "without data loss"]
+TAGS = ["Security", "Performance", "Usability", "Compliance", "Reporting", "Storage", "Integration", "Availability"]
+STAKEHOLDERS = ["User", "Admin", "Legal", "Operations", "Finance"]
+LEVELS = ["Low", "Medium", "High"]
+ACTIONS = ["Create", "Read", "Update", "Delete", "Validate"]
+
+
+class HashingEncoder:
+    """Deterministic bag-of-words encoder with the SentenceTransformer encode() signature."""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        for row, text in enumerate(texts):
+            for token in text.lower().split():
+                out[row, zlib.crc32(token.encode("utf-8")) % self.dim] += 1.0
+        out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out
+
+
+class RssSampler:
+    """Peak resident set size while a block runs (sampled every few ms)."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+
+def current_rss() -> int:
+    """Current RSS in bytes (/proc on Linux, else the process high-water mark)."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return max_rss()
+
+
+def max_rss() -> int:
+    """Process peak RSS in bytes (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def synthetic_frame(n: int, start: int = 0, seed: int = 42) -> pd.DataFrame:
+    """Requirement rows shaped like enriched_requirements.csv, with unique texts."""
+    rng = np.random.default_rng(seed + start)
+    pick = lambda values: [values[i] for i in rng.integers(0, len(values), n)]
+    actors, verbs, objects, qualifiers = pick(ACTORS), pick(VERBS), pick(OBJECTS), pick(QUALIFIERS)
+    tags = [str([TAGS[i] for i in rng.choice(len(TAGS), 2, replace=False)]) for _ in range(n)]
+    return pd.DataFrame({
+        "label": pick(["F", "PE", "SE", "US", "LF"]),
+        "requirement": [
+            f"The {a} {v} {o} {q} (SYN-{start + i:07d})."
+            for i, (a, v, o, q) in enumerate(zip(actors, verbs, objects, qualifiers))
+        ],
+        "enriched_domain_tags": tags,
+        "enriched_stakeholder": pick(STAKEHOLDERS),
+        "enriched_complexity_level": pick(LEVELS),
+        "enriched_action_type": pick(ACTIONS),
+    })
+
+
+def load_encoder(kind: str, model_name: str, dim: int):
+    """(encoder, description) for --embedder."""
+    if kind in ("auto", "model") and rag.SentenceTransformer is not None:
+        try:
+            return rag.SentenceTransformer(model_name), f"sentence-transformers:{model_name}"
+        except Exception as e:
+            if kind == "model":
+                raise
+            print(f"Model {model_name} not available offline ({e}); using the hashing encoder")
+    elif kind == "model":
+        raise RuntimeError("sentence-transformers is not installed")
+    return HashingEncoder(dim), f"hashing:{dim}"
+
+
+def summarize(latencies: List[float], items: int, peak_rss: int) -> Dict[str, Any]:
+    total = sum(latencies)
+    return {
+        "calls": len(latencies),
+        "items": items,
+        "seconds": round(total, 4),
+        "throughput_per_s": round(items / total, 1) if total > 0 else None,
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 3),
+        "peak_rss_mb": round(peak_rss / 2 ** 20, 1),
+    }
+
+
+def timed_calls(calls: List[Callable[[], Any]]) -> Tuple[List[float], int]:
+    latencies = []
+    with RssSampler() as rss:
+        for call in calls:
+            start = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - start)
+    return latencies, rss.peak
+
+
+def index_vectors(manager: RagManager, texts: List[str], embed_max: int, seed: int = 7) -> Tuple[np.ndarray, str]:
+    """Embeddings for every text, or a sample stretched with perturbed copies above embed_max."""
+    if len(texts) <= embed_max:
+        return manager.embed_texts(texts), "embedded"
+    sample = manager.embed_texts(texts[:embed_max])
+    rng = np.random.default_rng(seed)
+    extra = sample[rng.integers(0, len(sample), len(texts) - len(sample))]
+    extra = extra + 0.05 * rng.standard_normal(extra.shape).astype("float32")
+    return np.vstack([sample, extra]).astype("float32"), "perturbed_sample"
+
+
+def bench_corpus(manager: RagManager, name: str, chunks: List[Dict[str, Any]], args, workdir: str) -> Dict[str, Any]:
+    texts = [c["text"] for c in chunks]
+    ops: Dict[str, Dict[str, Any]] = {}
+
+    # embed_texts
+    sample = texts[:args.embed_max]
+    batches = [sample[i:i + args.embed_batch] for i in range(0, len(sample), args.embed_batch)]
+    latencies, peak = timed_calls([lambda b=b: manager.embed_texts(b) for b in batches])
+    ops["embed_texts"] = summarize(latencies, len(sample), peak)
+
+    vectors, vectors_source = index_vectors(manager, texts, args.embed_max)
+    index_path = os.path.join(workdir, name, "faiss_index.bin")
+    meta_path = os.path.join(workdir, name, "faiss_meta.pkl")
+
+    # build_faiss_index (normalizes in place, so each build gets a fresh copy)
+    latencies = []
+    with RssSampler() as rss:
+        for _ in range(args.repeats):
+            copy = vectors.copy()
+            start = time.perf_counter()
+            index = manager.build_faiss_index(copy, index_path)
+            latencies.append(time.perf_counter() - start)
+            del copy
+    ops["build_faiss_index"] = summarize(latencies, len(vectors) * args.repeats, rss.peak)
+    manager.save_metadata(chunks, meta_path)
+
+    # load_index_and_meta
+    latencies, peak = timed_calls(
+        [lambda: manager.load_index_and_meta(index_path, meta_path)] * args.repeats
+    )
+    ops["load_index_and_meta"] = summarize(latencies, len(chunks) * args.repeats, peak)
+
+    # query (embedding + search of one query text, like /kb/query)
+    index, loaded_chunks = manager.load_index_and_meta(index_path, meta_path)
+    rng = np.random.default_rng(11)
+    queries = [texts[i] for i in rng.integers(0, len(texts), args.queries)]
+    latencies, peak = timed_calls(
+        [lambda q=q, index=index, loaded=loaded_chunks: manager.query(q, index, loaded, top_k=args.top_k)
+         for q in queries]
+    )
+    ops["query"] = summarize(latencies, len(queries), peak)
+    del index, loaded_chunks
+
+    # incremental_add (new unique chunks; every call reloads and rewrites the KB)
+    new_frames = [
+        synthetic_frame(args.add_size, start=10_000_000 + b * args.add_size) for b in range(args.add_batches)
+    ]
+    new_chunks = [manager.prepare_chunks(frame) for frame in new_frames]
+    latencies, peak = timed_calls([
+        lambda c=c: manager.incremental_add(index_path, meta_path, c, project_id=f"bench-{name}")
+        for c in new_chunks
+    ])
+    ops["incremental_add"] = summarize(latencies, args.add_size * args.add_batches, peak)
+
+    result = {
+        "corpus": name,
+        "chunks": len(chunks),
+        "index_vectors": vectors_source,
+        "index_mb": round(os.path.getsize(index_path) / 2 ** 20, 2),
+        "operations": ops,
+    }
+    shutil.rmtree(os.path.join(workdir, name), ignore_errors=True)
+    return result
+
+
+def corpora(manager: RagManager, args):
+    """(name, chunks) pairs: the project CSV (if present) then the synthetic sizes."""
+    if args.csv and os.path.exists(args.csv):
+        yield "enriched_requirements", manager.prepare_chunks(pd.read_csv(args.csv))
+    elif args.csv:
+        print(f"{args.csv} not found; skipping the real corpus")
+    for n in args.sizes:
+        yield f"synthetic_{n}", manager.prepare_chunks(synthetic_frame(n))
+
+
+def compare(results: Dict[str, Any], baseline_path: str):
+    """Print p50 and throughput ratios (current / baseline) per corpus and operation."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {c["corpus"]: c for c in json.load(f)["corpora"]}
+    for corpus in results["corpora"]:
+        before = baseline.get(corpus["corpus"])
+        if before is None:
+            continue
+        for op, now in corpus["operations"].items():
+            prev = before["operations"].get(op)
+            if not prev:
+                continue
+            row = {"corpus": corpus["corpus"], "op": op}
+            if prev["p50_ms"]:
+                row["p50_ratio"] = round(now["p50_ms"] / prev["p50_ms"], 2)
+            if prev["throughput_per_s"] and now["throughput_per_s"]:
+                row["throughput_ratio"] = round(now["throughput_per_s"] / prev["throughput_per_s"], 2)
+            print(json.dumps(row))
+
+
+def main(args):
+    encoder, embedder = load_encoder(args.embedder, args.model, args.dim)
+    manager = RagManager(model_name=args.model, model=encoder)
+    workdir = tempfile.mkdtemp(prefix="bench_rag_")
+    results = {
+        "embedder": embedder,
+        "faiss": getattr(rag.faiss, "__version__", None),
+        "python": platform.python_version(),
+        "settings": {
+            key: getattr(args, key)
+            for key in ("embed_batch", "embed_max", "repeats", "queries", "top_k", "add_batches", "add_size")
+        },
+        "corpora": [],
+    }
+    try:
+        for name, chunks in corpora(manager, args):
+            corpus = bench_corpus(manager, name, chunks, args, workdir)
+            print(json.dumps(corpus))
+            results["corpora"].append(corpus)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    results["max_rss_mb"] = round(max_rss() / 2 ** 20, 1)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark RagManager embedding, indexing and query paths')
+    parser.add_argument('--csv', default=DEFAULT_CSV, help='Real corpus (empty string to skip)')
+    parser.add_argument('--sizes', type=int, nargs='*', default=[1000, 10000, 100000], help='Synthetic corpus sizes (chunks)')
+    parser.add_argument('--embedder', choices=['auto', 'model', 'hash'], default='auto',
+                        help='auto: cached model if available, else hashing encoder')
+    parser.add_argument('--model', default='all-MiniLM-L6-v2', help='SentenceTransformer model name')
+    parser.add_argument('--dim', type=int, default=384, help='Hashing encoder dimension (MiniLM = 384)')
+    parser.add_argument('--embed-batch', type=int, default=32, help='Texts per embed_texts call')
+    parser.add_argument('--embed-max', type=int, default=5000, help='Texts actually embedded per corpus')
+    parser.add_argument('--repeats', type=int, default=3, help='Index builds and loads per corpus')
+    parser.add_argument('--queries', type=int, default=200, help='Queries per corpus')
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--add-batches', type=int, default=5, help='incremental_add calls per corpus')
+    parser.add_argument('--add-size', type=int, default=100, help='New chunks per incremental_add call')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    parser.add_argument('--compare', help='Earlier results JSON to compare against')
+    args = parser.parse_args()
+    main(args)
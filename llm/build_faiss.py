@@ -1,8 +1,11 @@
 import argparse
+import logging
 import os
 from typing import List, Dict, Any
 from rag import RagManager, load_csv
 
+logger = logging.getLogger(__name__)
+
 
 def build_index_for_project(project_id: str, chunks: List[Dict[str, Any]], 
                             base_dir: str = 'faiss_store', 
@@ -31,8 +34,8 @@ def build_index_for_project(project_id: str, chunks: List[Dict[str, Any]],
     rag.build_faiss_index(embs, index_path)
     rag.save_metadata(chunks, meta_path, version=1)
     
-    print(f'Project {project_id} index saved to {index_path}')
-    print(f'Project {project_id} metadata saved to {meta_path}')
+    logger.info(f'Project {project_id} index saved to {index_path}')
+    logger.info(f'Project {project_id} metadata saved to {meta_path}')
     
     return {'index_path': index_path, 'meta_path': meta_path}
 
@@ -66,8 +69,8 @@ def main(csv_path: str, out_dir: str, model_name: str = 'all-MiniLM-L6-v2', proj
         rag.build_faiss_index(embs, index_path)
         rag.save_metadata(chunks, meta_path)
         
-        print(f'Index saved to {index_path}')
-        print(f'Metadata saved to {meta_path}')
+        logger.info(f'Index saved to {index_path}')
+        logger.info(f'Metadata saved to {meta_path}')
 
 
 if __name__ == '__main__':
@@ -77,4 +80,5 @@ if __name__ == '__main__':
     parser.add_argument('--model', default='all-MiniLM-L6-v2', help='SentenceTransformer model')
     parser.add_argument('--project-id', help='Project ID for project-specific index')
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     main(args.csv, args.out, model_name=args.model, project_id=args.project_id)
@@ -0,0 +1,214 @@
+"""
+candidate_pairs.py
+kNN-based candidate pair generation for conflict detection.
+
+Instead of asking the LLM about "everything in the same cluster", build a
+k-nearest-neighbour graph over the requirement embeddings, keep the pairs
+whose similarity falls inside a band (related, but not near-duplicates),
+rank them with a cheap contradiction-likelihood score and pack only the top
+pairs into prompts. LLM cost becomes O(n·k) and is predictable up front.
+"""
+
+import re
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+
+try:
+    import faiss
+except Exception:
+    faiss = None
+
+# Above this many vectors an HNSW graph is cheaper than exact search
+HNSW_THRESHOLD = 20000
+
+_NEGATION_RE = re.compile(r"\b(not|no|never|cannot|can't|won't|shouldn't|mustn't|without|prohibit\w*|forbid\w*|disallow\w*)\b")
+_NUMBER_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(%|ms|s|sec|seconds?|minutes?|hours?|days?|mb|gb|tb|users?|requests?|times?)?", re.I)
+
+# Word pairs that usually signal opposite intents when split across two requirements
+_OPPOSITES = [
+    ("online", "offline"),
+    ("allow", "deny"),
+    ("allow", "prevent"),
+    ("enable", "disable"),
+    ("real-time", "batch"),
+    ("realtime", "batch"),
+    ("synchronous", "asynchronous"),
+    ("increase", "decrease"),
+    ("mandatory", "optional"),
+    ("required", "optional"),
+    ("public", "private"),
+    ("encrypted", "plaintext"),
+    ("automatic", "manual"),
+    ("always", "never"),
+    ("minimum", "maximum"),
+    ("before", "after"),
+    ("permanent", "temporary"),
+    ("store", "delete"),
+    ("centralized", "decentralized"),
+]
+
+
+def knn_search(embeddings: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the k nearest neighbours of every embedding (cosine / inner product).
+
+    Args:
+        embeddings: L2-normalized float matrix (n, d)
+        k: Neighbours per point (excluding the point itself)
+
+    Returns:
+        (similarities, indices), both shaped (n, k); missing neighbours are -1
+    """
+    n = len(embeddings)
+    k = max(0, min(k, n - 1))
+    if n == 0 or k == 0:
+        return np.zeros((n, 0), dtype="float32"), np.zeros((n, 0), dtype="int64")
+
+    vectors = np.ascontiguousarray(embeddings, dtype="float32")
+
+    if faiss is not None:
+        d = vectors.shape[1]
+        if n > HNSW_THRESHOLD:
+            index = faiss.IndexHNSWFlat(d, 32, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efSearch = max(64, 2 * (k + 1))
+        else:
+            index = faiss.IndexFlatIP(d)
+        index.add(vectors)
+        sims, idx = index.search(vectors, k + 1)
+    else:
+        # Blockwise exact search keeps memory at block_size x n
+        block_size = 1024
+        sims = np.empty((n, k + 1), dtype="float32")
+        idx = np.empty((n, k + 1), dtype="int64")
+        for start in range(0, n, block_size):
+            block = vectors[start:start + block_size] @ vectors.T
+            top = np.argpartition(-block, k, axis=1)[:, :k + 1]
+            top_sims = np.take_along_axis(block, top, axis=1)
+            order = np.argsort(-top_sims, axis=1)
+            idx[start:start + block_size] = np.take_along_axis(top, order, axis=1)
+            sims[start:start + block_size] = np.take_along_axis(top_sims, order, axis=1)
+
+    # Drop the self-match (usually column 0, but ties can move it)
+    out_sims = np.full((n, k), -1.0, dtype="float32")
+    out_idx = np.full((n, k), -1, dtype="int64")
+    for i in range(n):
+        row = [(s, j) for s, j in zip(sims[i], idx[i]) if j != i and j >= 0][:k]
+        for c, (s, j) in enumerate(row):
+            out_sims[i, c] = s
+            out_idx[i, c] = j
+    return out_sims, out_idx
+
+
+def contradiction_score(text_a: str, text_b: str, similarity: float) -> float:
+    """
+    Cheap likelihood that two related requirements contradict each other.
+
+    Starts from the embedding similarity (related topics) and boosts pairs
+    with a negation mismatch, opposite keywords or differing numbers for the
+    same unit.
+    """
+    a, b = text_a.lower(), text_b.lower()
+    boost = 0.0
+
+    if bool(_NEGATION_RE.search(a)) != bool(_NEGATION_RE.search(b)):
+        boost += 0.5
+
+    for left, right in _OPPOSITES:
+        if (left in a and right in b and right not in a) or (right in a and left in b and left not in a):
+            boost += 0.4
+            break
+
+    nums_a = {(unit or "").lower(): value for value, unit in _NUMBER_RE.findall(a)}
+    nums_b = {(unit or "").lower(): value for value, unit in _NUMBER_RE.findall(b)}
+    shared_units = set(nums_a) & set(nums_b)
+    if any(nums_a[u] != nums_b[u] for u in shared_units):
+        boost += 0.3
+
+    return float(similarity) * (1.0 + boost)
+
+
+def generate_candidate_pairs(
+    embeddings: np.ndarray,
+    texts: List[str],
+    k: int = 10,
+    min_similarity: float = 0.45,
+    max_similarity: float = 0.95,
+    max_pairs_per_requirement: int = 5,
+) -> List[Dict]:
+    """
+    Build ranked candidate pairs from a kNN graph.
+
+    Args:
+        embeddings: L2-normalized embeddings (n, d)
+        texts: Requirement texts aligned with embeddings
+        k: Neighbours searched per requirement
+        min_similarity: Pairs below this are unrelated and skipped
+        max_similarity: Pairs above this are near-duplicates and skipped
+        max_pairs_per_requirement: Budget; total pairs <= n * this / 2
+
+    Returns:
+        List of {i, j, similarity, score} dicts (i < j), best score first
+    """
+    sims, idx = knn_search(embeddings, k)
+
+    pairs: Dict[Tuple[int, int], Dict] = {}
+    for i in range(len(texts)):
+        for s, j in zip(sims[i], idx[i]):
+            if j < 0 or not (min_similarity <= s <= max_similarity):
+                continue
+            key = (min(i, int(j)), max(i, int(j)))
+            if key in pairs:
+                continue
+            pairs[key] = {
+                "i": key[0],
+                "j": key[1],
+                "similarity": float(s),
+                "score": contradiction_score(texts[key[0]], texts[key[1]], s),
+            }
+
+    ranked = sorted(pairs.values(), key=lambda p: p["score"], reverse=True)
+    budget = max(1, (len(texts) * max_pairs_per_requirement) // 2)
+    return ranked[:budget]
+
+
+def pack_pairs(
+    pairs: List[Dict], max_requirements: int = 30, max_pairs: int = 40
+) -> List[Dict]:
+    """
+    Pack pairs into prompts without exceeding a requirement or pair count.
+
+    A pair goes into an open prompt that already holds one of its
+    requirements if it fits there, otherwise into the prompt being filled,
+    otherwise into a new one, so pairs sharing requirements tend to share
+    prompts. Open prompts are indexed by requirement row, so each pair looks
+    at no more than three prompts: O(pairs) overall.
+
+    Returns:
+        List of {"rows": [row, ...], "pairs": [(i, j), ...]} prompt specs
+    """
+    batches: List[Dict] = []
+    by_row: Dict[int, int] = {}  # row -> latest prompt holding it
+    filling = -1
+
+    for pair in pairs:
+        i, j = pair["i"], pair["j"]
+        target = -1
+        for candidate in (by_row.get(i, -1), by_row.get(j, -1), filling):
+            if candidate < 0:
+                continue
+            batch = batches[candidate]
+            rows: Set[int] = batch["row_set"]
+            needed = (i not in rows) + (j not in rows)
+            if len(batch["pairs"]) < max_pairs and len(rows) + needed <= max_requirements:
+                target = candidate
+                break
+        if target < 0:
+            batches.append({"row_set": set(), "pairs": []})
+            target = filling = len(batches) - 1
+        batch = batches[target]
+        batch["row_set"].update((i, j))
+        batch["pairs"].append((i, j))
+        by_row[i] = by_row[j] = target
+
+    return [{"rows": sorted(b["row_set"]), "pairs": b["pairs"]} for b in batches]
@@ -0,0 +1,144 @@
+"""
+chat_history.py
+Relevance-based selection of conversation history for the chat prompt.
+
+Instead of a fixed last-N window, the prompt gets the last few turns plus
+the earlier turns most similar to the new message, so a detail from 30
+turns ago can still reach the model. Turn embeddings are cached per
+conversation by message hash, so each turn is embedded once no matter how
+often the client resends the history.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+
+def turn_hash(role: str, content: str) -> str:
+    """Stable key of one conversation turn."""
+    return hashlib.sha256(f"{role}\n{content}".encode("utf-8")).hexdigest()
+
+
+def conversation_key(conversation_id: Optional[str], history: List[Dict[str, str]]) -> str:
+    """Cache key of a conversation; falls back to the hash of its first turn."""
+    if conversation_id:
+        return str(conversation_id)
+    first = history[0] if history else {"role": "", "content": ""}
+    return "first:" + turn_hash(first["role"], first["content"])
+
+
+class TurnEmbeddingCache:
+    """
+    LRU of per-conversation turn embeddings.
+
+    Args:
+        max_conversations: Conversations kept (least recently used go first)
+        max_turns: Embeddings kept per conversation
+    """
+
+    def __init__(self, max_conversations: int = 256, max_turns: int = 2000):
+        self.max_conversations = max_conversations
+        self.max_turns = max_turns
+        self._conversations: "OrderedDict[str, OrderedDict[str, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def embed(
+        self,
+        key: str,
+        turns: List[Dict[str, str]],
+        encode: Callable[[List[str]], np.ndarray],
+    ) -> np.ndarray:
+        """
+        Embeddings for `turns`, encoding only turns not seen before.
+
+        Args:
+            key: Conversation key (see conversation_key)
+            turns: {"role", "content"} dicts
+            encode: Batch encoder returning L2-normalized rows
+
+        Returns:
+            (len(turns), dim) array
+        """
+        hashes = [turn_hash(t["role"], t["content"]) for t in turns]
+        with self._lock:
+            cached = self._conversations.get(key)
+            if cached is None:
+                cached = self._conversations[key] = OrderedDict()
+            self._conversations.move_to_end(key)
+            vectors = {i: cached[h] for i, h in enumerate(hashes) if h in cached}
+            missing = [i for i in range(len(turns)) if i not in vectors]
+            self.hits += len(vectors)
+            self.misses += len(missing)
+
+        # Encode outside the lock; a concurrent request may duplicate work, which is harmless
+        if missing:
+            encoded = np.asarray(encode([turns[i]["content"] for i in missing]), dtype="float32")
+            with self._lock:
+                for i, vector in zip(missing, encoded):
+                    vectors[i] = cached[hashes[i]] = vector
+                while len(cached) > self.max_turns:
+                    cached.popitem(last=False)
+                while len(self._conversations) > self.max_conversations:
+                    self._conversations.popitem(last=False)
+
+        return np.vstack([vectors[i] for i in range(len(turns))])
+
+    def forget(self, key: str):
+        """Drop a conversation's embeddings."""
+        with self._lock:
+            self._conversations.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "conversations": len(self._conversations),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def select_turns(
+    turn_embeddings: np.ndarray,
+    query_embedding: np.ndarray,
+    roles: List[str],
+    relevant: int = 6,
+    recent: int = 6,
+) -> List[int]:
+    """
+    Choose which history turns go into the prompt, in priority order.
+
+    The last `recent` turns come first (newest first), then the `relevant`
+    earlier turns most similar to the query. A relevant user turn brings its
+    assistant reply along (and vice versa) so exchanges are not cut in half.
+
+    Returns:
+        Turn indices in the order they should be admitted to the prompt
+    """
+    n = len(turn_embeddings)
+    recent_start = max(0, n - recent)
+    order = list(range(n - 1, recent_start - 1, -1))
+    if recent_start == 0 or relevant <= 0:
+        return order
+
+    scores = turn_embeddings[:recent_start] @ query_embedding
+    chosen = set(order)
+    picked = 0
+    for i in np.argsort(-scores).tolist():
+        if picked >= relevant:
+            break
+        if i in chosen:
+            continue
+        partner = i + 1 if roles[i] == "user" else i - 1
+        members = [i]
+        if 0 <= partner < recent_start and partner not in chosen and roles[partner] != roles[i]:
+            members.append(partner)
+        for m in sorted(members):
+            order.append(m)
+            chosen.add(m)
+        picked += 1
+    return order
@@ -0,0 +1,186 @@
+"""
+chat_prompt.py
+Token-budgeted prompt assembly for the chat endpoint.
+
+The prompt is filled in priority order until the context budget is used up:
+
+1. system prompt (with persona) and the user's message - always included;
+   the optional project context is truncated if these alone overflow
+2. retrieved RAG chunks, best score first, after dropping near-identical ones
+3. the rolling summary of older turns, if any
+4. conversation history, newest turn first (or in a given priority order,
+   e.g. recent turns and then the most relevant older ones)
+
+Token counts come from the local tokenizer (token_utils), and the final
+per-section breakdown is returned alongside the messages.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from token_utils import count_tokens, truncate_to_tokens
+
+# Role markers and separators the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+RAG_HEADER = "Use the following retrieved context when helpful (do not fabricate answers):\n"
+RAG_FOOTER = "\nIf the context does not contain the answer, say so explicitly."
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+_WORD_RE = re.compile(r"\w+")
+
+
+@dataclass
+class ChatPrompt:
+    """Assembled messages plus the token breakdown by section."""
+    messages: List[Dict[str, str]]
+    breakdown: Dict[str, int] = field(default_factory=dict)
+
+
+def message_tokens(content: str) -> int:
+    """Estimated prompt tokens of one chat message."""
+    return count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _rag_line(position: int, chunk: Dict[str, Any]) -> str:
+    # include score for debugging usefulness
+    return f"{position}. {chunk.get('text', '')} (score: {chunk.get('score', 0.0):.4f})"
+
+
+def format_rag_context(chunks: List[Dict[str, Any]]) -> str:
+    """Format retrieved chunks into a single system message string."""
+    if not chunks:
+        return ""
+    lines = [RAG_HEADER]
+    lines.extend(_rag_line(i, chunk) for i, chunk in enumerate(chunks, start=1))
+    lines.append(RAG_FOOTER)
+    return "\n".join(lines)
+
+
+def dedupe_chunks(chunks: List[Dict[str, Any]], threshold: float = 0.9) -> List[Dict[str, Any]]:
+    """
+    Drop retrieved chunks that are near-identical to a better-ranked one.
+
+    Similarity is the Jaccard overlap of the chunks' word sets, which catches
+    the same passage indexed twice (e.g. from overlapping document chunks)
+    without another embedding call.
+    """
+    kept: List[Dict[str, Any]] = []
+    kept_words: List[set] = []
+    for chunk in chunks:
+        words = set(_WORD_RE.findall(str(chunk.get("text", "")).lower()))
+        duplicate = False
+        for other in kept_words:
+            union = len(words | other)
+            if union == 0 or len(words & other) / union >= threshold:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(chunk)
+            kept_words.append(words)
+    return kept
+
+
+def assemble_chat_prompt(
+    system_prompt: str,
+    message: str,
+    history: Optional[List[Dict[str, str]]] = None,
+    rag_chunks: Optional[List[Dict[str, Any]]] = None,
+    context: Optional[str] = None,
+    history_order: Optional[List[int]] = None,
+    summary: Optional[str] = None,
+    budget: int = 6000,
+    dedupe_threshold: float = 0.9,
+) -> ChatPrompt:
+    """
+    Build the chat messages within a prompt token budget.
+
+    Args:
+        system_prompt: System prompt including any persona section
+        message: The user's new message
+        history: Earlier turns as {"role", "content"} dicts, oldest first
+        rag_chunks: Retrieved chunks ({"text", "score", ...}), best first
+        context: Optional project context (sent as a system message)
+        history_order: History indices in the order they should be admitted;
+            unlisted turns are left out. Default: newest first, stopping at
+            the first turn that does not fit
+        summary: Summary of turns before `history` (sent as a system message)
+        budget: Maximum prompt tokens (the response budget is separate)
+        dedupe_threshold: Word-overlap ratio above which chunks are duplicates
+
+    Returns:
+        ChatPrompt with messages in the order system, RAG, context, summary,
+        history, message and a breakdown of tokens per section
+    """
+    history = history or []
+    rag_chunks = rag_chunks or []
+    breakdown = {
+        "budget": budget,
+        "system": message_tokens(system_prompt),
+        "message": message_tokens(message),
+    }
+    remaining = budget - breakdown["system"] - breakdown["message"]
+
+    # Tier 1: project context belongs with the system prompt; only it may be cut
+    context_message = None
+    if context:
+        context_message = f"Project Context: {context}"
+        if message_tokens(context_message) > remaining:
+            context_message = truncate_to_tokens(context_message, remaining - MESSAGE_OVERHEAD_TOKENS) or None
+    breakdown["context"] = message_tokens(context_message) if context_message else 0
+    remaining -= breakdown["context"]
+
+    # Tier 2: retrieved chunks, skipping any that no longer fit
+    unique_chunks = dedupe_chunks(rag_chunks, dedupe_threshold)
+    selected_chunks: List[Dict[str, Any]] = []
+    rag_used = message_tokens(RAG_HEADER + RAG_FOOTER)
+    for chunk in unique_chunks:
+        size = count_tokens(_rag_line(len(selected_chunks) + 1, chunk)) + 1
+        if rag_used + size <= remaining:
+            selected_chunks.append(chunk)
+            rag_used += size
+    rag_message = format_rag_context(selected_chunks)
+    breakdown["rag"] = message_tokens(rag_message) if rag_message else 0
+    breakdown["rag_chunks"] = len(selected_chunks)
+    breakdown["rag_duplicates_removed"] = len(rag_chunks) - len(unique_chunks)
+    breakdown["rag_chunks_dropped"] = len(unique_chunks) - len(selected_chunks)
+    remaining -= breakdown["rag"]
+
+    # Tier 3: summary of older turns, dropped whole if it does not fit
+    summary_message = f"{SUMMARY_PREFIX}{summary}" if summary else None
+    if summary_message and message_tokens(summary_message) > remaining:
+        summary_message = None
+    breakdown["summary"] = message_tokens(summary_message) if summary_message else 0
+    remaining -= breakdown["summary"]
+
+    # Tier 4: history turns in priority order; output stays chronological
+    selected: List[int] = []
+    history_used = 0
+    for i in (history_order if history_order is not None else range(len(history) - 1, -1, -1)):
+        size = message_tokens(history[i]["content"])
+        if history_used + size > remaining:
+            if history_order is None:
+                break
+            continue
+        selected.append(i)
+        history_used += size
+    turns = [history[i] for i in sorted(selected)]
+    breakdown["history"] = history_used
+    breakdown["history_messages"] = len(turns)
+    breakdown["history_messages_dropped"] = len(history) - len(turns)
+
+    messages = [{"role": "system", "content": system_prompt}]
+    if rag_message:
+        messages.append({"role": "system", "content": rag_message})
+    if context_message:
+        messages.append({"role": "system", "content": context_message})
+    if summary_message:
+        messages.append({"role": "system", "content": summary_message})
+    messages.extend({"role": turn["role"], "content": turn["content"]} for turn in turns)
+    messages.append({"role": "user", "content": message})
+
+    breakdown["total"] = (
+        breakdown["system"] + breakdown["context"] + breakdown["rag"]
+        + breakdown["summary"] + breakdown["history"] + breakdown["message"]
+    )
+    return ChatPrompt(messages=messages, breakdown=breakdown)
@@ -0,0 +1,147 @@
+"""
+chat_sessions.py
+Server-side chat sessions for the delta protocol of /api/chat.
+
+A session holds a conversation's history, its compiled system prompt, its
+context and recent retrieval results, so after the first turn the client
+only sends the new message, the session version it got back last time and
+the hash of its (unchanged) context. A missing,
+expired or out-of-date session is reported to the caller, who then resends
+the full history to re-seed it.
+
+Sessions expire after a TTL and the least recently used ones are evicted
+first once the store is full.
+"""
+
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+
+def context_hash(context: Optional[str]) -> Optional[str]:
+    """SHA-256 hex digest of a chat context, as the client computes it (None if empty)."""
+    if not context:
+        return None
+    return hashlib.sha256(context.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class ChatSession:
+    """State of one conversation between turns."""
+    conversation_id: str
+    history: List[Dict[str, str]] = field(default_factory=list)
+    system_prompt: Optional[str] = None
+    persona_id: Optional[int] = None
+    # Context of the last turn (e.g. uploaded documents) and its hash
+    context: Optional[str] = None
+    context_hash: Optional[str] = None
+    # message hash -> retrieved RAG chunks, most recent last
+    retrieval: "OrderedDict[str, List[Dict[str, Any]]]" = field(default_factory=OrderedDict)
+    version: str = ""
+    updated_at: float = field(default_factory=time.time)
+
+
+class ChatSessionStore:
+    """
+    TTL + LRU store of chat sessions keyed by conversation id.
+
+    Args:
+        ttl_seconds: Idle time after which a session expires
+        max_sessions: Sessions kept (least recently used go first)
+        max_turns: History turns kept per session (oldest are dropped)
+        max_retrievals: Retrieval results kept per session
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = 3600,
+        max_sessions: int = 1024,
+        max_turns: int = 200,
+        max_retrievals: int = 8,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.max_retrievals = max_retrievals
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id: str, version: Optional[str] = None) -> Optional[ChatSession]:
+        """
+        Live session for a conversation, or None.
+
+        With `version`, a session whose version differs (another turn was
+        recorded in between) also counts as missing.
+        """
+        with self._lock:
+            session = self._sessions.get(conversation_id)
+            if session is None:
+                return None
+            if time.time() - session.updated_at > self.ttl_seconds:
+                del self._sessions[conversation_id]
+                return None
+            if version is not None and session.version != version:
+                return None
+            self._sessions.move_to_end(conversation_id)
+            return session
+
+    def record_turn(
+        self,
+        conversation_id: str,
+        history: List[Dict[str, str]],
+        system_prompt: Optional[str],
+        persona_id: Optional[int],
+        retrieval: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+        context: Optional[str] = None,
+    ) -> ChatSession:
+        """
+        Store the conversation state after a turn and issue a new version.
+
+        Args:
+            conversation_id: Conversation the session belongs to
+            history: Full history including the turn just answered
+            system_prompt: Compiled system prompt (with persona)
+            persona_id: Persona the system prompt was compiled for
+            retrieval: Retrieval results to remember, by message hash
+            context: Context the turn was answered with
+
+        Returns:
+            The updated session
+        """
+        with self._lock:
+            session = self._sessions.get(conversation_id) or ChatSession(conversation_id)
+            session.history = list(history[-self.max_turns:])
+            session.system_prompt = system_prompt
+            session.persona_id = persona_id
+            session.context = context
+            session.context_hash = context_hash(context)
+            for key, chunks in (retrieval or {}).items():
+                session.retrieval[key] = chunks
+                session.retrieval.move_to_end(key)
+            while len(session.retrieval) > self.max_retrievals:
+                session.retrieval.popitem(last=False)
+            session.version = uuid.uuid4().hex[:16]
+            session.updated_at = time.time()
+            self._sessions[conversation_id] = session
+            self._sessions.move_to_end(conversation_id)
+            self._evict()
+            return session
+
+    def drop(self, conversation_id: str):
+        """Forget a conversation's session."""
+        with self._lock:
+            self._sessions.pop(conversation_id, None)
+
+    def _evict(self):
+        now = time.time()
+        for key in [k for k, s in self._sessions.items() if now - s.updated_at > self.ttl_seconds]:
+            del self._sessions[key]
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
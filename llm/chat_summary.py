@@ -0,0 +1,191 @@
+"""
+chat_summary.py
+Rolling per-conversation summaries, maintained off the request path.
+
+Once a conversation's history grows past a token threshold, older turns
+are folded into a running summary by a cheap background LLM call. The chat
+prompt then uses the summary plus the turns it does not cover yet. A
+request never waits for summarization: it uses whatever valid summary
+exists (possibly none) and at most schedules the next fold.
+
+A summary is stored with the hashes of the turns it covers. Clients send
+sliding windows (Laravel keeps the last 40 messages, server-side sessions
+trim to their own limit), so the incoming history may start part-way into
+the covered turns. The summary stays valid as long as the history begins
+with an unchanged tail of the covered turns; only an edited covered turn
+(or a history that no longer overlaps them) invalidates it.
+"""
+
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from chat_history import turn_hash
+from token_utils import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# summarize(previous_summary, turns) -> new summary
+Summarizer = Callable[[str, List[Dict[str, str]]], Awaitable[str]]
+
+
+def _turn_hashes(turns: List[Dict[str, str]]) -> List[str]:
+    return [turn_hash(turn["role"], turn["content"]) for turn in turns]
+
+
+@dataclass
+class SummaryEntry:
+    summary: str
+    # turn hashes of the newest covered turns, oldest first
+    covered_hashes: Tuple[str, ...]
+
+
+def covered_prefix(covered_hashes: Tuple[str, ...], history_hashes: List[str]) -> int:
+    """
+    Number of leading history turns that are covered turns.
+
+    The history may start anywhere inside the covered turns (older ones were
+    trimmed by the client); its first turns must then equal the rest of them.
+    The longest such overlap wins. Returns -1 if there is none.
+    """
+    if not history_hashes:
+        return -1
+    first = history_hashes[0]
+    for offset, covered in enumerate(covered_hashes):
+        if covered != first:
+            continue
+        overlap = len(covered_hashes) - offset
+        if overlap <= len(history_hashes) and list(covered_hashes[offset:]) == history_hashes[:overlap]:
+            return overlap
+    return -1
+
+
+class RollingSummaries:
+    """
+    Summary cache plus background folding.
+
+    Args:
+        summarize: Async callable folding turns into a previous summary
+        trigger_tokens: History size above which older turns get summarized
+        keep_recent: Newest turns that are never folded
+        fold_tokens: Maximum tokens of turns folded by one background call
+        max_conversations: Conversations kept (least recently used go first)
+        max_anchor_turns: Covered turn hashes kept per conversation; histories
+            starting before the newest this many covered turns get a new summary
+    """
+
+    def __init__(
+        self,
+        summarize: Summarizer,
+        trigger_tokens: int = 3000,
+        keep_recent: int = 6,
+        fold_tokens: int = 6000,
+        max_conversations: int = 512,
+        max_anchor_turns: int = 512,
+    ):
+        self.summarize = summarize
+        self.trigger_tokens = trigger_tokens
+        self.keep_recent = keep_recent
+        self.fold_tokens = fold_tokens
+        self.max_conversations = max_conversations
+        self.max_anchor_turns = max_anchor_turns
+        self._entries: "OrderedDict[str, SummaryEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._running: Dict[str, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.folds = 0
+        self.failures = 0
+
+    def get(self, key: str, history: List[Dict[str, str]]) -> Tuple[Optional[str], int]:
+        """
+        Valid summary for this history.
+
+        Returns:
+            (summary, number of leading turns it covers), or (None, 0)
+        """
+        entry, covered = self._lookup(key, _turn_hashes(history))
+        if entry is None:
+            return None, 0
+        return entry.summary, covered
+
+    def _lookup(self, key: str, history_hashes: List[str]) -> Tuple[Optional[SummaryEntry], int]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, 0
+            self._entries.move_to_end(key)
+        covered = covered_prefix(entry.covered_hashes, history_hashes)
+        if covered < 0:
+            return None, 0
+        return entry, covered
+
+    def schedule(self, key: str, history: List[Dict[str, str]]) -> bool:
+        """
+        Start a background fold if the history needs one (event loop only).
+
+        Returns:
+            True if a fold was started
+        """
+        if key in self._running:
+            return False
+        foldable_end = len(history) - self.keep_recent
+        if foldable_end <= 0:
+            return False
+        if sum(count_tokens(turn["content"]) for turn in history) <= self.trigger_tokens:
+            return False
+
+        history_hashes = _turn_hashes(history)
+        entry, covered = self._lookup(key, history_hashes)
+        if covered >= foldable_end:
+            return False
+
+        # Fold the next slice of uncovered turns, bounded by fold_tokens
+        end, used = covered, 0
+        while end < foldable_end:
+            size = count_tokens(history[end]["content"])
+            if end > covered and used + size > self.fold_tokens:
+                break
+            used += size
+            end += 1
+
+        # The new summary covers the old covered turns plus the folded ones
+        base = entry.covered_hashes if entry is not None else ()
+        anchor = (base + tuple(history_hashes[covered:end]))[-self.max_anchor_turns:]
+        task = asyncio.get_running_loop().create_task(
+            self._fold(key, entry.summary if entry is not None else "", list(history[covered:end]), anchor)
+        )
+        self._running[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _fold(self, key: str, previous: str, turns: List[Dict[str, str]], covered_hashes: Tuple[str, ...]):
+        try:
+            summary = await self.summarize(previous, turns)
+            if not summary:
+                return
+            entry = SummaryEntry(summary=summary, covered_hashes=covered_hashes)
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_conversations:
+                    self._entries.popitem(last=False)
+            self.folds += 1
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"Conversation summary failed: {e}")
+        finally:
+            self._running.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            cached = len(self._entries)
+        return {
+            "conversations": cached,
+            "running": len(self._running),
+            "folds": self.folds,
+            "failures": self.failures,
+        }
@@ -0,0 +1,345 @@
+"""
+clustering.py
+Pluggable clustering stage for conflict detection.
+
+Backends:
+    hdbscan      HDBSCAN over all embeddings (the original behaviour)
+    partitioned  FAISS k-means coarse partition, HDBSCAN inside each partition;
+                 used automatically for very large inputs
+    leader       NumPy-only leader clustering; used when hdbscan is not installed
+
+Embeddings can optionally be reduced with a linear projection (PCA via SVD)
+before clustering. The fitted ClusterModel is kept so new requirements can be
+assigned to existing clusters in incremental runs.
+"""
+
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from metrics import CLUSTERING_SECONDS
+from tracing import record
+
+try:
+    import hdbscan
+except ImportError:
+    hdbscan = None
+
+try:
+    import faiss
+except Exception:
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+# Above this many rows the "auto" backend partitions before running HDBSCAN
+PARTITION_THRESHOLD = int(os.getenv("CONFLICT_PARTITION_THRESHOLD", "20000"))
+# Target rows per coarse partition
+PARTITION_SIZE = int(os.getenv("CONFLICT_PARTITION_SIZE", "5000"))
+# Rows used to fit the PCA projection
+PCA_SAMPLE = 10000
+# Cosine similarity needed to join a leader (fallback backend) or a centroid
+LEADER_SIMILARITY = 0.6
+# Noise points are searched in batches of this size when reassigning them
+REASSIGN_BATCH_SIZE = 4096
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class LinearReducer:
+    """PCA projection fitted with an SVD; outputs are re-normalized so euclidean ~ cosine."""
+
+    def __init__(self, n_components: int):
+        self.n_components = n_components
+        self.mean: Optional[np.ndarray] = None
+        self.components: Optional[np.ndarray] = None
+
+    def fit(self, embeddings: np.ndarray) -> "LinearReducer":
+        sample = embeddings
+        if len(embeddings) > PCA_SAMPLE:
+            rows = np.random.default_rng(0).choice(len(embeddings), PCA_SAMPLE, replace=False)
+            sample = embeddings[rows]
+        self.mean = sample.mean(axis=0)
+        _, _, vt = np.linalg.svd(sample - self.mean, full_matrices=False)
+        self.components = vt[:self.n_components].astype("float32")
+        return self
+
+    def transform(self, embeddings: np.ndarray) -> np.ndarray:
+        projected = (embeddings - self.mean) @ self.components.T
+        return np.ascontiguousarray(_normalize(projected), dtype="float32")
+
+
+@dataclass
+class ClusterModel:
+    """
+    Everything needed to assign new embeddings to the clusters of a run.
+
+    `clusterer` is a fitted hdbscan.HDBSCAN (prediction_data=True) for the
+    hdbscan backend; other backends fall back to the nearest cluster centroid.
+    """
+    backend: str
+    reducer: Optional[LinearReducer] = None
+    clusterer: Any = None
+    centroids: Optional[np.ndarray] = None
+    centroid_labels: Optional[np.ndarray] = None
+    min_similarity: float = LEADER_SIMILARITY
+
+    def predict(self, embeddings: np.ndarray) -> np.ndarray:
+        """Cluster label for each new embedding (-1 = noise)."""
+        vectors = self.reducer.transform(embeddings) if self.reducer is not None else embeddings
+        if self.clusterer is not None and hdbscan is not None:
+            labels, _ = hdbscan.approximate_predict(self.clusterer, vectors)
+            return np.asarray(labels)
+        if self.centroids is None or len(self.centroids) == 0:
+            return np.full(len(vectors), -1)
+        sims = _normalize(np.asarray(vectors, dtype="float32")) @ self.centroids.T
+        best = sims.argmax(axis=1)
+        return np.where(
+            sims[np.arange(len(vectors)), best] >= self.min_similarity,
+            self.centroid_labels[best],
+            -1,
+        )
+
+
+@dataclass
+class ClusteringResult:
+    labels: np.ndarray
+    model: ClusterModel
+    backend: str
+    seconds: float
+    reduced_dims: Optional[int] = None
+    partitions: int = 1
+
+    @property
+    def n_clusters(self) -> int:
+        return len(set(self.labels.tolist()) - {-1})
+
+    @property
+    def n_noise(self) -> int:
+        return int((self.labels == -1).sum())
+
+    @property
+    def noise_ratio(self) -> float:
+        return self.n_noise / len(self.labels) if len(self.labels) else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        """Timing and quality figures for API responses and logs."""
+        return {
+            "backend": self.backend,
+            "seconds": round(self.seconds, 3),
+            "clusters": self.n_clusters,
+            "noise": self.n_noise,
+            "noise_ratio": round(self.noise_ratio, 4),
+            "reduced_dims": self.reduced_dims,
+            "partitions": self.partitions,
+        }
+
+
+def predict_labels(model: Any, embeddings: np.ndarray) -> np.ndarray:
+    """
+    Assign new embeddings to the clusters of a stored model.
+
+    Accepts a ClusterModel or, for states saved before it existed, a raw
+    fitted hdbscan.HDBSCAN.
+    """
+    if isinstance(model, ClusterModel):
+        return model.predict(embeddings)
+    labels, _ = hdbscan.approximate_predict(model, embeddings)
+    return np.asarray(labels)
+
+
+def _centroids(embeddings: np.ndarray, labels: np.ndarray):
+    cluster_ids = np.array(sorted(set(labels.tolist()) - {-1}), dtype=labels.dtype)
+    if len(cluster_ids) == 0:
+        return np.zeros((0, embeddings.shape[1]), dtype="float32"), cluster_ids
+    centroids = np.stack([embeddings[labels == c].mean(axis=0) for c in cluster_ids])
+    return _normalize(centroids).astype("float32"), cluster_ids
+
+
+def _hdbscan(embeddings: np.ndarray, min_cluster_size: int, n_jobs: int, prediction_data: bool):
+    clusterer = hdbscan.HDBSCAN(
+        min_cluster_size=min_cluster_size,
+        min_samples=1,  # More lenient - allows single points to join clusters
+        metric='euclidean',
+        cluster_selection_method='eom',
+        prediction_data=prediction_data,  # enables approximate_predict for incremental runs
+        allow_single_cluster=False,
+        core_dist_n_jobs=n_jobs,
+    )
+    return clusterer, np.asarray(clusterer.fit_predict(embeddings))
+
+
+def _coarse_partition(embeddings: np.ndarray, n_partitions: int) -> np.ndarray:
+    d = embeddings.shape[1]
+    kmeans = faiss.Kmeans(d, n_partitions, niter=20, seed=0, spherical=True,
+                          max_points_per_centroid=256)
+    kmeans.train(embeddings)
+    _, assignment = kmeans.index.search(embeddings, 1)
+    return assignment[:, 0]
+
+
+def _partitioned(embeddings: np.ndarray, min_cluster_size: int, n_jobs: int):
+    n_partitions = max(2, int(np.ceil(len(embeddings) / PARTITION_SIZE)))
+    assignment = _coarse_partition(embeddings, n_partitions)
+
+    labels = np.full(len(embeddings), -1, dtype=np.int64)
+    offset = 0
+    for p in range(n_partitions):
+        rows = np.flatnonzero(assignment == p)
+        if len(rows) < max(2, min_cluster_size):
+            continue
+        _, part_labels = _hdbscan(embeddings[rows], min_cluster_size, n_jobs, prediction_data=False)
+        clustered = part_labels != -1
+        labels[rows[clustered]] = part_labels[clustered] + offset
+        if clustered.any():
+            offset += int(part_labels.max()) + 1
+    return labels, n_partitions
+
+
+def _leader(embeddings: np.ndarray, min_cluster_size: int, min_similarity: float) -> np.ndarray:
+    """Each point joins the most similar leader above `min_similarity` or becomes a leader."""
+    vectors = _normalize(np.asarray(embeddings, dtype="float32"))
+    leaders = np.empty_like(vectors)
+    n_leaders = 0
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for i, vector in enumerate(vectors):
+        if n_leaders:
+            sims = leaders[:n_leaders] @ vector
+            best = int(sims.argmax())
+            if sims[best] >= min_similarity:
+                assignment[i] = best
+                continue
+        assignment[i] = n_leaders
+        leaders[n_leaders] = vector
+        n_leaders += 1
+
+    # Groups smaller than min_cluster_size are noise; relabel the rest 0..k-1
+    sizes = np.bincount(assignment)
+    keep = np.flatnonzero(sizes >= min_cluster_size)
+    remap = np.full(len(sizes), -1, dtype=np.int64)
+    remap[keep] = np.arange(len(keep))
+    return remap[assignment]
+
+
+def cluster_embeddings(
+    embeddings: np.ndarray,
+    min_cluster_size: int = 2,
+    backend: str = "auto",
+    reduce_dims: Optional[int] = None,
+    n_jobs: int = -1,
+) -> ClusteringResult:
+    """
+    Cluster L2-normalized embeddings.
+
+    Args:
+        embeddings: Requirement embeddings (n, d)
+        min_cluster_size: Smallest group reported as a cluster
+        backend: "auto", "hdbscan", "partitioned" or "leader"
+        reduce_dims: Project to this many dimensions first (None/0 = no reduction)
+        n_jobs: Parallel jobs for HDBSCAN core-distance computation (-1 = all cores)
+
+    Returns:
+        ClusteringResult with labels (-1 = noise), model and timing
+    """
+    start = time.perf_counter()
+    vectors = np.ascontiguousarray(embeddings, dtype="float32")
+
+    if backend == "auto":
+        if hdbscan is None:
+            backend = "leader"
+        elif faiss is not None and len(vectors) > PARTITION_THRESHOLD:
+            backend = "partitioned"
+        else:
+            backend = "hdbscan"
+    if backend in ("hdbscan", "partitioned") and hdbscan is None:
+        logger.warning("hdbscan is not installed - using leader clustering")
+        backend = "leader"
+    if backend == "partitioned" and faiss is None:
+        backend = "hdbscan"
+
+    reducer = None
+    if reduce_dims and 0 < reduce_dims < vectors.shape[1] and len(vectors) > reduce_dims:
+        reducer = LinearReducer(reduce_dims).fit(vectors)
+        vectors = reducer.transform(vectors)
+
+    model = ClusterModel(backend=backend, reducer=reducer)
+    partitions = 1
+    if len(vectors) < 2:
+        labels = np.full(len(vectors), -1, dtype=np.int64)
+    elif backend == "hdbscan":
+        model.clusterer, labels = _hdbscan(vectors, min_cluster_size, n_jobs, prediction_data=True)
+    elif backend == "partitioned":
+        labels, partitions = _partitioned(vectors, min_cluster_size, n_jobs)
+    elif backend == "leader":
+        labels = _leader(vectors, min_cluster_size, LEADER_SIMILARITY)
+    else:
+        raise ValueError(f"Unknown clustering backend: {backend}")
+
+    if model.clusterer is None:
+        model.centroids, model.centroid_labels = _centroids(_normalize(vectors), labels)
+
+    seconds = time.perf_counter() - start
+    CLUSTERING_SECONDS.labels(backend).observe(seconds)
+    record("cluster", seconds)
+    return ClusteringResult(
+        labels=labels,
+        model=model,
+        backend=backend,
+        seconds=seconds,
+        reduced_dims=reducer.n_components if reducer is not None else None,
+        partitions=partitions,
+    )
+
+
+def reassign_noise(
+    embeddings: np.ndarray,
+    labels: np.ndarray,
+    min_similarity: float = 0.65,
+    batch_size: int = REASSIGN_BATCH_SIZE,
+):
+    """
+    Move noise points (-1) into the cluster of their nearest clustered point.
+
+    A noise point is reassigned only if that nearest point's cosine similarity
+    is above `min_similarity`. Uses a FAISS inner-product index over the
+    clustered points with batched top-1 search (NumPy blocks without FAISS),
+    so memory is bounded by batch_size x clustered points.
+
+    Returns:
+        (updated labels, number of reassigned points)
+    """
+    noise_rows = np.flatnonzero(labels == -1)
+    clustered_rows = np.flatnonzero(labels != -1)
+    updated = labels.copy()
+    if len(noise_rows) == 0 or len(clustered_rows) == 0:
+        return updated, 0
+
+    vectors = np.ascontiguousarray(_normalize(np.asarray(embeddings, dtype="float32")))
+    clustered = np.ascontiguousarray(vectors[clustered_rows])
+    index = None
+    if faiss is not None:
+        index = faiss.IndexFlatIP(clustered.shape[1])
+        index.add(clustered)
+
+    reassigned = 0
+    for start in range(0, len(noise_rows), batch_size):
+        rows = noise_rows[start:start + batch_size]
+        if index is not None:
+            sims, nearest = index.search(vectors[rows], 1)
+            sims, nearest = sims[:, 0], nearest[:, 0]
+        else:
+            block = vectors[rows] @ clustered.T
+            nearest = block.argmax(axis=1)
+            sims = block[np.arange(len(rows)), nearest]
+        hit = sims > min_similarity
+        updated[rows[hit]] = labels[clustered_rows[nearest[hit]]]
+        reassigned += int(hit.sum())
+    return updated, reassigned
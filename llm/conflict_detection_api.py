@@ -3,23 +3,59 @@ conflict_detection_api.py
 FastAPI endpoints for domain-agnostic conflict detection.
 """
 
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from pydantic import BaseModel
-from typing import List, Dict, Optional
-import pandas as pd
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
 import os
 import asyncio
+import logging
+import threading
 from datetime import datetime
-import json
 
 from domain_agnostic_conflict_detector import DomainAgnosticConflictDetector
+from job_events import JobEventBus, sse_response
+from verdict_cache import shared_verdict_caches
+from tracing import traced
 
 router = APIRouter(prefix="/api/conflicts", tags=["Conflict Detection"])
+logger = logging.getLogger(__name__)
 
 # In-memory job tracking (use Redis in production)
 _conflict_jobs: Dict[str, Dict] = {}
 _conflict_jobs_lock = asyncio.Lock()
 
+# Jobs run on a fixed number of workers; extra jobs wait in the queue
+CONFLICT_JOB_WORKERS = int(os.getenv("CONFLICT_JOB_WORKERS", "2"))
+_job_queue: Optional[asyncio.Queue] = None
+_job_workers: List[asyncio.Task] = []
+# Ids of jobs still waiting in _job_queue, in queue order (for their position)
+_queued_job_ids: List[str] = []
+
+# Progress events per job, streamed at GET /api/conflicts/events/{job_id}
+_job_events = JobEventBus()
+
+# Embedding model and LLM client shared by all jobs (loaded once, on first use)
+_shared_embedder = None
+_shared_llm_client = None
+_shared_lock = threading.Lock()
+
+
+def _get_shared_clients():
+    """Return the shared (SentenceTransformer, Groq) pair, loading them once."""
+    global _shared_embedder, _shared_llm_client
+    with _shared_lock:
+        if _shared_embedder is None:
+            from sentence_transformers import SentenceTransformer
+            from groq import Groq
+            logger.info("Loading shared embedding model for conflict jobs...")
+            _shared_embedder = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+            _shared_llm_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+        return _shared_embedder, _shared_llm_client
+
+
+def _project_output_dir(project_id: int) -> str:
+    return f"data/conflict_detection/{project_id}"
+
 
 class ConflictDetectionRequest(BaseModel):
     """Request to detect conflicts in requirements."""
@@ -27,6 +63,8 @@ class ConflictDetectionRequest(BaseModel):
     requirements: List[Dict[str, str]]  # [{"id": "1", "text": "..."}]
     min_cluster_size: Optional[int] = 2
     max_batch_size: Optional[int] = 30
+    candidate_strategy: Optional[str] = Field(default="cluster", pattern="^(cluster|knn)$")
+    clustering_backend: Optional[str] = Field(default="auto", pattern="^(auto|hdbscan|partitioned|leader)$")
 
 
 class ConflictDetectionResponse(BaseModel):
@@ -62,38 +100,47 @@ async def run_conflict_detection(
     project_id: int,
     requirements: List[Dict[str, str]],
     min_cluster_size: int,
-    max_batch_size: int
+    max_batch_size: int,
+    candidate_strategy: str = "cluster",
+    clustering_backend: str = "auto"
 ):
-    """Background task to run conflict detection."""
+    """Run one conflict detection job (called by a pool worker)."""
     async with _conflict_jobs_lock:
         _conflict_jobs[job_id]["status"] = "running"
         _conflict_jobs[job_id]["progress"] = "Initializing detector..."
+    _job_events.publish(job_id, "started", requirements=len(requirements))
+    
+    def on_event(event_type: str, data: Dict[str, Any]):
+        # Called on the event loop thread, so the job dict can be updated directly
+        if event_type == "cluster":
+            _conflict_jobs[job_id]["progress"] = f"Checked cluster {data['completed']}/{data['total']}"
+        _job_events.publish(job_id, event_type, **data)
     
     try:
-        # Create temporary CSV from requirements
-        temp_dir = f"data/temp/{project_id}"
-        os.makedirs(temp_dir, exist_ok=True)
-        temp_csv = f"{temp_dir}/requirements_{job_id}.csv"
-        
-        # Convert requirements to DataFrame
-        df = pd.DataFrame(requirements)
-        df.to_csv(temp_csv, index=False)
+        embedder, llm_client = await asyncio.to_thread(_get_shared_clients)
+        # Verdicts are shared with the synchronous /api/conflicts/detect path
+        verdict_cache = await asyncio.to_thread(shared_verdict_caches().get, project_id)
         
-        # Initialize detector
+        # Per-job detector state; models, client and verdict cache are shared
         detector = DomainAgnosticConflictDetector(
-            output_dir=f"data/conflict_detection/{project_id}",
+            output_dir=_project_output_dir(project_id),
             min_cluster_size=min_cluster_size,
             max_cluster_batch=max_batch_size,
+            candidate_strategy=candidate_strategy,
+            clustering_backend=clustering_backend,
+            embedder=embedder,
+            llm_client=llm_client,
+            verdict_cache=verdict_cache,
+            on_event=on_event,
         )
         
         async with _conflict_jobs_lock:
             _conflict_jobs[job_id]["progress"] = "Detecting conflicts..."
         
-        # Run detection
-        await detector.run(
-            csv_path=temp_csv,
-            text_column="text",
-            id_column="id",
+        # Run detection on the request's requirements directly
+        await detector.run_on_requirements(
+            ids=[req["id"] for req in requirements],
+            texts=[req["text"] for req in requirements],
             add_tags=False
         )
         
@@ -120,6 +167,7 @@ async def run_conflict_detection(
             "clusters_found": n_clusters,
             "noise_points": n_noise,
             "conflicts_found": len(conflicts),
+            "clustering": detector.clustering_summary,
             "timestamp": datetime.now().isoformat()
         }
         
@@ -129,23 +177,53 @@ async def run_conflict_detection(
             _conflict_jobs[job_id]["conflicts"] = conflicts
             _conflict_jobs[job_id]["metadata"] = metadata
             _conflict_jobs[job_id]["progress"] = None
-        
-        # Cleanup temp file
-        if os.path.exists(temp_csv):
-            os.remove(temp_csv)
+        _job_events.publish(job_id, "done", **metadata)
             
     except Exception as e:
         async with _conflict_jobs_lock:
             _conflict_jobs[job_id]["status"] = "failed"
             _conflict_jobs[job_id]["error"] = str(e)
             _conflict_jobs[job_id]["progress"] = None
+        _job_events.publish(job_id, "error", error=str(e))
+
+
+async def _job_worker():
+    """Take queued jobs one at a time, forever."""
+    while True:
+        job_id, kwargs = await _job_queue.get()
+        if job_id in _queued_job_ids:
+            _queued_job_ids.remove(job_id)
+        try:
+            # Queued jobs outlive the request that submitted them: each gets its own trace
+            with traced("conflict_detection", request_id=job_id, project_id=kwargs.get("project_id")):
+                await run_conflict_detection(job_id, **kwargs)
+        finally:
+            _job_queue.task_done()
+
+
+def _enqueue_job(job_id: str, kwargs: Dict[str, Any]) -> int:
+    """Queue a job, starting the worker pool on first use. Returns the queue position."""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = asyncio.Queue()
+    _job_workers[:] = [w for w in _job_workers if not w.done()]
+    while len(_job_workers) < CONFLICT_JOB_WORKERS:
+        _job_workers.append(asyncio.create_task(_job_worker()))
+    _job_queue.put_nowait((job_id, kwargs))
+    _queued_job_ids.append(job_id)
+    return len(_queued_job_ids)
+
+
+def _queue_position(job_id: str) -> Optional[int]:
+    """1-based position of a job still waiting in the queue, or None."""
+    try:
+        return _queued_job_ids.index(job_id) + 1
+    except ValueError:
+        return None
 
 
 @router.post("/detect", response_model=ConflictDetectionResponse)
-async def detect_conflicts(
-    request: ConflictDetectionRequest,
-    background_tasks: BackgroundTasks
-):
+async def detect_conflicts(request: ConflictDetectionRequest):
     """
     Start conflict detection for a project's requirements.
     
@@ -178,21 +256,22 @@ async def detect_conflicts(
             "error": None,
             "created_at": datetime.now().isoformat()
         }
+    _job_events.link(job_id, job_id)
     
-    # Start background task
-    background_tasks.add_task(
-        run_conflict_detection,
-        job_id,
-        request.project_id,
-        request.requirements,
-        request.min_cluster_size,
-        request.max_batch_size
-    )
+    # Hand the job to the bounded worker pool
+    _enqueue_job(job_id, {
+        "project_id": request.project_id,
+        "requirements": request.requirements,
+        "min_cluster_size": request.min_cluster_size,
+        "max_batch_size": request.max_batch_size,
+        "candidate_strategy": request.candidate_strategy,
+        "clustering_backend": request.clustering_backend,
+    })
     
     return ConflictDetectionResponse(
         job_id=job_id,
         status="pending",
-        message=f"Conflict detection started for {len(request.requirements)} requirements"
+        message=f"Conflict detection queued for {len(request.requirements)} requirements"
     )
 
 
@@ -205,16 +284,32 @@ async def get_conflict_status(job_id: str):
         
         job = _conflict_jobs[job_id]
     
+    # The position moves up as earlier jobs start, so it is computed on read
+    progress = job.get("progress")
+    position = _queue_position(job_id) if job["status"] == "pending" else None
+    if position is not None:
+        progress = f"Queued (position {position})"
+    
     return ConflictStatusResponse(
         job_id=job_id,
         status=job["status"],
-        progress=job.get("progress"),
+        progress=progress,
         conflicts=job.get("conflicts"),
         error=job.get("error"),
         metadata=job.get("metadata")
     )
 
 
+@router.get("/events/{job_id}")
+async def conflict_job_events(job_id: str):
+    """
+    Server-Sent Events for a job: started, stage (embed/cluster/dedupe timings),
+    batch (conflicts as soon as a batch is verified), cluster (completion) and
+    finally done (job metadata) or error.
+    """
+    return sse_response(_job_events, job_id)
+
+
 @router.delete("/status/{job_id}")
 async def clear_conflict_job(job_id: str):
     """Clear a completed conflict detection job."""
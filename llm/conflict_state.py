@@ -0,0 +1,155 @@
+"""
+conflict_state.py
+Per-project state kept between conflict detection runs.
+
+Incremental detection needs the previous run's embeddings, cluster labels
+and fitted HDBSCAN model so that newly added requirements can be embedded,
+assigned to an existing cluster and checked against their neighbours only.
+States live in a small in-memory LRU and are persisted with pickle so they
+survive restarts.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def text_hash(text: str) -> str:
+    """Stable hash of a requirement text (whitespace-normalized)."""
+    normalized = " ".join((text or "").split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class ProjectConflictState:
+    """Snapshot of the last detection run for one project."""
+    req_ids: List[str]
+    text_hashes: List[str]
+    embeddings: np.ndarray
+    labels: np.ndarray
+    clusterer: Any = None  # fitted hdbscan.HDBSCAN with prediction_data=True
+    updated_at: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+
+    def diff(self, req_ids: List[str], texts: List[str]) -> Tuple[List[int], List[int], List[str]]:
+        """
+        Compare an incoming requirement set against this state.
+
+        Args:
+            req_ids: Incoming requirement IDs
+            texts: Incoming requirement texts
+
+        Returns:
+            (indices of new or changed requirements in the incoming list,
+             indices of unchanged requirements in the incoming list,
+             IDs present in the state but missing from the incoming list)
+        """
+        known = {rid: h for rid, h in zip(self.req_ids, self.text_hashes)}
+        incoming = set()
+        changed, unchanged = [], []
+        for i, (rid, text) in enumerate(zip(req_ids, texts)):
+            incoming.add(rid)
+            if known.get(rid) == text_hash(text):
+                unchanged.append(i)
+            else:
+                changed.append(i)
+        removed = [rid for rid in self.req_ids if rid not in incoming]
+        return changed, unchanged, removed
+
+    def without(self, req_ids: List[str]) -> "ProjectConflictState":
+        """Return a copy with the given requirement IDs dropped."""
+        drop = set(req_ids)
+        keep = [i for i, rid in enumerate(self.req_ids) if rid not in drop]
+        return ProjectConflictState(
+            req_ids=[self.req_ids[i] for i in keep],
+            text_hashes=[self.text_hashes[i] for i in keep],
+            embeddings=self.embeddings[keep],
+            labels=self.labels[keep],
+            clusterer=self.clusterer,
+        )
+
+    def row_of(self) -> Dict[str, int]:
+        """Map requirement ID -> row in embeddings/labels."""
+        return {rid: i for i, rid in enumerate(self.req_ids)}
+
+
+class ConflictStateStore:
+    """
+    LRU of per-project states backed by pickle files.
+
+    Args:
+        base_dir: Directory for persisted states ({base_dir}/{project_id}/state.pkl)
+        max_projects: Number of project states kept in memory
+    """
+
+    def __init__(self, base_dir: str = "data/conflict_state", max_projects: int = 32):
+        self.base_dir = base_dir
+        self.max_projects = max_projects
+        self._states: "OrderedDict[str, ProjectConflictState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, project_id: str) -> str:
+        return os.path.join(self.base_dir, str(project_id), "state.pkl")
+
+    def get(self, project_id: str) -> Optional[ProjectConflictState]:
+        """Return the state for a project from memory or disk, or None."""
+        key = str(project_id)
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None:
+                self._states.move_to_end(key)
+                return state
+
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load conflict state for project {key}: {e}")
+            return None
+
+        self._remember(key, state)
+        return state
+
+    def put(self, project_id: str, state: ProjectConflictState):
+        """Store a project's state in memory and on disk."""
+        key = str(project_id)
+        state.updated_at = datetime.utcnow().isoformat()
+        self._remember(key, state)
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f)
+        os.replace(tmp_path, path)
+
+    def clear(self, project_id: str):
+        """Forget a project's state (memory and disk)."""
+        key = str(project_id)
+        with self._lock:
+            self._states.pop(key, None)
+        path = self._path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _remember(self, key: str, state: ProjectConflictState):
+        with self._lock:
+            self._states[key] = state
+            self._states.move_to_end(key)
+            while len(self._states) > self.max_projects:
+                self._states.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._states)
@@ -0,0 +1,158 @@
+"""
+dedupe.py
+Near-duplicate detection over L2-normalized embeddings.
+
+Greedy, order-preserving semantics: walking the rows in order, each row that
+is still kept absorbs every later row whose cosine similarity exceeds the
+threshold. Rows that were already absorbed never absorb others.
+
+Small inputs use a NumPy-vectorized pass over the dense similarity matrix.
+Larger inputs collect each row's near neighbours blockwise (exact), and very
+large inputs use an approximate FAISS IVF range search, so memory stays
+proportional to the number of near pairs rather than n².
+"""
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import faiss
+except Exception:
+    faiss = None
+
+# Up to this many rows the dense n x n matrix is the fastest option
+DENSE_LIMIT = 2048
+# Rows per block for the exact blockwise search (memory: BLOCK_SIZE x n floats)
+BLOCK_SIZE = 1024
+# Above this many rows exact search gets slow; switch to a FAISS IVF range search
+IVF_LIMIT = 20000
+IVF_NPROBE = 4
+IVF_TRAIN_PER_LIST = 16
+IVF_QUERY_BATCH = 8192
+
+
+def _greedy_dense(embeddings: np.ndarray, threshold: float) -> Tuple[List[int], List[List[int]]]:
+    sim = embeddings @ embeddings.T
+    alive = np.ones(len(embeddings), dtype=bool)
+    groups = []
+    for i in range(len(embeddings)):
+        if not alive[i]:
+            continue
+        dup = alive & (sim[i] > threshold)
+        dup[:i + 1] = False
+        if dup.any():
+            members = np.flatnonzero(dup)
+            alive[members] = False
+            groups.append([i] + members.tolist())
+    return np.flatnonzero(alive).tolist(), groups
+
+
+def _greedy_from_neighbors(n: int, neighbors: List[np.ndarray]) -> Tuple[List[int], List[List[int]]]:
+    """Apply the greedy pass given, for every row, the later rows above threshold."""
+    alive = np.ones(n, dtype=bool)
+    groups = []
+    for i in range(n):
+        if not alive[i]:
+            continue
+        later = neighbors[i]
+        later = later[alive[later]]
+        if len(later):
+            alive[later] = False
+            groups.append([i] + sorted(later.tolist()))
+    return np.flatnonzero(alive).tolist(), groups
+
+
+def _range_neighbors_exact(embeddings: np.ndarray, threshold: float) -> List[np.ndarray]:
+    """Later rows above threshold for every row, via blockwise matrix products."""
+    n = len(embeddings)
+    neighbors: List[np.ndarray] = []
+    for start in range(0, n, BLOCK_SIZE):
+        block = embeddings[start:start + BLOCK_SIZE] @ embeddings.T
+        rows, cols = np.nonzero(block > threshold)
+        rows += start
+        later = cols > rows
+        rows, cols = rows[later], cols[later]
+        # nonzero is row-major, so each row's hits are contiguous and sorted
+        bounds = np.searchsorted(rows, np.arange(start, start + len(block) + 1))
+        neighbors.extend(cols[bounds[r]:bounds[r + 1]] for r in range(len(block)))
+    return neighbors
+
+
+def _range_neighbors_ivf(embeddings: np.ndarray, threshold: float) -> List[np.ndarray]:
+    """Approximate neighbours above threshold using a FAISS IVF range search."""
+    n, d = embeddings.shape
+    nlist = int(4 * np.sqrt(n))
+    quantizer = faiss.IndexFlatIP(d)
+    index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+    # A sample is plenty to place coarse centroids; full k-means dominates otherwise
+    index.cp.niter = 10
+    index.cp.min_points_per_centroid = IVF_TRAIN_PER_LIST
+    sample = np.random.default_rng(0).choice(n, min(n, IVF_TRAIN_PER_LIST * nlist), replace=False)
+    index.train(embeddings[np.sort(sample)])
+    index.add(embeddings)
+    index.nprobe = IVF_NPROBE
+
+    neighbors: List[np.ndarray] = []
+    for start in range(0, n, IVF_QUERY_BATCH):
+        block = embeddings[start:start + IVF_QUERY_BATCH]
+        lims, sims, ids = index.range_search(block, threshold)
+        for r in range(len(block)):
+            found = ids[lims[r]:lims[r + 1]]
+            found_sims = sims[lims[r]:lims[r + 1]]
+            # range_search is inclusive; keep the strict > of the exact path
+            neighbors.append(np.sort(found[(found > start + r) & (found_sims > threshold)]))
+    return neighbors
+
+
+def find_near_duplicates(
+    embeddings: np.ndarray, threshold: float = 0.95, dense_limit: Optional[int] = None
+) -> Tuple[List[int], List[List[int]]]:
+    """
+    Find near-duplicate rows.
+
+    Args:
+        embeddings: L2-normalized embeddings (n, d)
+        threshold: Cosine similarity above which rows are duplicates
+        dense_limit: Override DENSE_LIMIT (mainly for benchmarking)
+
+    Returns:
+        (kept row positions in order,
+         duplicate groups as [kept_row, dup_row, ...] for every row that absorbed others)
+    """
+    n = len(embeddings)
+    if n <= 1:
+        return list(range(n)), []
+
+    vectors = np.ascontiguousarray(embeddings, dtype="float32")
+    if n <= (DENSE_LIMIT if dense_limit is None else dense_limit):
+        return _greedy_dense(vectors, threshold)
+
+    if faiss is not None and n > IVF_LIMIT:
+        neighbors = _range_neighbors_ivf(vectors, threshold)
+    else:
+        neighbors = _range_neighbors_exact(vectors, threshold)
+    return _greedy_from_neighbors(n, neighbors)
+
+
+def remove_near_duplicates(
+    indices: List[int], embeddings: np.ndarray, threshold: float = 0.95
+) -> Tuple[List[int], List[List[int]]]:
+    """
+    Drop near-duplicates from a subset of rows (e.g. one cluster).
+
+    Args:
+        indices: Row indices into `embeddings`
+        embeddings: Full embedding matrix
+        threshold: Cosine similarity above which rows are duplicates
+
+    Returns:
+        (kept indices, duplicate groups expressed in the original indices)
+    """
+    if len(indices) <= 1:
+        return list(indices), []
+    kept, groups = find_near_duplicates(embeddings[indices], threshold)
+    return (
+        [indices[i] for i in kept],
+        [[indices[i] for i in group] for group in groups],
+    )
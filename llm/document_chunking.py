@@ -0,0 +1,138 @@
+"""
+document_chunking.py
+Section-aware splitting of long documents under a token budget.
+
+Used by the map-reduce extraction pipeline: each chunk is sent to the LLM
+on its own, so a chunk should be a self-contained run of sections that
+fits comfortably in the extraction prompt.
+"""
+
+import re
+from typing import Any, Dict, List
+
+from token_utils import count_tokens
+
+# Lines that look like section headings:
+#   "# Title", "## Title"                (markdown)
+#   "1. Title", "3.2.1 Title", "4) Title" (numbered)
+#   "SECTION 2", "FUNCTIONAL REQUIREMENTS" (short all-caps lines)
+_HEADING_RE = re.compile(
+    r"^\s*(#{1,6}\s+\S.*"
+    r"|\d+(\.\d+)*[.)]?\s+[A-Z][^\n]{0,80}"
+    r"|[A-Z][A-Z0-9 /&,\-]{3,60}:?)\s*$"
+)
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def _split_sections(text: str) -> List[Dict[str, str]]:
+    """Split text at heading lines; each section keeps its heading."""
+    sections = []
+    heading = ""
+    buffer: List[str] = []
+
+    for line in text.splitlines():
+        if _HEADING_RE.match(line) and buffer and "".join(buffer).strip():
+            sections.append({"heading": heading, "text": "\n".join(buffer).strip()})
+            buffer = []
+        if _HEADING_RE.match(line):
+            heading = line.strip().lstrip("#").strip()
+        buffer.append(line)
+
+    if "".join(buffer).strip():
+        sections.append({"heading": heading, "text": "\n".join(buffer).strip()})
+    return sections
+
+
+def _split_oversized(text: str, max_tokens: int) -> List[str]:
+    """Split a single section that exceeds the budget by paragraph, then sentence."""
+    pieces: List[str] = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if count_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph)
+            continue
+        for sentence in _SENTENCE_SPLIT_RE.split(paragraph):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            # Last resort for run-on text without punctuation: hard cut by characters
+            while count_tokens(sentence) > max_tokens:
+                cut = max(1, int(len(sentence) * max_tokens / count_tokens(sentence)))
+                pieces.append(sentence[:cut])
+                sentence = sentence[cut:]
+            if sentence:
+                pieces.append(sentence)
+
+    # Re-pack the small pieces so chunks stay close to the budget
+    packed: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for piece in pieces:
+        piece_tokens = count_tokens(piece) + 1  # +1 for the paragraph separator
+        if current and current_tokens + piece_tokens > max_tokens:
+            packed.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += piece_tokens
+    if current:
+        packed.append("\n\n".join(current))
+    return packed
+
+
+def split_document(text: str, max_tokens: int = 2500) -> List[Dict[str, Any]]:
+    """
+    Split a document into section-aligned chunks that fit a token budget.
+
+    Consecutive small sections are packed together; sections larger than the
+    budget are split by paragraph and sentence.
+
+    Args:
+        text: Full document text
+        max_tokens: Maximum tokens per chunk
+
+    Returns:
+        List of {index, heading, text, tokens} dicts in document order
+    """
+    text = (text or "").strip()
+    if not text:
+        return []
+
+    chunks: List[Dict[str, Any]] = []
+    current: List[str] = []
+    current_heading = ""
+    current_tokens = 0
+
+    def flush():
+        nonlocal current, current_tokens
+        if current:
+            body = "\n\n".join(current)
+            chunks.append({
+                "index": len(chunks),
+                "heading": current_heading,
+                "text": body,
+                "tokens": count_tokens(body),
+            })
+        current, current_tokens = [], 0
+
+    for section in _split_sections(text):
+        section_tokens = count_tokens(section["text"])
+
+        if section_tokens > max_tokens:
+            flush()
+            current_heading = section["heading"]
+            for piece in _split_oversized(section["text"], max_tokens):
+                current = [piece]
+                flush()
+            continue
+
+        if current and current_tokens + section_tokens > max_tokens:
+            flush()
+        if not current:
+            current_heading = section["heading"]
+        current.append(section["text"])
+        current_tokens += section_tokens
+
+    flush()
+    return chunks
@@ -8,18 +8,19 @@ import pandas as pd
 import numpy as np
 import os
 import json
+import logging
 from datetime import datetime
-from typing import List, Dict, Tuple, Optional
+from collections import Counter
+from typing import Any, Callable, List, Dict, Tuple, Optional
 import asyncio
+import time
 from dataclasses import dataclass, asdict
 import warnings
 warnings.filterwarnings('ignore')
 
 # Embedding and clustering
 from sentence_transformers import SentenceTransformer
-import hdbscan
 from sklearn.preprocessing import normalize
-from sklearn.metrics.pairwise import cosine_similarity
 
 # LLM
 from groq import Groq
@@ -28,6 +29,16 @@ from dotenv import load_dotenv
 # Progress tracking
 from tqdm import tqdm
 
+from candidate_pairs import generate_candidate_pairs, pack_pairs
+from verdict_cache import PairVerdictCache
+from dedupe import remove_near_duplicates
+from clustering import cluster_embeddings, reassign_noise
+from prompt_packing import AliasedPrompt, ConflictGroup, pack_groups, split_group
+from llm_calls import create_completion
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
 
 @dataclass
 class ConflictPair:
@@ -75,6 +86,20 @@ class DomainAgnosticConflictDetector:
         min_cluster_size: int = 2,
         max_cluster_batch: int = 30,
         similarity_threshold: float = 0.95,
+        candidate_strategy: str = "cluster",
+        knn_k: int = 10,
+        min_pair_similarity: float = 0.45,
+        max_pairs_per_requirement: int = 5,
+        max_pairs_per_prompt: int = 40,
+        prompt_token_budget: int = 1500,
+        use_verdict_cache: bool = True,
+        verdict_cache: Optional[PairVerdictCache] = None,
+        clustering_backend: str = "auto",
+        reduce_dims: Optional[int] = None,
+        cluster_n_jobs: int = -1,
+        embedder: Optional[SentenceTransformer] = None,
+        llm_client: Optional[Groq] = None,
+        on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None,
     ):
         """
         Initialize the conflict detector.
@@ -84,8 +109,29 @@ class DomainAgnosticConflictDetector:
             llm_model: Groq LLM model for conflict verification
             output_dir: Directory to save results and training data
             min_cluster_size: Minimum requirements in a cluster to check
-            max_cluster_batch: Maximum requirements per LLM batch
+            max_cluster_batch: Maximum requirements per LLM prompt
             similarity_threshold: Threshold to skip near-duplicates
+            candidate_strategy: "cluster" (check whole clusters) or "knn"
+                (check ranked kNN candidate pairs only)
+            knn_k: Neighbours per requirement for the kNN strategy
+            min_pair_similarity: Lower similarity bound for kNN pairs
+            max_pairs_per_requirement: kNN pair budget per requirement
+            max_pairs_per_prompt: Maximum pairs packed into one LLM prompt
+            prompt_token_budget: Estimated tokens of requirement text per
+                prompt; large clusters are split and small ones packed together
+            use_verdict_cache: Reuse verdicts stored in output_dir for pairs
+                whose texts have not changed
+            verdict_cache: Shared verdict cache for the project (by default
+                one is loaded from output_dir)
+            clustering_backend: "auto", "hdbscan", "partitioned" (FAISS k-means
+                + HDBSCAN per partition) or "leader" (no hdbscan needed)
+            reduce_dims: PCA dimensions before clustering (None = no reduction)
+            cluster_n_jobs: Parallel jobs for HDBSCAN core distances (-1 = all cores)
+            embedder: Already-loaded SentenceTransformer to reuse (loaded from
+                embedding_model if None)
+            llm_client: Shared Groq client to reuse (created if None)
+            on_event: Progress callback, called as on_event(type, data) with
+                "stage", "batch" and "cluster" events from the event loop
         """
         load_dotenv()
         
@@ -95,22 +141,55 @@ class DomainAgnosticConflictDetector:
         self.min_cluster_size = min_cluster_size
         self.max_cluster_batch = max_cluster_batch
         self.similarity_threshold = similarity_threshold
-        
-        # Initialize models
-        print(f"🔧 Loading embedding model: {embedding_model}")
-        self.embedding_model = SentenceTransformer(embedding_model)
-        
-        print(f"🔧 Initializing LLM client: {llm_model}")
-        self.llm_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+        self.candidate_strategy = candidate_strategy
+        self.knn_k = knn_k
+        self.min_pair_similarity = min_pair_similarity
+        self.max_pairs_per_requirement = max_pairs_per_requirement
+        self.max_pairs_per_prompt = max_pairs_per_prompt
+        self.prompt_token_budget = prompt_token_budget
+        self.clustering_backend = clustering_backend
+        self.reduce_dims = reduce_dims
+        self.cluster_n_jobs = cluster_n_jobs
+        self.clustering_summary: Optional[Dict] = None
+        
+        # Initialize models (long-running services pass shared instances in)
+        if embedder is None:
+            logger.info(f"🔧 Loading embedding model: {embedding_model}")
+            embedder = SentenceTransformer(embedding_model)
+        self.embedding_model = embedder
+        
+        if llm_client is None:
+            logger.info(f"🔧 Initializing LLM client: {llm_model}")
+            llm_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+        self.llm_client = llm_client
+        self.on_event = on_event
         
         # Storage
         self.requirements: List[RequirementMetadata] = []
         self.conflicts: List[ConflictPair] = []
         self.embeddings: np.ndarray = None
+        self.duplicate_groups: List[List[str]] = []
+        self.dedupe_seconds = 0.0
         
         # Create output directory
         os.makedirs(output_dir, exist_ok=True)
         
+        # Verdicts from earlier runs on this output_dir (one per project)
+        if not use_verdict_cache:
+            verdict_cache = None
+        elif verdict_cache is None:
+            verdict_cache = PairVerdictCache(os.path.join(output_dir, "pair_verdicts.pkl"))
+        self.verdict_cache = verdict_cache
+        self.cached_batches = 0
+        
+    def _emit(self, event_type: str, **data):
+        """Report progress to the on_event callback, if any."""
+        if self.on_event is not None:
+            self.on_event(event_type, data)
+    
+    def _emit_batch(self, cluster_id: int, conflicts: List[ConflictPair]):
+        self._emit("batch", cluster_id=int(cluster_id), conflicts=[asdict(c) for c in conflicts])
+    
     def load_requirements(self, csv_path: str, text_column: str = "requirement", id_column: str = None):
         """
         Load requirements from CSV.
@@ -120,7 +199,7 @@ class DomainAgnosticConflictDetector:
             text_column: Column containing requirement text
             id_column: Column containing requirement ID (optional)
         """
-        print(f"\n📂 Loading requirements from {csv_path}")
+        logger.info(f"📂 Loading requirements from {csv_path}")
         df = pd.read_csv(csv_path)
         
         if text_column not in df.columns:
@@ -134,25 +213,26 @@ class DomainAgnosticConflictDetector:
         
         texts = df[text_column].astype(str).tolist()
         
-        print(f"✅ Loaded {len(texts)} requirements")
+        logger.info(f"✅ Loaded {len(texts)} requirements")
         return ids, texts
     
     def generate_embeddings(self, texts: List[str]) -> np.ndarray:
         """Generate and normalize embeddings for requirements."""
-        print(f"\n🧮 Generating embeddings for {len(texts)} requirements...")
+        logger.info(f"🧮 Generating embeddings for {len(texts)} requirements...")
         
-        embeddings = self.embedding_model.encode(
-            texts,
-            show_progress_bar=True,
-            normalize_embeddings=True,  # L2 normalization for cosine similarity
-        )
+        with span("embed"):
+            embeddings = self.embedding_model.encode(
+                texts,
+                show_progress_bar=True,
+                normalize_embeddings=True,  # L2 normalization for cosine similarity
+            )
         
-        print(f"✅ Generated embeddings: shape {embeddings.shape}")
+        logger.info(f"✅ Generated embeddings: shape {embeddings.shape}")
         return embeddings
     
     def cluster_requirements(self, embeddings: np.ndarray) -> np.ndarray:
         """
-        Cluster requirements using HDBSCAN.
+        Cluster requirements (HDBSCAN, partitioned HDBSCAN or leader fallback).
         
         Args:
             embeddings: Normalized requirement embeddings
@@ -160,47 +240,46 @@ class DomainAgnosticConflictDetector:
         Returns:
             Cluster labels (-1 = noise/outliers)
         """
-        print(f"\n🔍 Clustering {len(embeddings)} requirements...")
+        logger.info(f"🔍 Clustering {len(embeddings)} requirements...")
         
-        clusterer = hdbscan.HDBSCAN(
+        result = cluster_embeddings(
+            embeddings,
             min_cluster_size=self.min_cluster_size,
-            min_samples=1,  # More lenient - allows single points to join clusters
-            metric='euclidean',
-            cluster_selection_method='eom',
-            prediction_data=True,
-            allow_single_cluster=False
+            backend=self.clustering_backend,
+            reduce_dims=self.reduce_dims,
+            n_jobs=self.cluster_n_jobs,
         )
+        self.clustering_summary = result.summary()
+        cluster_labels = result.labels
         
-        cluster_labels = clusterer.fit_predict(embeddings)
-        
-        n_clusters = len(set(cluster_labels)) - (1 if -1 in cluster_labels else 0)
-        n_noise = list(cluster_labels).count(-1)
-        noise_pct = (n_noise / len(embeddings)) * 100
+        n_clusters = result.n_clusters
+        n_noise = result.n_noise
+        noise_pct = result.noise_ratio * 100
         
-        print(f"✅ Found {n_clusters} clusters")
-        print(f"   📊 Noise/outliers: {n_noise} requirements ({noise_pct:.1f}%)")
+        logger.info(f"✅ Found {n_clusters} clusters with {result.backend} in {result.seconds:.2f}s")
+        logger.info(f"📊 Noise/outliers: {n_noise} requirements ({noise_pct:.1f}%)")
         
         # If too many noise points (>30%), try reassigning them to nearest clusters
         if noise_pct > 30 and n_clusters > 0:
-            print(f"   ⚠️  High noise percentage - reassigning outliers to nearest clusters...")
+            logger.warning("⚠️  High noise percentage - reassigning outliers to nearest clusters...")
             cluster_labels = self._reassign_noise_points(embeddings, cluster_labels)
             
             n_noise_after = list(cluster_labels).count(-1)
             noise_pct_after = (n_noise_after / len(embeddings)) * 100
-            print(f"   ✅ Reduced noise to {n_noise_after} requirements ({noise_pct_after:.1f}%)")
+            logger.info(f"✅ Reduced noise to {n_noise_after} requirements ({noise_pct_after:.1f}%)")
         
         # Print cluster sizes
         cluster_sizes = pd.Series(cluster_labels).value_counts().sort_index()
-        print(f"\n📊 Cluster Distribution:")
+        logger.info("📊 Cluster Distribution:")
         for cluster_id, size in cluster_sizes.items():
             if cluster_id != -1:
-                print(f"   Cluster {cluster_id}: {size} requirements")
+                logger.info(f"Cluster {cluster_id}: {size} requirements")
         
         return cluster_labels
     
     def _reassign_noise_points(self, embeddings: np.ndarray, cluster_labels: np.ndarray) -> np.ndarray:
         """
-        Reassign noise points (-1) to their nearest cluster.
+        Reassign noise points (-1) to the cluster of their nearest clustered requirement.
         
         Args:
             embeddings: Requirement embeddings
@@ -209,42 +288,15 @@ class DomainAgnosticConflictDetector:
         Returns:
             Updated cluster labels with fewer noise points
         """
-        from sklearn.metrics.pairwise import cosine_similarity
-        
-        # Get noise point indices
-        noise_indices = np.where(cluster_labels == -1)[0]
-        if len(noise_indices) == 0:
+        noise_count = int((cluster_labels == -1).sum())
+        if noise_count == 0:
             return cluster_labels
         
-        # Get clustered point indices
-        clustered_indices = np.where(cluster_labels != -1)[0]
-        if len(clustered_indices) == 0:
-            return cluster_labels
+        # Only reassign if the nearest clustered requirement is CLEARLY similar (> 0.65);
+        # lower similarity means it's truly unique and should remain noise
+        updated_labels, reassigned_count = reassign_noise(embeddings, cluster_labels, min_similarity=0.65)
         
-        # Calculate similarity between noise points and clustered points
-        noise_embeddings = embeddings[noise_indices]
-        clustered_embeddings = embeddings[clustered_indices]
-        
-        similarities = cosine_similarity(noise_embeddings, clustered_embeddings)
-        
-        # Assign each noise point to cluster of its nearest neighbor
-        # Use higher threshold (0.65) - only reassign if CLEARLY similar
-        updated_labels = cluster_labels.copy()
-        reassigned_count = 0
-        
-        for i, noise_idx in enumerate(noise_indices):
-            # Find most similar clustered requirement
-            most_similar_idx = np.argmax(similarities[i])
-            max_similarity = similarities[i, most_similar_idx]
-            
-            # Only reassign if similarity is strong (> 0.65)
-            # Lower similarity means it's truly unique and should remain noise
-            if max_similarity > 0.65:
-                nearest_cluster = cluster_labels[clustered_indices[most_similar_idx]]
-                updated_labels[noise_idx] = nearest_cluster
-                reassigned_count += 1
-        
-        print(f"   📌 Reassigned {reassigned_count}/{len(noise_indices)} outliers (kept {len(noise_indices) - reassigned_count} as truly unique)")
+        logger.info(f"📌 Reassigned {reassigned_count}/{noise_count} outliers (kept {noise_count - reassigned_count} as truly unique)")
         
         return updated_labels
     
@@ -252,68 +304,57 @@ class DomainAgnosticConflictDetector:
         """
         Remove near-duplicate requirements from a cluster.
         
+        Keeps the first occurrence of each duplicate group; a requirement
+        that was already removed never removes others. Removed groups are
+        recorded in self.duplicate_groups.
+        
         Args:
             req_indices: List of requirement indices in cluster
             
         Returns:
             Filtered list without near-duplicates
         """
-        if len(req_indices) <= 1:
-            return req_indices
-        
-        cluster_embeddings = self.embeddings[req_indices]
-        sim_matrix = cosine_similarity(cluster_embeddings)
-        
-        # Keep track of which requirements to keep
-        to_keep = set(range(len(req_indices)))
-        
-        for i in range(len(req_indices)):
-            for j in range(i + 1, len(req_indices)):
-                if sim_matrix[i, j] > self.similarity_threshold:
-                    # Remove j (keep first occurrence)
-                    to_keep.discard(j)
-        
-        filtered_indices = [req_indices[i] for i in sorted(to_keep)]
+        stage_start = time.perf_counter()
+        filtered_indices, groups = remove_near_duplicates(
+            req_indices, self.embeddings, self.similarity_threshold
+        )
+        self.dedupe_seconds += time.perf_counter() - stage_start
+        self.duplicate_groups.extend(
+            [self.requirements[i].req_id for i in group] for group in groups
+        )
         removed = len(req_indices) - len(filtered_indices)
         
         if removed > 0:
-            print(f"   ⚠️  Removed {removed} near-duplicate(s)")
+            logger.warning(f"⚠️  Removed {removed} near-duplicate(s)")
         
         return filtered_indices
     
-    async def check_conflicts_in_batch(
-        self,
-        requirements: List[Tuple[str, str]],
-        cluster_id: int
-    ) -> List[ConflictPair]:
+    async def _ask_llm_for_conflicts(self, groups: List[ConflictGroup]) -> Optional[List[Tuple[int, Dict]]]:
         """
-        Use LLM to check for conflicts in a batch of requirements.
+        Send one conflict-check prompt covering one or more groups to the LLM.
+        
+        Requirement IDs are sent as short aliases and mapped back; pairs are
+        only compared within a group (and only the listed pairs, if any).
         
         Args:
-            requirements: List of (req_id, req_text) tuples
-            cluster_id: Cluster ID for tracking
+            groups: Groups packed into this prompt
             
         Returns:
-            List of detected conflicts
+            (group index, raw conflict dict) tuples, or None if the call or
+            JSON parsing failed
         """
-        if len(requirements) < 2:
-            return []
-        
-        # Build structured prompt
-        req_list = "\n".join([
-            f"{i+1}. [{req_id}] {text}"
-            for i, (req_id, text) in enumerate(requirements)
-        ])
+        aliased = AliasedPrompt(groups)
+        pair_rule = " Where a group lists pairs, check ONLY those pairs." if aliased.has_pair_lists else ""
         
         prompt = f"""You are analyzing requirements for logical conflicts.
 
-Requirements to analyze:
-{req_list}
+Requirements to analyze, in {len(groups)} independent group(s):
+{aliased.listing()}
 
-Task: Identify any pairs of requirements that CANNOT both be true or would create a logical contradiction.
+Task: Identify pairs of requirements from the SAME group that CANNOT both be true or would create a logical contradiction. Never pair requirements from different groups.{pair_rule}
 
 Return your analysis as a JSON array. For each conflict found, include:
-- req_a: ID of first requirement (e.g., "REQ_0001")
+- req_a: ID of first requirement (the exact ID from the brackets, e.g., "R1")
 - req_b: ID of second requirement
 - reason: Brief explanation of the conflict
 - confidence: "high", "medium", or "low"
@@ -322,16 +363,20 @@ If no conflicts exist, return an empty array: []
 
 Response format:
 [
-  {{"req_a": "REQ_0001", "req_b": "REQ_0003", "reason": "...", "confidence": "high"}},
+  {{"req_a": "R1", "req_b": "R3", "reason": "...", "confidence": "high"}},
   ...
 ]
 
 JSON output only:"""
 
+        response_text = ""
         try:
-            response = self.llm_client.chat.completions.create(
-                model=self.llm_model,
-                messages=[{"role": "user", "content": prompt}],
+            # Blocking client call runs in a thread so concurrent jobs can overlap
+            response = await asyncio.to_thread(
+                create_completion,
+                self.llm_client,
+                self.llm_model,
+                [{"role": "user", "content": prompt}],
                 temperature=0.3,
                 max_tokens=2000,
             )
@@ -345,37 +390,175 @@ JSON output only:"""
                 response_text = response_text.split("```")[1].split("```")[0].strip()
             
             conflicts_data = json.loads(response_text)
-            
-            # Create ConflictPair objects
-            conflicts = []
-            req_map = {req_id: text for req_id, text in requirements}
-            
-            for conflict in conflicts_data:
-                if all(k in conflict for k in ['req_a', 'req_b', 'reason', 'confidence']):
-                    conflicts.append(ConflictPair(
-                        req_a_id=conflict['req_a'],
-                        req_b_id=conflict['req_b'],
-                        req_a_text=req_map.get(conflict['req_a'], ''),
-                        req_b_text=req_map.get(conflict['req_b'], ''),
-                        reason=conflict['reason'],
-                        confidence=conflict['confidence'],
-                        cluster_id=cluster_id,
-                        timestamp=datetime.now().isoformat()
-                    ))
-            
-            return conflicts
+            conflicts_data = [
+                c for c in conflicts_data
+                if isinstance(c, dict) and all(k in c for k in ['req_a', 'req_b', 'reason', 'confidence'])
+            ]
+            return aliased.resolve(conflicts_data)
             
         except json.JSONDecodeError as e:
-            print(f"   ⚠️  JSON parsing error: {e}")
-            print(f"   Response: {response_text[:200]}...")
-            return []
+            logger.warning(f"⚠️  JSON parsing error: {e} (response preview: {response_text[:200]!r})")
+            return None
         except Exception as e:
-            print(f"   ⚠️  Error checking batch: {e}")
-            return []
+            logger.warning(f"⚠️  Error checking batch: {e}")
+            return None
+    
+    def _to_conflict_pair(self, raw: Dict, req_map: Dict[str, str], cluster_id: int) -> ConflictPair:
+        """Build a ConflictPair from a raw LLM/verdict dict."""
+        return ConflictPair(
+            req_a_id=raw['req_a'],
+            req_b_id=raw['req_b'],
+            req_a_text=req_map.get(raw['req_a'], ''),
+            req_b_text=req_map.get(raw['req_b'], ''),
+            reason=raw['reason'],
+            confidence=raw['confidence'],
+            cluster_id=cluster_id,
+            timestamp=datetime.now().isoformat()
+        )
+    
+    async def check_conflict_groups(
+        self,
+        groups: List[ConflictGroup],
+        on_group_done: Optional[Callable[[int, List[ConflictPair]], None]] = None,
+    ) -> List[List[ConflictPair]]:
+        """
+        Check several groups (clusters or pair batches) with as few LLM calls
+        as possible.
+        
+        Groups over the token budget are split, pairs already judged by this
+        model are answered from the verdict cache, and the remaining pieces
+        are bin-packed into prompts by estimated tokens.
+        
+        Args:
+            groups: Groups to check; pairs are only compared within a group
+            on_group_done: Called as on_group_done(index, conflicts) once the
+                last prompt covering a group has been answered
+            
+        Returns:
+            Conflicts per input group, aligned with `groups`
+        """
+        results: List[List[ConflictPair]] = [[] for _ in groups]
+        pending: List[Tuple[int, ConflictGroup]] = []
+        
+        for index, group in enumerate(groups):
+            for piece in split_group(group, self.prompt_token_budget, self.max_cluster_batch):
+                if len(piece.requirements) < 2:
+                    continue
+                if self.verdict_cache is None:
+                    pending.append((index, piece))
+                    continue
+                
+                req_map = dict(piece.requirements)
+                unjudged = []
+                for a, b in piece.candidate_pairs():
+                    verdict = self.verdict_cache.get(req_map[a], req_map[b], self.llm_model)
+                    if verdict is None:
+                        unjudged.append((a, b))
+                    elif verdict['conflict']:
+                        results[index].append(
+                            self._to_conflict_pair({'req_a': a, 'req_b': b, **verdict}, req_map, group.group_id)
+                        )
+                if not unjudged:
+                    self.cached_batches += 1
+                    continue
+                
+                keep = {req_id for pair in unjudged for req_id in pair}
+                prompt_requirements = [(req_id, text) for req_id, text in piece.requirements if req_id in keep]
+                all_pairs_count = len(prompt_requirements) * (len(prompt_requirements) - 1) // 2
+                explicit = piece.pairs is not None or (
+                    len(unjudged) < all_pairs_count and len(unjudged) <= self.max_pairs_per_prompt
+                )
+                pending.append((
+                    index,
+                    ConflictGroup(group.group_id, prompt_requirements, unjudged if explicit else None),
+                ))
+        
+        prompts = pack_groups(
+            [piece for _, piece in pending], self.prompt_token_budget, max(2, self.max_cluster_batch)
+        )
+        if len(prompts) < len(pending):
+            logger.info(f"📦 Packed {len(pending)} group(s) into {len(prompts)} prompt(s)")
+        
+        remaining = [0] * len(groups)
+        for members in prompts:
+            for index in {pending[m][0] for m in members}:
+                remaining[index] += 1
+        if on_group_done is not None:
+            for index, count in enumerate(remaining):
+                if count == 0:
+                    on_group_done(index, results[index])
+        
+        for members in tqdm(prompts, desc="Checking prompts", disable=len(prompts) < 2):
+            pieces = [pending[m][1] for m in members]
+            raw = await self._ask_llm_for_conflicts(pieces)
+            found_by_group: Dict[int, List[ConflictPair]] = {}
+            if raw is not None:
+                flagged = [{} for _ in pieces]
+                for position, conflict in raw:
+                    flagged[position][frozenset((conflict['req_a'], conflict['req_b']))] = conflict
+                for position, m in enumerate(members):
+                    index, piece = pending[m]
+                    req_map = dict(piece.requirements)
+                    for a, b in piece.candidate_pairs():
+                        found = flagged[position].get(frozenset((a, b)))
+                        if found is None:
+                            if self.verdict_cache is not None:
+                                self.verdict_cache.record(req_map[a], req_map[b], self.llm_model, conflict=False)
+                            continue
+                        if self.verdict_cache is not None:
+                            self.verdict_cache.record(
+                                req_map[a], req_map[b], self.llm_model,
+                                conflict=True,
+                                reason=found['reason'],
+                                confidence=found['confidence'],
+                                severity=found.get('severity', 'medium'),
+                            )
+                        conflict = self._to_conflict_pair(found, req_map, piece.group_id)
+                        results[index].append(conflict)
+                        found_by_group.setdefault(piece.group_id, []).append(conflict)
+            # A failed call judges nothing, so its pairs are retried next run
+            for group_id in sorted({pending[m][1].group_id for m in members}):
+                self._emit_batch(group_id, found_by_group.get(group_id, []))
+            for index in {pending[m][0] for m in members}:
+                remaining[index] -= 1
+                if remaining[index] == 0 and on_group_done is not None:
+                    on_group_done(index, results[index])
+        
+        return results
+    
+    async def check_conflicts_in_batch(
+        self,
+        requirements: List[Tuple[str, str]],
+        cluster_id: int,
+        pairs: Optional[List[Tuple[str, str]]] = None
+    ) -> List[ConflictPair]:
+        """
+        Use LLM to check for conflicts in a batch of requirements.
+        
+        Args:
+            requirements: List of (req_id, req_text) tuples
+            cluster_id: Cluster ID for tracking
+            pairs: Optional (req_id, req_id) pairs; when given, only these
+                pairs are asked about and returned
+            
+        Returns:
+            List of detected conflicts
+        """
+        results = await self.check_conflict_groups([ConflictGroup(cluster_id, requirements, pairs)])
+        return results[0]
     
-    def split_into_batches(self, items: List, batch_size: int) -> List[List]:
-        """Split a list into batches."""
-        return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    def _cluster_group(self, cluster_id: int, req_indices: List[int]) -> Optional[ConflictGroup]:
+        """Deduplicated requirements of one cluster, or None if fewer than two remain."""
+        req_indices = self.remove_near_duplicates(req_indices)
+        
+        if len(req_indices) < 2:
+            logger.info(f"⏭️  Skipping cluster {cluster_id}: < 2 unique requirements")
+            return None
+        
+        return ConflictGroup(
+            int(cluster_id),
+            [(self.requirements[i].req_id, self.requirements[i].text) for i in req_indices],
+        )
     
     async def detect_conflicts_in_cluster(
         self,
@@ -392,40 +575,60 @@ JSON output only:"""
         Returns:
             List of detected conflicts
         """
-        # Remove near-duplicates
-        req_indices = self.remove_near_duplicates(req_indices)
-        
-        if len(req_indices) < 2:
-            print(f"   ⏭️  Skipping cluster {cluster_id}: < 2 unique requirements")
+        group = self._cluster_group(cluster_id, req_indices)
+        if group is None:
             return []
         
-        # Get requirements
-        requirements = [
-            (self.requirements[i].req_id, self.requirements[i].text)
-            for i in req_indices
-        ]
+        logger.info(f"🔍 Checking cluster {cluster_id}: {len(group.requirements)} requirements")
+        results = await self.check_conflict_groups([group])
+        return results[0]
+    
+    async def detect_conflicts_knn(self) -> List[ConflictPair]:
+        """
+        Detect conflicts over ranked kNN candidate pairs.
+        
+        Unlike the cluster strategy, pairs that straddle clusters or involve
+        noise points are considered, and far-apart pairs inside a large
+        cluster are not. LLM cost is bounded by n * max_pairs_per_requirement.
+        """
+        logger.info(f"🔗 Building kNN candidate pairs (k={self.knn_k})...")
+        texts = [req.text for req in self.requirements]
+        pairs = await asyncio.to_thread(
+            generate_candidate_pairs,
+            self.embeddings,
+            texts,
+            k=self.knn_k,
+            min_similarity=self.min_pair_similarity,
+            max_similarity=self.similarity_threshold,
+            max_pairs_per_requirement=self.max_pairs_per_requirement,
+        )
+        batches = await asyncio.to_thread(pack_pairs, pairs, self.max_cluster_batch, self.max_pairs_per_prompt)
+        logger.info(f"📦 {len(pairs)} candidate pairs packed into {len(batches)} prompt(s)")
+        
+        groups = []
+        for batch in batches:
+            requirements = [(self.requirements[r].req_id, self.requirements[r].text) for r in batch["rows"]]
+            id_pairs = [(self.requirements[i].req_id, self.requirements[j].req_id) for i, j in batch["pairs"]]
+            # Report the shared cluster when both sides agree, otherwise -1
+            labels = {self.requirements[r].cluster_id for r in batch["rows"]}
+            cluster_id = labels.pop() if len(labels) == 1 else -1
+            groups.append(ConflictGroup(int(cluster_id), requirements, id_pairs))
         
-        print(f"   🔍 Checking cluster {cluster_id}: {len(requirements)} requirements")
+        per_batch = await self.check_conflict_groups(groups)
+        all_conflicts = [conflict for conflicts in per_batch for conflict in conflicts]
         
-        # Split into batches if too large
-        if len(requirements) <= self.max_cluster_batch:
-            return await self.check_conflicts_in_batch(requirements, cluster_id)
-        else:
-            # Split large cluster into batches
-            batches = self.split_into_batches(requirements, self.max_cluster_batch)
-            print(f"   📦 Split into {len(batches)} batches")
-            
-            all_conflicts = []
-            for batch_idx, batch in enumerate(batches, 1):
-                print(f"      Batch {batch_idx}/{len(batches)}")
-                conflicts = await self.check_conflicts_in_batch(batch, cluster_id)
-                all_conflicts.extend(conflicts)
-            
-            return all_conflicts
+        self.conflicts = all_conflicts
+        logger.info("✅ Conflict detection complete!")
+        logger.info(f"📊 Found {len(all_conflicts)} conflicts from {len(pairs)} candidate pairs")
+        
+        return all_conflicts
     
     async def detect_all_conflicts(self):
         """Detect conflicts across all clusters."""
-        print(f"\n🔍 Starting conflict detection across clusters...")
+        if self.candidate_strategy == "knn":
+            return await self.detect_conflicts_knn()
+        
+        logger.info("🔍 Starting conflict detection across clusters...")
         
         cluster_labels = np.array([req.cluster_id for req in self.requirements])
         unique_clusters = sorted(set(cluster_labels))
@@ -433,24 +636,36 @@ JSON output only:"""
         # Skip noise cluster (-1) - these are truly unique requirements unlikely to conflict
         noise_count = list(cluster_labels).count(-1)
         if noise_count > 0:
-            print(f"   ⏭️  Skipping {noise_count} noise/outlier requirements (semantically isolated)")
+            logger.info(f"⏭️  Skipping {noise_count} noise/outlier requirements (semantically isolated)")
         
         unique_clusters = [c for c in unique_clusters if c != -1]
         
-        all_conflicts = []
-        
-        for cluster_id in tqdm(unique_clusters, desc="Processing clusters"):
+        # Deduplicate every cluster first, then pack clusters into prompts
+        groups = []
+        for cluster_id in unique_clusters:
             cluster_indices = np.where(cluster_labels == cluster_id)[0].tolist()
             
+            group = None
             if len(cluster_indices) >= self.min_cluster_size:
-                conflicts = await self.detect_conflicts_in_cluster(cluster_id, cluster_indices)
-                all_conflicts.extend(conflicts)
+                group = self._cluster_group(cluster_id, cluster_indices)
             else:
-                print(f"   ⏭️  Skipping cluster {cluster_id}: only {len(cluster_indices)} requirement(s)")
+                logger.info(f"⏭️  Skipping cluster {cluster_id}: only {len(cluster_indices)} requirement(s)")
+            groups.append(group or ConflictGroup(int(cluster_id), []))
+        
+        completed = 0
+        
+        def cluster_done(index: int, conflicts: List[ConflictPair]):
+            nonlocal completed
+            completed += 1
+            self._emit("cluster", cluster_id=groups[index].group_id, completed=completed,
+                       total=len(groups), conflicts=len(conflicts))
+        
+        per_cluster = await self.check_conflict_groups(groups, on_group_done=cluster_done)
+        all_conflicts = [conflict for conflicts in per_cluster for conflict in conflicts]
         
         self.conflicts = all_conflicts
-        print(f"\n✅ Conflict detection complete!")
-        print(f"   📊 Found {len(all_conflicts)} conflicts across {len(unique_clusters)} clusters")
+        logger.info("✅ Conflict detection complete!")
+        logger.info(f"📊 Found {len(all_conflicts)} conflicts across {len(unique_clusters)} clusters")
         
         return all_conflicts
     
@@ -473,9 +688,10 @@ Return 1-3 tags from: Security, Performance, UI, UX, Database, API, Authenticati
 Response format (comma-separated): Security, Performance, API"""
 
         try:
-            response = self.llm_client.chat.completions.create(
-                model=self.llm_model,
-                messages=[{"role": "user", "content": prompt}],
+            response = create_completion(
+                self.llm_client,
+                self.llm_model,
+                [{"role": "user", "content": prompt}],
                 temperature=0.2,
                 max_tokens=50,
             )
@@ -485,7 +701,7 @@ Response format (comma-separated): Security, Performance, API"""
             return tags[:3]  # Limit to 3 tags
             
         except Exception as e:
-            print(f"   ⚠️  Error generating tags: {e}")
+            logger.warning(f"⚠️  Error generating tags: {e}")
             return []
     
     def add_tags_to_requirements(self, sample_size: int = 10):
@@ -495,14 +711,14 @@ Response format (comma-separated): Security, Performance, API"""
         Args:
             sample_size: Number of requirements to tag (for demo/testing)
         """
-        print(f"\n🏷️  Generating tags for {sample_size} sample requirements...")
+        logger.info(f"🏷️  Generating tags for {sample_size} sample requirements...")
         
         sample_reqs = self.requirements[:sample_size]
         
         for req in tqdm(sample_reqs, desc="Tagging"):
             req.tags = self.generate_tags(req.text)
         
-        print(f"✅ Tags generated")
+        logger.info("✅ Tags generated")
     
     def save_results(self):
         """Save all results to disk."""
@@ -513,14 +729,14 @@ Response format (comma-separated): Security, Performance, API"""
             conflicts_df = pd.DataFrame([asdict(c) for c in self.conflicts])
             conflicts_path = f"{self.output_dir}/conflicts_{timestamp}.csv"
             conflicts_df.to_csv(conflicts_path, index=False)
-            print(f"\n💾 Saved conflicts to: {conflicts_path}")
+            logger.info(f"💾 Saved conflicts to: {conflicts_path}")
         
         # Save requirement metadata
         metadata_path = f"{self.output_dir}/requirements_metadata_{timestamp}.json"
         metadata = [req.to_dict() for req in self.requirements]
         with open(metadata_path, 'w', encoding='utf-8') as f:
             json.dump(metadata, f, indent=2, ensure_ascii=False)
-        print(f"💾 Saved metadata to: {metadata_path}")
+        logger.info(f"💾 Saved metadata to: {metadata_path}")
         
         # Save training dataset (for future fine-tuning)
         if self.conflicts:
@@ -536,38 +752,39 @@ Response format (comma-separated): Security, Performance, API"""
             
             training_path = f"{self.output_dir}/training_data_{timestamp}.csv"
             pd.DataFrame(training_data).to_csv(training_path, index=False)
-            print(f"💾 Saved training data to: {training_path}")
+            logger.info(f"💾 Saved training data to: {training_path}")
+        
+        # Save near-duplicate groups (first ID is the one that was kept)
+        if self.duplicate_groups:
+            duplicates_path = f"{self.output_dir}/duplicate_groups_{timestamp}.json"
+            with open(duplicates_path, 'w', encoding='utf-8') as f:
+                json.dump(self.duplicate_groups, f, indent=2, ensure_ascii=False)
+            logger.info(f"💾 Saved duplicate groups to: {duplicates_path}")
     
-    def print_summary(self):
-        """Print summary of results."""
-        print("\n" + "="*60)
-        print("📊 CONFLICT DETECTION SUMMARY")
-        print("="*60)
-        
-        print(f"\n📈 Statistics:")
-        print(f"   Total requirements: {len(self.requirements)}")
-        print(f"   Total conflicts found: {len(self.conflicts)}")
-        
-        if self.conflicts:
-            # Conflicts by cluster
-            cluster_counts = pd.Series([c.cluster_id for c in self.conflicts]).value_counts()
-            print(f"\n📊 Conflicts by cluster:")
-            for cluster_id, count in cluster_counts.items():
-                print(f"   Cluster {cluster_id}: {count} conflicts")
-            
-            # Confidence distribution
-            confidence_counts = pd.Series([c.confidence for c in self.conflicts]).value_counts()
-            print(f"\n🎯 Confidence distribution:")
-            for conf, count in confidence_counts.items():
-                print(f"   {conf.capitalize()}: {count} conflicts")
-            
-            # Sample conflicts
-            print(f"\n📋 Sample conflicts:")
-            for i, conflict in enumerate(self.conflicts[:3], 1):
-                print(f"\n{i}. {conflict.req_a_id} ↔ {conflict.req_b_id} (Confidence: {conflict.confidence})")
-                print(f"   A: {conflict.req_a_text[:80]}...")
-                print(f"   B: {conflict.req_b_text[:80]}...")
-                print(f"   Reason: {conflict.reason}")
+    def log_summary(self):
+        """Log the run's counts as one record (structured fields in JSON logs)."""
+        summary: Dict[str, Any] = {
+            "requirements": len(self.requirements),
+            "conflicts": len(self.conflicts),
+            "duplicate_groups": len(self.duplicate_groups),
+            "conflicts_by_cluster": dict(Counter(str(c.cluster_id) for c in self.conflicts)),
+            "conflicts_by_confidence": dict(Counter(c.confidence for c in self.conflicts)),
+        }
+        if self.clustering_summary:
+            summary["clustering"] = self.clustering_summary
+        if self.verdict_cache is not None:
+            summary["cached_batches"] = self.cached_batches
+        
+        message = (
+            f"📊 Conflict detection summary: {summary['requirements']} requirements, "
+            f"{summary['conflicts']} conflicts, {summary['duplicate_groups']} near-duplicate groups removed"
+        )
+        if self.clustering_summary:
+            message += (f"; clustering {self.clustering_summary['backend']} in {self.clustering_summary['seconds']}s "
+                        f"(noise ratio {self.clustering_summary['noise_ratio']:.1%})")
+        if self.verdict_cache is not None:
+            message += f"; {self.cached_batches} batches from verdict cache"
+        logger.info(message, extra={"fields": summary})
     
     async def run(
         self,
@@ -578,7 +795,7 @@ Response format (comma-separated): Security, Performance, API"""
         tag_sample_size: int = 10
     ):
         """
-        Run the complete conflict detection pipeline.
+        Run the complete conflict detection pipeline on a CSV file.
         
         Args:
             csv_path: Path to requirements CSV
@@ -587,19 +804,44 @@ Response format (comma-separated): Security, Performance, API"""
             add_tags: Whether to generate semantic tags
             tag_sample_size: Number of requirements to tag
         """
-        print("\n🚀 Starting Domain-Agnostic Conflict Detection Pipeline")
-        print("="*60)
-        
         # Step 1: Load requirements
         ids, texts = self.load_requirements(csv_path, text_column, id_column)
         
-        # Step 2: Generate embeddings
-        self.embeddings = self.generate_embeddings(texts)
+        await self.run_on_requirements(ids, texts, add_tags=add_tags, tag_sample_size=tag_sample_size)
+    
+    async def run_on_requirements(
+        self,
+        ids: List[str],
+        texts: List[str],
+        add_tags: bool = False,
+        tag_sample_size: int = 10
+    ):
+        """
+        Run the conflict detection pipeline on in-memory requirements.
+        
+        Args:
+            ids: Requirement IDs
+            texts: Requirement texts aligned with ids
+            add_tags: Whether to generate semantic tags
+            tag_sample_size: Number of requirements to tag
+        """
+        logger.info("🚀 Starting Domain-Agnostic Conflict Detection Pipeline")
+        
+        ids = [str(req_id) for req_id in ids]
+        texts = [str(text) for text in texts]
+        
+        # Step 2: Generate embeddings (off the event loop; the model may be shared)
+        stage_start = time.perf_counter()
+        self.embeddings = await asyncio.to_thread(self.generate_embeddings, texts)
+        self._emit("stage", stage="embed", seconds=round(time.perf_counter() - stage_start, 3),
+                   requirements=len(texts))
         
         # Step 3: Cluster requirements
-        cluster_labels = self.cluster_requirements(self.embeddings)
+        cluster_labels = await asyncio.to_thread(self.cluster_requirements, self.embeddings)
+        self._emit("stage", stage="cluster", **(self.clustering_summary or {}))
         
         # Create requirement metadata objects
+        self.requirements = []
         for i, (req_id, text, cluster_id) in enumerate(zip(ids, texts, cluster_labels)):
             self.requirements.append(RequirementMetadata(
                 req_id=req_id,
@@ -609,8 +851,10 @@ Response format (comma-separated): Security, Performance, API"""
                 tags=None
             ))
         
-        # Step 4: Detect conflicts
+        # Step 4: Detect conflicts (near-duplicates are removed per cluster along the way)
         await self.detect_all_conflicts()
+        self._emit("stage", stage="dedupe", seconds=round(self.dedupe_seconds, 3),
+                   duplicate_groups=len(self.duplicate_groups))
         
         # Step 5: Optional tagging
         if add_tags:
@@ -618,12 +862,13 @@ Response format (comma-separated): Security, Performance, API"""
         
         # Step 6: Save results
         self.save_results()
+        if self.verdict_cache is not None:
+            await asyncio.to_thread(self.verdict_cache.save)
         
-        # Step 7: Print summary
-        self.print_summary()
+        # Step 7: Log summary
+        self.log_summary()
         
-        print("\n✨ Pipeline complete!")
-
+        logger.info("✨ Pipeline complete!")
 
 async def main():
     """Example usage."""
@@ -637,15 +882,28 @@ async def main():
     parser.add_argument("--add-tags", action="store_true", help="Generate semantic tags")
     parser.add_argument("--tag-sample", type=int, default=10, help="Number of requirements to tag")
     parser.add_argument("--min-cluster-size", type=int, default=2, help="Minimum cluster size")
-    parser.add_argument("--max-batch", type=int, default=30, help="Max requirements per LLM batch")
+    parser.add_argument("--max-batch", type=int, default=30, help="Max requirements per LLM prompt")
+    parser.add_argument("--prompt-tokens", type=int, default=1500, help="Token budget for requirement text per LLM prompt")
+    parser.add_argument("--candidate-strategy", choices=["cluster", "knn"], default="cluster", help="How to pick pairs for the LLM")
+    parser.add_argument("--knn-k", type=int, default=10, help="Neighbours per requirement (knn strategy)")
+    parser.add_argument("--clustering-backend", choices=["auto", "hdbscan", "partitioned", "leader"], default="auto", help="Clustering backend")
+    parser.add_argument("--reduce-dims", type=int, default=None, help="PCA dimensions before clustering")
+    parser.add_argument("--cluster-jobs", type=int, default=-1, help="Parallel jobs for HDBSCAN core distances")
     
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     
     # Initialize detector
     detector = DomainAgnosticConflictDetector(
         output_dir=args.output_dir,
         min_cluster_size=args.min_cluster_size,
         max_cluster_batch=args.max_batch,
+        prompt_token_budget=args.prompt_tokens,
+        candidate_strategy=args.candidate_strategy,
+        knn_k=args.knn_k,
+        clustering_backend=args.clustering_backend,
+        reduce_dims=args.reduce_dims,
+        cluster_n_jobs=args.cluster_jobs,
     )
     
     # Run pipeline
@@ -0,0 +1,204 @@
+"""
+incremental_json.py
+Incremental parser that pulls complete objects out of a streamed JSON array.
+
+LLM completions arrive a few characters at a time and are sometimes cut off
+or slightly malformed. Instead of waiting for the whole document and then
+failing on one bad character, this parser yields every array item as soon
+as its closing brace arrives. A truncated tail only loses the item that was
+still open.
+
+Accepted shapes:
+    {"requirements": [ {...}, {...} ]}   (the array under the "requirements" key,
+                                           at any depth and after other fields)
+    [ {...}, {...} ]                     (an array that starts the document or
+                                           the first line after a code fence)
+Markdown code fences and chatter around the JSON are ignored, including
+brackets in the chatter.
+"""
+
+import json
+import re
+from typing import Any, Dict, List
+
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+
+
+class IncrementalArrayParser:
+    """
+    Feed text fragments; collect each object of the target JSON array as it closes.
+
+    Usage:
+        parser = IncrementalArrayParser()
+        for delta in stream:
+            for item in parser.feed(delta):
+                handle(item)
+        parser.close()
+
+    Args:
+        key: Object key whose array value holds the items
+    """
+
+    def __init__(self, key: str = "requirements"):
+        self.key = key
+        self._buffer: List[str] = []   # characters of the object currently open
+        self._depth = 0                # nesting depth of {} and [] outside strings
+        self._array_depth = None       # depth of the target array once found
+        self._in_string = False
+        self._escape = False
+        self._in_comment = False
+        self._done = False
+        # Until the target array is found: the string just closed (a possible
+        # key), the key followed by ":", the current line, and whether only
+        # whitespace or a code fence has been seen so far
+        self._string: List[str] = []
+        self._last_string = None
+        self._colon_key = None
+        self._line: List[str] = []
+        self._at_start = True
+        self.items_emitted = 0
+        self.items_invalid = 0
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """
+        Consume a fragment of the stream.
+
+        Args:
+            text: Next piece of completion text
+
+        Returns:
+            Objects completed by this fragment (possibly empty)
+        """
+        completed: List[Dict[str, Any]] = []
+        if self._done or not text:
+            return completed
+
+        for ch in text:
+            in_item = self._array_depth is not None and self._depth > self._array_depth
+
+            if self._in_comment:
+                # Models sometimes echo the "# Optional" annotations from the prompt template
+                if ch == "\n":
+                    self._in_comment = False
+                    if in_item:
+                        self._buffer.append(ch)
+                continue
+
+            if self._in_string:
+                if in_item:
+                    self._buffer.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._array_depth is None:
+                        self._last_string = "".join(self._string)
+                    continue
+                if self._array_depth is None:
+                    self._string.append(ch)
+                continue
+
+            if self._array_depth is None and self._search(ch):
+                # This "[" opens the target array
+                self._depth += 1
+                self._array_depth = self._depth
+                continue
+
+            if ch == "#" and in_item:
+                self._in_comment = True
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string = []
+                if in_item:
+                    self._buffer.append(ch)
+                continue
+
+            if ch in "{[":
+                self._depth += 1
+                if self._array_depth is not None and self._depth > self._array_depth:
+                    self._buffer.append(ch)
+                continue
+
+            if ch in "}]":
+                if in_item:
+                    self._buffer.append(ch)
+                self._depth -= 1
+                if self._array_depth is not None:
+                    if self._depth == self._array_depth and in_item:
+                        item = self._decode(''.join(self._buffer))
+                        self._buffer = []
+                        if item is not None:
+                            completed.append(item)
+                    elif self._depth < self._array_depth:
+                        # Target array closed: ignore anything after it
+                        self._done = True
+                        break
+                continue
+
+            if in_item:
+                self._buffer.append(ch)
+
+        return completed
+
+    def _search(self, ch: str) -> bool:
+        """
+        Track the text before the target array (outside strings); True if
+        `ch` is the "[" that opens it.
+        """
+        if ch == "\n":
+            if "".join(self._line).strip().startswith("```"):
+                self._at_start = True
+            self._line = []
+            return False
+        if ch.isspace():
+            return False
+
+        if ch == ":" and self._last_string is not None:
+            self._colon_key, self._last_string = self._last_string, None
+            return False
+        is_target = ch == "[" and (self._colon_key == self.key or self._at_start)
+        self._last_string = self._colon_key = None
+
+        self._line.append(ch)
+        if not "".join(self._line).lstrip().startswith("```"[:len(self._line)]):
+            self._at_start = False
+        return is_target
+
+    def _decode(self, raw: str):
+        """Decode one item, tolerating trailing commas; None if still invalid."""
+        for candidate in (raw, _TRAILING_COMMA_RE.sub(r"\1", raw)):
+            try:
+                value = json.loads(candidate)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(value, dict):
+                self.items_emitted += 1
+                return value
+            break
+        self.items_invalid += 1
+        return None
+
+    @property
+    def has_partial_item(self) -> bool:
+        """True if the stream stopped in the middle of an item."""
+        return bool(self._buffer)
+
+    def close(self) -> Dict[str, Any]:
+        """
+        Finish parsing and report what happened to the tail.
+
+        Returns:
+            Dict with emitted, invalid and dropped_partial counts
+        """
+        dropped = 1 if self.has_partial_item else 0
+        self._buffer = []
+        self._done = True
+        return {
+            "emitted": self.items_emitted,
+            "invalid": self.items_invalid,
+            "dropped_partial": dropped,
+        }
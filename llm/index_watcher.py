@@ -0,0 +1,163 @@
+"""
+index_watcher.py
+Hot reload of an on-disk FAISS index + metadata pair.
+
+The watcher polls the files' version token (mtime and size of both files).
+When it changes and neither file was modified during a short settle period
+(so a rebuild that is still writing is not picked up), the new snapshot is
+loaded off the event loop and swapped in with a single reference
+assignment. Readers take the current snapshot once and use its index and
+chunks together, so a query never mixes an old index with new metadata.
+
+A failed load keeps serving the previous snapshot and is retried with
+exponential backoff. The background poll only starts loading once a first
+load was requested through refresh(), so an unused index costs nothing.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from kb_cache import kb_version_token
+
+# load(index_path, meta_path) -> (index, chunks)
+Loader = Callable[[str, str], Tuple[Any, List[Dict[str, Any]]]]
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class IndexSnapshot:
+    """An index and its chunks, loaded together from one version of the files."""
+    index: Any
+    chunks: List[Dict[str, Any]]
+    version: str
+    loaded_at: float
+
+
+class IndexWatcher:
+    """
+    Keeps the newest loadable snapshot of an index/metadata pair.
+
+    Args:
+        load: Reads (index, chunks) from the two paths
+        index_path: FAISS index file
+        meta_path: Metadata (chunks) file
+        poll_seconds: Interval between version checks in the background task
+        settle_seconds: Minimum age of the newest file before a version is loaded
+        retry_seconds: First retry delay after a failed load (doubles per failure)
+        max_retry_seconds: Upper bound of the retry delay
+    """
+
+    def __init__(
+        self,
+        load: Loader,
+        index_path: str,
+        meta_path: str,
+        poll_seconds: float = 10.0,
+        settle_seconds: float = 2.0,
+        retry_seconds: float = 5.0,
+        max_retry_seconds: float = 300.0,
+    ):
+        self.load = load
+        self.index_path = index_path
+        self.meta_path = meta_path
+        self.poll_seconds = poll_seconds
+        self.settle_seconds = settle_seconds
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self._snapshot: Optional[IndexSnapshot] = None
+        self._load_lock = threading.Lock()
+        self._failures = 0
+        self._retry_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._requested = False
+        self.reloads = 0
+        self.last_error: Optional[str] = None
+
+    def current(self) -> Optional[IndexSnapshot]:
+        """The snapshot to serve from (None until one loaded successfully)."""
+        return self._snapshot
+
+    def refresh(self, wait_for_settle: bool = True) -> Optional[IndexSnapshot]:
+        """
+        Load the files if they changed since the current snapshot (blocking).
+
+        Args:
+            wait_for_settle: Skip versions that changed less than settle_seconds
+                ago (the background poll); the first load does not wait
+
+        Returns:
+            The current snapshot after the check
+        """
+        if not wait_for_settle:
+            self._requested = True
+        version = kb_version_token(self.index_path, self.meta_path)
+        snapshot = self._snapshot
+        if "missing" in version or (snapshot is not None and snapshot.version == version):
+            return snapshot
+
+        if wait_for_settle and time.time() - self._newest_mtime() < self.settle_seconds:
+            return snapshot
+        if time.monotonic() < self._retry_at:
+            return snapshot
+
+        with self._load_lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.version == version:
+                return snapshot
+            try:
+                index, chunks = self.load(self.index_path, self.meta_path)
+                # Files rewritten while loading: the pair may be inconsistent, try again later
+                if kb_version_token(self.index_path, self.meta_path) != version:
+                    return self._snapshot
+                self._snapshot = IndexSnapshot(index=index, chunks=chunks, version=version, loaded_at=time.time())
+                self._failures, self._retry_at, self.last_error = 0, 0.0, None
+                self.reloads += 1
+            except Exception as e:
+                self._failures += 1
+                delay = min(self.max_retry_seconds, self.retry_seconds * 2 ** (self._failures - 1))
+                self._retry_at = time.monotonic() + delay
+                self.last_error = str(e)
+                logger.warning(f"Index load failed ({self.index_path}), retrying in {delay:.0f}s: {e}")
+            return self._snapshot
+
+    def _newest_mtime(self) -> float:
+        try:
+            return max(os.stat(self.index_path).st_mtime, os.stat(self.meta_path).st_mtime)
+        except OSError:
+            return time.time()
+
+    def start(self):
+        """Start the background poll on the running event loop (idempotent)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._watch())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _watch(self):
+        while True:
+            try:
+                if self._requested:
+                    await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.exception(f"Index watcher error: {e}")
+            await asyncio.sleep(self.poll_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            "loaded": snapshot is not None,
+            "version": snapshot.version if snapshot else None,
+            "loaded_at": snapshot.loaded_at if snapshot else None,
+            "reloads": self.reloads,
+            "failures": self._failures,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,190 @@
+"""
+job_events.py
+Progress events for long-running jobs, delivered as Server-Sent Events.
+
+A run publishes events (stage timings, per-cluster completion, partial
+results) into a stream. Clients subscribe by job id and receive the full
+history followed by live events until the run finishes, so a subscriber that
+connects late - or before the job has started - still sees everything.
+Several job ids can point at the same run (coalesced identical requests).
+
+All methods must be called from the event loop thread.
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi.responses import StreamingResponse
+
+# Event types that end a stream
+TERMINAL_EVENTS = {"done", "error"}
+
+
+class _Stream:
+    def __init__(self):
+        self.history: List[Dict[str, Any]] = []
+        self.subscribers: List[asyncio.Queue] = []
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+
+
+class JobEventBus:
+    """
+    Per-run event streams with replay.
+
+    Args:
+        retention_seconds: How long finished streams stay available
+        max_streams: Upper bound on streams kept (oldest finished go first)
+    """
+
+    def __init__(self, retention_seconds: float = 900, max_streams: int = 256):
+        self.retention_seconds = retention_seconds
+        self.max_streams = max_streams
+        self._streams: "OrderedDict[str, _Stream]" = OrderedDict()
+        self._aliases: Dict[str, str] = {}
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+
+    def link(self, job_id: str, run_key: str):
+        """
+        Make `job_id` an alias for the run `run_key`.
+
+        Creates the stream if needed; a finished stream under the same key
+        is replaced, since linking means a new run is about to start.
+        """
+        stream = self._streams.get(run_key)
+        if stream is not None and stream.finished_at is not None:
+            del self._streams[run_key]
+        self._stream(run_key)
+        self._aliases[job_id] = run_key
+        for waiter in self._waiters.pop(job_id, []):
+            if not waiter.done():
+                waiter.set_result(run_key)
+
+    def publish(self, run_key: str, event_type: str, **data):
+        """Append an event to a run and fan it out to current subscribers."""
+        stream = self._stream(run_key)
+        if stream.finished_at is not None:
+            return
+        event = {"type": event_type, "ts": round(time.time() - stream.started_at, 3), **data}
+        stream.history.append(event)
+        for queue in stream.subscribers:
+            queue.put_nowait(event)
+        if event_type in TERMINAL_EVENTS:
+            stream.finished_at = time.time()
+
+    async def subscribe(self, job_id: str, wait_seconds: float = 30) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield a job's events from the beginning until the run finishes.
+
+        Waits up to `wait_seconds` for the job to appear; yields a single
+        error event if it never does.
+        """
+        run_key = self._aliases.get(job_id)
+        if run_key is None:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.setdefault(job_id, []).append(waiter)
+            try:
+                run_key = await asyncio.wait_for(waiter, wait_seconds)
+            except asyncio.TimeoutError:
+                yield {"type": "error", "error": f"Unknown job: {job_id}"}
+                return
+            finally:
+                waiters = self._waiters.get(job_id, [])
+                if waiter in waiters:
+                    waiters.remove(waiter)
+                if not waiters:
+                    self._waiters.pop(job_id, None)
+
+        stream = self._streams.get(run_key)
+        if stream is None:
+            yield {"type": "error", "error": f"Events for job {job_id} expired"}
+            return
+
+        # History snapshot and registration happen without an await in between
+        backlog = list(stream.history)
+        queue: Optional[asyncio.Queue] = None
+        if stream.finished_at is None:
+            queue = asyncio.Queue()
+            stream.subscribers.append(queue)
+        try:
+            for event in backlog:
+                yield event
+            while queue is not None:
+                event = await queue.get()
+                yield event
+                if event["type"] in TERMINAL_EVENTS:
+                    break
+        finally:
+            if queue is not None and queue in stream.subscribers:
+                stream.subscribers.remove(queue)
+
+    def _stream(self, run_key: str) -> _Stream:
+        stream = self._streams.get(run_key)
+        if stream is None:
+            self._prune()
+            stream = self._streams[run_key] = _Stream()
+        return stream
+
+    def _prune(self):
+        now = time.time()
+        expired = [
+            key for key, s in self._streams.items()
+            if s.finished_at is not None and now - s.finished_at > self.retention_seconds
+        ]
+        finished = [key for key, s in self._streams.items() if s.finished_at is not None]
+        overflow = max(0, len(self._streams) - len(expired) + 1 - self.max_streams)
+        for key in expired + [k for k in finished if k not in expired][:overflow]:
+            self._streams.pop(key, None)
+        live = set(self._streams)
+        self._aliases = {job: key for job, key in self._aliases.items() if key in live}
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """Encode one event as an SSE frame (event name = event type)."""
+    return f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+def sse_response(bus: JobEventBus, job_id: str, heartbeat_seconds: float = 15) -> StreamingResponse:
+    """
+    StreamingResponse that relays a job's events as Server-Sent Events.
+
+    A comment line is sent every `heartbeat_seconds` without events so
+    proxies keep the connection open.
+    """
+
+    async def generate():
+        events = bus.subscribe(job_id).__aiter__()
+        next_event = asyncio.ensure_future(events.__anext__())
+        try:
+            while True:
+                done, _ = await asyncio.wait({next_event}, timeout=heartbeat_seconds)
+                if not done:
+                    yield ": keep-alive\n\n"
+                    continue
+                try:
+                    event = next_event.result()
+                except StopAsyncIteration:
+                    break
+                yield format_sse(event)
+                if event["type"] in TERMINAL_EVENTS:
+                    break
+                next_event = asyncio.ensure_future(events.__anext__())
+        finally:
+            next_event.cancel()
+            try:
+                await next_event
+            except (asyncio.CancelledError, Exception):
+                pass
+            await events.aclose()
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,94 @@
+"""
+kb_cache.py
+In-memory cache of loaded per-project knowledge base indexes.
+
+Reading a FAISS index and its pickled metadata from disk on every query
+dominates the cost of small KB lookups. Loaded indexes are kept per
+project together with the KB version token they were read at, so a
+rebuilt or extended KB is picked up on the next lookup while unchanged
+KBs are served from memory. The least recently used projects are evicted
+first.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+
+def kb_version_token(index_path: str, meta_path: str) -> str:
+    """Cheap KB version token from file stats (changes whenever the KB is rebuilt or extended)."""
+    parts = []
+    for path in (index_path, meta_path):
+        try:
+            st = os.stat(path)
+            parts.append(f"{st.st_mtime_ns}-{st.st_size}")
+        except OSError:
+            parts.append("missing")
+    return "|".join(parts)
+
+
+@dataclass
+class CachedIndex:
+    """A project's index and chunks as loaded at `version`."""
+    index: Any
+    chunks: List[Dict[str, Any]]
+    version: str
+
+
+class ProjectIndexCache:
+    """
+    LRU of loaded project indexes, validated by version token.
+
+    Args:
+        max_projects: Projects kept in memory (least recently used go first)
+    """
+
+    def __init__(self, max_projects: int = 16):
+        self.max_projects = max_projects
+        self._entries: "OrderedDict[str, CachedIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, project_id: str, version: str) -> Optional[CachedIndex]:
+        """Cached index of a project if it was loaded at this version."""
+        key = str(project_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def peek(self, project_id: str, version: str) -> Optional[CachedIndex]:
+        """Like get(), but does not count a hit or miss or refresh recency."""
+        with self._lock:
+            entry = self._entries.get(str(project_id))
+            return entry if entry is not None and entry.version == version else None
+
+    def put(self, project_id: str, version: str, index: Any, chunks: List[Dict[str, Any]]) -> CachedIndex:
+        """Store a freshly loaded index (replacing any older version)."""
+        key = str(project_id)
+        entry = CachedIndex(index=index, chunks=chunks, version=version)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_projects:
+                self._entries.popitem(last=False)
+        return entry
+
+    def drop(self, project_id: str):
+        """Forget a project's index."""
+        with self._lock:
+            self._entries.pop(str(project_id), None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"projects": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,60 @@
+"""
+llm_calls.py
+Instrumented LLM completions shared by the API and the conflict detector.
+
+Every completion, whichever client or model it uses, goes through
+observe_llm_call so latency, tokens, errors and in-flight calls are
+recorded on the same Prometheus metrics and as the "llm" stage of the
+current request trace.
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+from metrics import LLM_ERRORS, LLM_IN_FLIGHT, LLM_SECONDS, LLM_TOKENS, current_endpoint
+from tracing import record
+
+
+@contextmanager
+def observe_llm_call(model: str) -> Iterator[str]:
+    """
+    Record one LLM call made inside the block.
+
+    Yields the endpoint label, for observe_tokens() once usage is known.
+    """
+    endpoint = current_endpoint.get()
+    LLM_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    try:
+        yield endpoint
+    except Exception:
+        LLM_ERRORS.labels(endpoint, model).inc()
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        LLM_IN_FLIGHT.dec()
+        LLM_SECONDS.labels(endpoint, model).observe(seconds)
+        record("llm", seconds)
+
+
+def observe_tokens(endpoint: str, model: str, tokens: int):
+    LLM_TOKENS.labels(endpoint, model).observe(tokens)
+
+
+def create_completion(client, model: str, messages: List[Dict[str, Any]], **kwargs):
+    """
+    Blocking, non-streaming client.chat.completions.create with metrics.
+
+    Args:
+        client: Groq (or OpenAI-compatible) client
+        model: Model name (also the metrics label)
+        messages: Chat messages
+        kwargs: Other completion parameters (max_tokens, temperature, ...)
+    """
+    with observe_llm_call(model) as endpoint:
+        completion = client.chat.completions.create(model=model, messages=messages, **kwargs)
+    usage = getattr(completion, "usage", None)
+    if usage is not None and getattr(usage, "total_tokens", None):
+        observe_tokens(endpoint, model, usage.total_tokens)
+    return completion
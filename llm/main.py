@@ -12,16 +12,24 @@ from fastapi import (
     Depends,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security import APIKeyHeader
+from starlette.routing import Match
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any, Tuple
+from typing import List, Optional, Dict, Any, Tuple, Union, Callable
 from groq import Groq
 import os
 import json
+import re
 import uuid
+import time
 import asyncio
+import logging
+import threading
+from contextvars import ContextVar
 from dotenv import load_dotenv
 from datetime import datetime
+import numpy as np
 
 # Lazy import of RagManager (may raise at runtime if deps missing)
 try:
@@ -35,19 +43,47 @@ try:
 except Exception:
     build_index_for_project = None
 
+from single_flight import get_group, make_key, get_all_stats
+from document_chunking import split_document
+from incremental_json import IncrementalArrayParser
+from conflict_state import ConflictStateStore, ProjectConflictState, text_hash
+from candidate_pairs import generate_candidate_pairs, pack_pairs
+from verdict_cache import PairVerdictCache, shared_verdict_caches
+from dedupe import remove_near_duplicates
+from clustering import cluster_embeddings, predict_labels
+from job_events import JobEventBus, sse_response
+from prompt_packing import AliasedPrompt, ConflictGroup, pack_groups, split_group
+from chat_prompt import assemble_chat_prompt
+from chat_history import TurnEmbeddingCache, conversation_key, select_turns, turn_hash
+from chat_sessions import ChatSessionStore
+from chat_summary import RollingSummaries
+from persona_manager import persona_registry
+from persona_batch import build_batch_prompt, pack_requirements, parse_batch_views
+from token_utils import truncate_to_tokens
+from semantic_router import RouteDecision, SemanticRouter, load_examples
+from kb_cache import ProjectIndexCache, kb_version_token
+from index_watcher import IndexWatcher
+from llm_calls import create_completion, observe_llm_call, observe_tokens
+from metrics import (
+    EMBED_SECONDS,
+    current_endpoint,
+    register_stats,
+    render as render_metrics,
+)
+from tracing import REQUEST_ID_HEADER, configure_logging, request_id_from, span, start_trace
+
 # Import domain-agnostic conflict detection dependencies
+# (hdbscan is optional: clustering.py falls back to leader clustering without it)
 try:
     from sentence_transformers import SentenceTransformer
-    import hdbscan
-    from sklearn.metrics.pairwise import cosine_similarity
     CONFLICT_DETECTION_AVAILABLE = True
 except ImportError:
     CONFLICT_DETECTION_AVAILABLE = False
     SentenceTransformer = None
-    hdbscan = None
-    cosine_similarity = None
 
 load_dotenv()
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="AI Requirements Generation Service",
@@ -68,9 +104,7 @@ app.add_middleware(
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 if not GROQ_API_KEY:
     # Visible runtime warning to help developers during local development
-    print(
-        "WARNING: GROQ_API_KEY is not set. Groq calls will fail until you set this in your .env file."
-    )
+    logger.warning("GROQ_API_KEY is not set. Groq calls will fail until you set this in your .env file.")
 
 groq_client = Groq(api_key=GROQ_API_KEY)
 DEFAULT_MODEL = os.getenv("GROQ_MODEL", "moonshotai/kimi-k2-instruct-0905")
@@ -82,6 +116,10 @@ api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 # Knowledge Base configuration
 KB_BASE_DIR = os.getenv("KB_BASE_DIR", "faiss_store")
 KB_MODEL = os.getenv("KB_MODEL", "all-MiniLM-L6-v2")
+# Loaded project KB indexes kept in memory (shared by /kb/query and /api/chat)
+KB_CACHE_PROJECTS = int(os.getenv("KB_CACHE_PROJECTS", "16"))
+# Project KB chunks added to every chat message (as Laravel's /kb/query did)
+KB_CHAT_TOP_K = int(os.getenv("KB_CHAT_TOP_K", "5"))
 
 # In-memory job tracking (use Redis/DB in production)
 _build_jobs: Dict[str, Dict[str, Any]] = {}
@@ -150,7 +188,7 @@ if _contains_control_chars(_raw_rag_index):
                             RAG_INDEX_PATH = os.path.normpath(raw_val)
                     break
     except Exception as e:
-        print(f"Failed to parse raw .env for RAG_INDEX_PATH fallback: {e}")
+        logger.warning(f"Failed to parse raw .env for RAG_INDEX_PATH fallback: {e}")
 
 _raw_rag_meta = _clean_env(os.getenv("RAG_META_PATH", "llm/faiss_store/faiss_meta.pkl"))
 RAG_META_PATH = (
@@ -178,24 +216,118 @@ if _contains_control_chars(_raw_rag_meta):
                             RAG_META_PATH = os.path.normpath(raw_val)
                     break
     except Exception as e:
-        print(f"Failed to parse raw .env for RAG_META_PATH fallback: {e}")
+        logger.warning(f"Failed to parse raw .env for RAG_META_PATH fallback: {e}")
 
 _raw_rag_model = _clean_env(os.getenv("RAG_MODEL", "all-MiniLM-L6-v2"))
 RAG_MODEL = _raw_rag_model or "all-MiniLM-L6-v2"
 RAG_TOP_K = int(os.getenv("RAG_TOP_K", "5"))
+# Seconds between checks of the global index files for a rebuild (0 = never reload)
+RAG_RELOAD_SECONDS = float(os.getenv("RAG_RELOAD_SECONDS", "10"))
+# Retrieved chunks scoring below this are dropped
 RAG_SIM_THRESHOLD = float(os.getenv("RAG_SIM_THRESHOLD", "0.35"))
-# comma-separated keywords that strongly signal RAG is needed
-RAG_KEYWORDS = os.getenv(
-    "RAG_KEYWORDS",
-    "requirement,requirements,specification,standard,security,privacy,compliance,regulation,payment,billing",
-).split(",")
+# Semantic router: example utterances (JSON file, empty = built-in), centroid cache, decision margin
+RAG_ROUTER_EXAMPLES = _clean_env(os.getenv("RAG_ROUTER_EXAMPLES", ""))
+RAG_ROUTER_PATH = _clean_env(os.getenv("RAG_ROUTER_PATH", "data/rag_router.npz"))
+RAG_ROUTER_MARGIN = float(os.getenv("RAG_ROUTER_MARGIN", "0.0"))
+# Chat prompt budget (prompt tokens; the 2000-token response is on top) and the
+# word-overlap ratio above which retrieved chunks count as duplicates
+CHAT_PROMPT_TOKEN_BUDGET = int(os.getenv("CHAT_PROMPT_TOKEN_BUDGET", "6000"))
+CHAT_RAG_DEDUP_THRESHOLD = float(os.getenv("CHAT_RAG_DEDUP_THRESHOLD", "0.9"))
+# History selection: always the last N turns, plus the K earlier turns most
+# relevant to the new message (0 = plain recency)
+CHAT_HISTORY_RECENT = int(os.getenv("CHAT_HISTORY_RECENT", "6"))
+CHAT_HISTORY_RELEVANT = int(os.getenv("CHAT_HISTORY_RELEVANT", "6"))
+CHAT_HISTORY_CACHE_CONVERSATIONS = int(os.getenv("CHAT_HISTORY_CACHE_CONVERSATIONS", "256"))
+# Server-side chat sessions (delta protocol): idle TTL and number kept
+CHAT_SESSIONS_ENABLED = os.getenv("CHAT_SESSIONS_ENABLED", "true").lower() in ("1", "true", "yes")
+CHAT_SESSION_TTL_SECONDS = int(os.getenv("CHAT_SESSION_TTL_SECONDS", "3600"))
+CHAT_SESSION_MAX = int(os.getenv("CHAT_SESSION_MAX", "1024"))
+# Rolling conversation summaries: history tokens that trigger a background fold
+# (0 = off), turns never folded, and the (cheap) model doing the folding
+CHAT_SUMMARY_TRIGGER_TOKENS = int(os.getenv("CHAT_SUMMARY_TRIGGER_TOKENS", "3000"))
+CHAT_SUMMARY_KEEP_RECENT = int(os.getenv("CHAT_SUMMARY_KEEP_RECENT", "6"))
+CHAT_SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "llama-3.1-8b-instant")
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "400"))
+
+# Map-reduce extraction for long documents
+EXTRACTION_CHUNK_TOKENS = int(os.getenv("EXTRACTION_CHUNK_TOKENS", "2500"))
+EXTRACTION_MAX_CONCURRENCY = int(os.getenv("EXTRACTION_MAX_CONCURRENCY", "4"))
+EXTRACTION_DEDUP_THRESHOLD = float(os.getenv("EXTRACTION_DEDUP_THRESHOLD", "0.92"))
+
+# Batch persona views: requirements packed per prompt, prompts in flight at once (process-wide)
+PERSONA_BATCH_PROMPT_TOKENS = int(os.getenv("PERSONA_BATCH_PROMPT_TOKENS", "1500"))
+PERSONA_BATCH_MAX_REQUIREMENTS = int(os.getenv("PERSONA_BATCH_MAX_REQUIREMENTS", "8"))
+PERSONA_BATCH_MAX_CONCURRENCY = int(os.getenv("PERSONA_BATCH_MAX_CONCURRENCY", "4"))
+
+# Multi-persona analysis: per-persona calls (same concurrency limit) and a cheap merge pass
+PERSONA_ANALYSIS_MAX_TOKENS = int(os.getenv("PERSONA_ANALYSIS_MAX_TOKENS", "1200"))
+PERSONA_MERGE_MODEL = os.getenv("PERSONA_MERGE_MODEL", "llama-3.1-8b-instant")
+PERSONA_MERGE_MAX_TOKENS = int(os.getenv("PERSONA_MERGE_MAX_TOKENS", "800"))
+# Analyses are truncated to share this many tokens in the merge prompt
+PERSONA_MERGE_INPUT_TOKENS = int(os.getenv("PERSONA_MERGE_INPUT_TOKENS", "4000"))
+
+# kNN candidate pairs: pairs packed into one prompt
+CONFLICT_MAX_PAIRS_PER_PROMPT = int(os.getenv("CONFLICT_MAX_PAIRS_PER_PROMPT", "40"))
+# Estimated tokens of requirement text per conflict-check prompt; large clusters
+# are split and small ones packed together up to this budget
+CONFLICT_PROMPT_TOKEN_BUDGET = int(os.getenv("CONFLICT_PROMPT_TOKEN_BUDGET", "1500"))
+
+# Incremental conflict detection (per-project state from the previous run)
+CONFLICT_STATE_DIR = os.getenv("CONFLICT_STATE_DIR", "data/conflict_state")
+CONFLICT_INCREMENTAL_NEIGHBORS = int(os.getenv("CONFLICT_INCREMENTAL_NEIGHBORS", "8"))
+CONFLICT_NEIGHBOR_MIN_SIM = float(os.getenv("CONFLICT_NEIGHBOR_MIN_SIM", "0.5"))
+# Above this fraction of new/changed requirements a full re-cluster is cheaper and more accurate
+CONFLICT_RECLUSTER_RATIO = float(os.getenv("CONFLICT_RECLUSTER_RATIO", "0.3"))
+
+# Clustering stage: backend ("auto", "hdbscan", "partitioned", "leader"),
+# optional PCA dimensions (0 = off) and HDBSCAN core-distance jobs (-1 = all cores)
+CONFLICT_CLUSTER_BACKEND = os.getenv("CONFLICT_CLUSTER_BACKEND", "auto")
+CONFLICT_REDUCE_DIMS = int(os.getenv("CONFLICT_REDUCE_DIMS", "0"))
+CONFLICT_CLUSTER_N_JOBS = int(os.getenv("CONFLICT_CLUSTER_N_JOBS", "-1"))
 
 # Internal state for RAG and conflict detection
 _rag_manager = None
-_rag_index = None
-_rag_chunks = None
-_rag_available = False
+_rag_manager_lock = threading.Lock()
+# Global index snapshot, reloaded in the background when the files change
+_rag_watcher = IndexWatcher(
+    lambda index_path, meta_path: _global_rag_manager().load_index_and_meta(index_path, meta_path),
+    RAG_INDEX_PATH,
+    RAG_META_PATH,
+    poll_seconds=max(RAG_RELOAD_SECONDS, 1.0),
+)
+try:
+    _rag_router_examples = load_examples(RAG_ROUTER_EXAMPLES)
+except (OSError, ValueError) as e:
+    logger.warning(f"RAG router examples not loaded, using built-in ones: {e}")
+    _rag_router_examples = None
+_rag_routers: Dict[str, SemanticRouter] = {}
+_kb_manager = None
+_kb_manager_lock = threading.Lock()
+_kb_indexes = ProjectIndexCache(max_projects=KB_CACHE_PROJECTS)
 _embedding_model_cache = None
+_embedding_model_lock = threading.Lock()
+_conflict_states = ConflictStateStore(base_dir=CONFLICT_STATE_DIR)
+# Pair verdicts per project ({CONFLICT_STATE_DIR}/{id}), shared with conflict jobs
+_verdict_caches = shared_verdict_caches()
+# Chat history turn embeddings, per conversation and message hash
+_turn_embeddings = TurnEmbeddingCache(max_conversations=CHAT_HISTORY_CACHE_CONVERSATIONS)
+# Persona LLM calls in flight, shared by all /api/persona/generate_batch and
+# /api/persona/analyze requests so concurrent requests do not multiply it
+_persona_llm_slots = asyncio.Semaphore(max(1, PERSONA_BATCH_MAX_CONCURRENCY))
+_chat_sessions = ChatSessionStore(ttl_seconds=CHAT_SESSION_TTL_SECONDS, max_sessions=CHAT_SESSION_MAX)
+# Rolling summaries of long conversations (filled by background folds; the
+# summarizer is looked up at call time since it is defined further down)
+_chat_summaries = RollingSummaries(
+    lambda previous, turns: _summarize_conversation(previous, turns),
+    trigger_tokens=CHAT_SUMMARY_TRIGGER_TOKENS,
+    keep_recent=CHAT_SUMMARY_KEEP_RECENT,
+)
+# Per-run counter of conflict-check LLM calls (set by _run_conflict_detection)
+_conflict_llm_calls: ContextVar[Optional[List[int]]] = ContextVar("conflict_llm_calls", default=None)
+# Progress events for conflict runs (GET /api/conflicts/events/{job_id}); the
+# ContextVar holds the event stream key of the current run
+_job_events = JobEventBus()
+_conflict_event_run: ContextVar[Optional[str]] = ContextVar("conflict_event_run", default=None)
 
 # ==================== REQUEST/RESPONSE MODELS ====================
 
@@ -212,12 +344,27 @@ class ChatRequest(BaseModel):
     context: Optional[str] = None
     persona_id: Optional[int] = None
     persona_data: Optional[Dict[str, Any]] = None
+    # Retrieve from this project's KB (falls back to the global index if it has none)
+    project_id: Optional[Union[int, str]] = None
+    # Stable id of the conversation; keys the server-side history caches and session
+    conversation_id: Optional[str] = None
+    # Delta protocol: the session_version from the previous response; history and
+    # persona_data may then be omitted (409 means resend the full history)
+    session_version: Optional[str] = None
+    # With session_version: SHA-256 of the context, sent instead of an unchanged context
+    context_hash: Optional[str] = None
 
 
 class ChatResponse(BaseModel):
     response: str
     tokens_used: int
     model: str
+    # Estimated prompt tokens per section (system, context, rag, history, message, ...)
+    prompt_tokens: Optional[Dict[str, int]] = None
+    # Send back as session_version on the next turn to skip the history
+    session_version: Optional[str] = None
+    # Semantic router result: {"route", "score", "use_rag"} (None if RAG is off or cached)
+    rag_route: Optional[Dict[str, Any]] = None
 
 
 class ExtractionRequest(BaseModel):
@@ -237,12 +384,21 @@ class ExtractionResponse(BaseModel):
     requirements: List[Requirement]
     total_extracted: int
     tokens_used: int
+    chunks_processed: Optional[int] = None
+    duplicates_removed: Optional[int] = None
+    chunk_timings: Optional[List[Dict[str, Any]]] = None
+    # Set when some chunks still failed after their retry: their requirements are missing
+    partial: bool = False
+    failed_chunks: List[int] = Field(default_factory=list)
 
 
 class PersonaGenerationRequest(BaseModel):
     requirement_text: str
     persona_name: str  # Developer, Business Analyst, Manager
-    persona_prompt: str
+    persona_prompt: str = ""
+    # Full persona profile; when given, its compiled prompt replaces persona_prompt
+    persona_id: Optional[int] = None
+    persona_data: Optional[Dict[str, Any]] = None
 
 
 class PersonaGenerationResponse(BaseModel):
@@ -250,17 +406,69 @@ class PersonaGenerationResponse(BaseModel):
     tokens_used: int
 
 
+class PersonaBatchRequest(BaseModel):
+    # [{"id": 1, "text": "..."}]; ids default to the list position
+    requirements: List[Dict[str, Any]]
+    # Persona profiles as sent to /api/chat (persona_data); need an id or a name
+    personas: List[Dict[str, Any]]
+
+
+class MultiPersonaAnalysisRequest(BaseModel):
+    # [{"id": 1, "text": "..."}]; ids default to the list position
+    requirements: List[Dict[str, Any]]
+    # Persona profiles as sent to /api/chat (persona_data); need an id or a name
+    personas: List[Dict[str, Any]]
+    task_type: str = Field(default="analyze", pattern="^(analyze|review|refine)$")
+    context: Optional[str] = None
+
+
+class PersonaAnalysis(BaseModel):
+    persona_id: Union[int, str]
+    persona_name: str
+    analysis: str
+    tokens_used: int
+    seconds: float
+    error: Optional[str] = None
+
+
+class MultiPersonaAnalysisResponse(BaseModel):
+    analyses: List[PersonaAnalysis]
+    # [{"personas": [...], "requirement_ids": [...], "description": "..."}]
+    conflicts: List[Dict[str, Any]]
+    merged_summary: str
+    tokens_used: int
+    seconds: float
+    merge_seconds: float
+    merge_error: Optional[str] = None
+
+
 class ConflictDetectionRequest(BaseModel):
     requirements: List[Dict[str, Any]]
     project_id: Optional[int] = None
     min_cluster_size: Optional[int] = 2
+    # Upper bound on requirements per LLM prompt (the token budget usually binds first)
     max_batch_size: Optional[int] = 30
     similarity_threshold: Optional[float] = 0.95
+    # Only check new/changed requirements against the project's previous run
+    incremental: Optional[bool] = False
+    # Reuse earlier LLM verdicts for unchanged requirement pairs (needs project_id)
+    use_verdict_cache: Optional[bool] = True
+    # "cluster" (HDBSCAN clusters) or "knn" (ranked kNN candidate pairs)
+    candidate_strategy: Optional[str] = Field(default="cluster", pattern="^(cluster|knn)$")
+    knn_k: Optional[int] = 10
+    min_pair_similarity: Optional[float] = 0.45
+    max_pairs_per_requirement: Optional[int] = 5
+    # Clustering backend and PCA dimensions; None uses the server defaults
+    clustering_backend: Optional[str] = Field(default=None, pattern="^(auto|hdbscan|partitioned|leader)$")
+    reduce_dims: Optional[int] = None
+    # Client-chosen id for following progress at GET /api/conflicts/events/{job_id}
+    job_id: Optional[str] = None
 
 
 class Conflict(BaseModel):
-    requirement_id_1: int
-    requirement_id_2: int
+    # Numeric IDs are returned as ints, anything else as the original string
+    requirement_id_1: Union[int, str]
+    requirement_id_2: Union[int, str]
     conflict_description: str
     severity: str
     req_text_1: Optional[str] = None
@@ -275,6 +483,11 @@ class ConflictDetectionResponse(BaseModel):
     total_requirements: Optional[int] = None
     clusters_found: Optional[int] = None
     method: Optional[str] = "semantic_clustering"
+    new_requirements: Optional[int] = None
+    llm_calls: Optional[int] = None
+    duplicate_groups: Optional[List[List[str]]] = None
+    # Clustering backend, seconds, clusters, noise ratio, ...
+    clustering: Optional[Dict[str, Any]] = None
 
 
 class ConflictResolutionRequest(BaseModel):
@@ -411,6 +624,35 @@ Instructions:
 
 Provide the rewritten requirement:"""
 
+PERSONA_ANALYSIS_PROMPT = """Requirements:
+{requirements}
+{context}
+Keep your answer focused on your own perspective and refer to requirements by their [id]."""
+
+PERSONA_MERGE_PROMPT = """Several stakeholders analyzed the same software requirements, each from their own perspective.
+
+{analyses}
+
+Identify where the stakeholders' positions conflict (e.g. one wants X, another's concern rules out X) and summarize the points they agree on.
+
+Return ONLY valid JSON:
+{{
+  "conflicts": [
+    {{"personas": ["Name A", "Name B"], "requirement_ids": ["1"], "description": "What conflicts and why"}}
+  ],
+  "summary": "Short merged summary of all perspectives"
+}}"""
+
+CONVERSATION_SUMMARY_PROMPT = """Update the running summary of a software requirements conversation.
+
+Current summary:
+{summary}
+
+New conversation turns:
+{turns}
+
+Write the updated summary in at most {max_words} words. Keep decisions, requirements, constraints, names, numbers and open questions; drop greetings and repetition. Return only the summary text."""
+
 CONFLICT_DETECTION_PROMPT = """Analyze the following requirements and identify any conflicts or contradictions.
 
 Requirements:
@@ -468,13 +710,15 @@ async def verify_api_key(api_key: str = Depends(api_key_header)):
 
 
 def call_groq_chat(
-    messages: List[Dict], max_tokens: int = 1000, temperature: float = 0.7
+    messages: List[Dict], max_tokens: int = 1000, temperature: float = 0.7, model: Optional[str] = None
 ) -> tuple:
     """Call Groq API and return response + token usage"""
+    model = model or DEFAULT_MODEL
     try:
-        chat_completion = groq_client.chat.completions.create(
-            messages=messages,
-            model=DEFAULT_MODEL,
+        chat_completion = create_completion(
+            groq_client,
+            model,
+            messages,
             max_tokens=max_tokens,
             temperature=temperature,
         )
@@ -487,82 +731,104 @@ def call_groq_chat(
         raise HTTPException(status_code=500, detail=f"Groq API error: {str(e)}")
 
 
+def stream_groq_chat(
+    messages: List[Dict], on_delta, max_tokens: int = 1000, temperature: float = 0.7
+) -> int:
+    """
+    Stream a Groq completion, calling on_delta(text) for every fragment.
+
+    Blocking; run it in a worker thread. Returns total tokens when the
+    provider reports usage on the final chunk, otherwise 0.
+    """
+    with observe_llm_call(DEFAULT_MODEL) as endpoint:
+        stream = groq_client.chat.completions.create(
+            messages=messages,
+            model=DEFAULT_MODEL,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+        )
+        tokens_used = 0
+        for chunk in stream:
+            if chunk.choices:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    on_delta(delta)
+            usage = getattr(getattr(chunk, "x_groq", None), "usage", None) or getattr(chunk, "usage", None)
+            if usage is not None and getattr(usage, "total_tokens", None):
+                tokens_used = usage.total_tokens
+    observe_tokens(endpoint, DEFAULT_MODEL, tokens_used)
+    return tokens_used
+
+
+def _global_rag_manager():
+    """RagManager of the global index (the embedding model is loaded once)."""
+    global _rag_manager
+    if _rag_manager is None:
+        with _rag_manager_lock:
+            if _rag_manager is None:
+                _rag_manager = RagManager(model_name=RAG_MODEL)
+    return _rag_manager
+
+
 def _load_rag_artifacts() -> Tuple[bool, object, list]:
-    """Lazily load RagManager, FAISS index and metadata. Returns (available, index, chunks)."""
-    global _rag_manager, _rag_index, _rag_chunks, _rag_available
+    """Current global RAG index snapshot. Returns (available, index, chunks).
+
+    The first call loads the index (and the embedding model); afterwards the
+    background watcher swaps in rebuilt indexes. A failed load is retried
+    with backoff instead of on every call.
+    """
     if not RAG_ENABLED:
         return False, None, None
 
-    if _rag_available:
-        return True, _rag_index, _rag_chunks
+    snapshot = _rag_watcher.current()
+    if snapshot is not None:
+        return True, snapshot.index, snapshot.chunks
 
     if RagManager is None:
         # sentence-transformers or faiss not installed or rag import failed
-        _rag_available = False
         return False, None, None
 
-    try:
-        _rag_manager = RagManager(model_name=RAG_MODEL)
-        _rag_index, _rag_chunks = _rag_manager.load_index_and_meta(
-            RAG_INDEX_PATH, RAG_META_PATH
-        )
-        _rag_available = True
-        return True, _rag_index, _rag_chunks
-    except Exception as e:
-        print(f"RAG load failed: {e}")
-        _rag_available = False
+    snapshot = _rag_watcher.refresh(wait_for_settle=False)
+    if snapshot is None:
         return False, None, None
+    return True, snapshot.index, snapshot.chunks
+
+
+def _semantic_router(model_name: str) -> SemanticRouter:
+    """Semantic router for an embedding model (centroids are model specific)."""
+    router = _rag_routers.get(model_name)
+    if router is None:
+        path = RAG_ROUTER_PATH
+        if path and model_name != RAG_MODEL:
+            root, ext = os.path.splitext(path)
+            path = f"{root}_{re.sub(r'[^A-Za-z0-9]+', '_', model_name)}{ext or '.npz'}"
+        router = _rag_routers.setdefault(
+            model_name, SemanticRouter(model_name, _rag_router_examples, path=path, margin=RAG_ROUTER_MARGIN)
+        )
+    return router
 
 
-def needs_rag(user_query: str, use_model: bool = True) -> bool:
-    """Decide whether to use RAG. First apply rule-based keywords, then optional model-based similarity check.
+def needs_rag(user_query: str) -> Tuple[Optional[RouteDecision], Optional[np.ndarray]]:
+    """Route a chat message for the global RAG index with the semantic router.
 
-    Returns True if RAG should be used.
+    The message is embedded once with the retrieval model; the router
+    decides with a single dot product and the same embedding is reused for
+    retrieval. Project KBs are not routed: chat always searches them.
+
+    Returns (decision, query embedding), or (None, None) when RAG is unavailable.
     """
     if not RAG_ENABLED:
-        return False
-
-    q = (user_query or "").lower()
-    # Rule-based: if any keyword appears
-    for kw in RAG_KEYWORDS:
-        kw = kw.strip().lower()
-        if not kw:
-            continue
-        if kw in q:
-            return True
-
-    # If model-based classification requested, try similarity against the index
-    if use_model:
-        avail, index, chunks = _load_rag_artifacts()
-        if not avail:
-            return False
-        try:
-            # use the rag manager to query top-1 and inspect score
-            results = _rag_manager.query(user_query, index, chunks, top_k=1)
-            if results and len(results) > 0:
-                top_score = results[0].get("score", 0.0)
-                return float(top_score) >= float(RAG_SIM_THRESHOLD)
-        except Exception as e:
-            print(f"RAG classification error: {e}")
-            return False
-
-    return False
+        return None, None
 
+    avail, _, _ = _load_rag_artifacts()
+    if not avail or _rag_manager is None:
+        return None, None
 
-def _build_rag_context_message(retrieved: list) -> str:
-    """Format retrieved chunks into a single system message string."""
-    if not retrieved:
-        return ""
-    lines = [
-        "Use the following retrieved context when helpful (do not fabricate answers):\n"
-    ]
-    for i, item in enumerate(retrieved, start=1):
-        # include score for debugging usefulness
-        lines.append(
-            f"{i}. {item.get('text', '')} (score: {item.get('score', 0.0):.4f})"
-        )
-    lines.append("\nIf the context does not contain the answer, say so explicitly.")
-    return "\n".join(lines)
+    query_embedding = _rag_manager.embed_texts([user_query or ""])
+    with span("route"):
+        decision = _semantic_router(RAG_MODEL).decide(query_embedding[0], _rag_manager.embed_texts)
+    return decision, query_embedding
 
 
 def parse_json_response(content: str) -> Dict:
@@ -595,19 +861,519 @@ def parse_json_response(content: str) -> Dict:
         )
 
 
+def _get_embedding_model():
+    """Get the shared SentenceTransformer used for conflict detection and dedupe (None if unavailable)."""
+    global _embedding_model_cache
+    if SentenceTransformer is None:
+        return None
+    with _embedding_model_lock:
+        if _embedding_model_cache is None:
+            _embedding_model_cache = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+    return _embedding_model_cache
+
+
+def _select_history(
+    conversation_id: Optional[str], history: List[Dict[str, str]], message: str
+) -> Optional[List[int]]:
+    """
+    Priority order of history turns for the chat prompt (None = plain recency).
+
+    Each turn is embedded once per conversation; later requests only embed
+    the turns they have not sent before, plus the new message.
+    """
+    model = _get_embedding_model()
+    if model is None:
+        return None
+    try:
+        def encode(texts: List[str]):
+            with span("embed", EMBED_SECONDS, "chat_history"):
+                return model.encode(texts, normalize_embeddings=True)
+
+        turn_embeddings = _turn_embeddings.embed(conversation_key(conversation_id, history), history, encode)
+        query_embedding = encode([message])[0]
+    except Exception as e:
+        logger.warning(f"History selection failed: {e}")
+        return None
+    return select_turns(
+        turn_embeddings,
+        query_embedding,
+        [turn["role"] for turn in history],
+        relevant=CHAT_HISTORY_RELEVANT,
+        recent=CHAT_HISTORY_RECENT,
+    )
+
+
+async def _summarize_conversation(previous: str, turns: List[Dict[str, str]]) -> str:
+    """Fold turns into a conversation summary (runs in the background)."""
+    prompt = CONVERSATION_SUMMARY_PROMPT.format(
+        summary=previous or "(none yet)",
+        turns="\n".join(f"{turn['role']}: {turn['content']}" for turn in turns),
+        max_words=int(CHAT_SUMMARY_MAX_TOKENS * 0.7),
+    )
+    summary, _ = await asyncio.to_thread(
+        call_groq_chat,
+        [{"role": "user", "content": prompt}],
+        max_tokens=CHAT_SUMMARY_MAX_TOKENS,
+        temperature=0.2,
+        model=CHAT_SUMMARY_MODEL,
+    )
+    return (summary or "").strip()
+
+
+def _dedupe_extracted_requirements(
+    requirements: List[Requirement], threshold: float
+) -> Tuple[List[Requirement], int]:
+    """
+    Merge requirements extracted from overlapping chunks.
+
+    Near-identical requirements (cosine similarity above `threshold`) collapse
+    into the first occurrence, keeping the highest confidence score seen.
+    Falls back to exact normalized-text matching without an embedding model.
+    """
+    if len(requirements) <= 1:
+        return requirements, 0
+
+    model = _get_embedding_model()
+    kept: List[Requirement] = []
+
+    if model is None:
+        seen: Dict[str, int] = {}
+        for req in requirements:
+            norm = " ".join(req.requirement_text.lower().split())
+            if norm in seen:
+                first = kept[seen[norm]]
+                first.confidence_score = max(first.confidence_score, req.confidence_score)
+                continue
+            seen[norm] = len(kept)
+            kept.append(req)
+        return kept, len(requirements) - len(kept)
+
+    with span("embed", EMBED_SECONDS, "extraction"):
+        embeddings = model.encode(
+            [req.requirement_text for req in requirements], normalize_embeddings=True
+        )
+    sim_matrix = embeddings @ embeddings.T
+    kept_rows: List[int] = []
+    for i, req in enumerate(requirements):
+        match = next((k for k, row in enumerate(kept_rows) if sim_matrix[i, row] > threshold), None)
+        if match is not None:
+            first = kept[match]
+            first.confidence_score = max(first.confidence_score, req.confidence_score)
+            continue
+        kept_rows.append(i)
+        kept.append(req)
+    return kept, len(requirements) - len(kept)
+
+
+async def _extract_chunk(chunk: Dict[str, Any], semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    """Run the extraction prompt on one document chunk and time it."""
+    async with semaphore:
+        started = time.perf_counter()
+        timing = {
+            "chunk_index": chunk["index"],
+            "heading": chunk["heading"],
+            "input_tokens": chunk["tokens"],
+        }
+        messages = [
+            {
+                "role": "system",
+                "content": "You are Fishy, a requirements extraction expert. Always return valid JSON.",
+            },
+            {"role": "user", "content": EXTRACTION_PROMPT.format(text=chunk["text"])},
+        ]
+        try:
+            response_text, tokens_used = await asyncio.to_thread(
+                call_groq_chat, messages, max_tokens=3000, temperature=0.3
+            )
+            parsed_data = parse_json_response(response_text)
+            requirements = [
+                Requirement(**req) for req in parsed_data.get("requirements", [])
+            ]
+            timing.update(tokens_used=tokens_used, requirements=len(requirements), error=None)
+        except Exception as e:
+            requirements, tokens_used = [], 0
+            timing.update(tokens_used=0, requirements=0, error=getattr(e, "detail", str(e)))
+        timing["seconds"] = round(time.perf_counter() - started, 3)
+        return {"requirements": requirements, "tokens_used": tokens_used, "timing": timing}
+
+
+async def _extract_requirements_chunked(text: str) -> ExtractionResponse:
+    """
+    Map-reduce requirement extraction for documents of any length.
+
+    Map: split the document by section under EXTRACTION_CHUNK_TOKENS and run
+    the extraction prompt on every chunk concurrently.
+    Reduce: merge results in document order and drop near-duplicates.
+
+    A chunk that fails is retried once. Chunks that fail again are listed
+    in failed_chunks (with partial=True) so callers can tell the result is
+    incomplete; the request only fails if every chunk fails.
+    """
+    chunks = split_document(text, max_tokens=EXTRACTION_CHUNK_TOKENS)
+    if not chunks:
+        return ExtractionResponse(requirements=[], total_extracted=0, tokens_used=0, chunks_processed=0)
+
+    semaphore = asyncio.Semaphore(max(1, EXTRACTION_MAX_CONCURRENCY))
+    results = await asyncio.gather(*[_extract_chunk(chunk, semaphore) for chunk in chunks])
+
+    retry = [i for i, r in enumerate(results) if r["timing"]["error"]]
+    if retry:
+        retried = await asyncio.gather(*[_extract_chunk(chunks[i], semaphore) for i in retry])
+        for i, result in zip(retry, retried):
+            result["timing"]["retried"] = True
+            results[i] = result
+
+    timings = [r["timing"] for r in results]
+    failed = [t for t in timings if t["error"]]
+    if len(failed) == len(results):
+        raise HTTPException(status_code=500, detail=failed[0]["error"])
+    if failed:
+        logger.warning(f"{len(failed)} of {len(chunks)} chunk(s) failed after retry; returning partial requirements")
+
+    all_requirements = [req for r in results for req in r["requirements"]]
+    tokens_used = sum(r["tokens_used"] for r in results)
+    with span("dedupe"):
+        requirements, removed = await asyncio.to_thread(
+            _dedupe_extracted_requirements, all_requirements, EXTRACTION_DEDUP_THRESHOLD
+        )
+
+    logger.info(
+        f"Extracted {len(requirements)} requirements from {len(chunks)} chunk(s) "
+        f"({removed} duplicates removed, {len(failed)} chunk(s) failed)"
+    )
+
+    return ExtractionResponse(
+        requirements=requirements,
+        total_extracted=len(requirements),
+        tokens_used=tokens_used,
+        chunks_processed=len(chunks),
+        duplicates_removed=removed,
+        chunk_timings=timings,
+        partial=bool(failed),
+        failed_chunks=[t["chunk_index"] for t in failed],
+    )
+
+
+async def _stream_extraction_chunk(
+    chunk: Dict[str, Any], queue: asyncio.Queue, semaphore: asyncio.Semaphore
+):
+    """Stream one chunk's completion into `queue` as (kind, chunk_index, payload) events."""
+    loop = asyncio.get_running_loop()
+    index = chunk["index"]
+    async with semaphore:
+        messages = [
+            {
+                "role": "system",
+                "content": "You are Fishy, a requirements extraction expert. Always return valid JSON.",
+            },
+            {"role": "user", "content": EXTRACTION_PROMPT.format(text=chunk["text"])},
+        ]
+        try:
+            tokens_used = await asyncio.to_thread(
+                stream_groq_chat,
+                messages,
+                lambda delta: loop.call_soon_threadsafe(queue.put_nowait, ("delta", index, delta)),
+                3000,
+                0.3,
+            )
+            await queue.put(("done", index, tokens_used))
+        except Exception as e:
+            await queue.put(("error", index, str(e)))
+
+
+async def _stream_extraction(chunks: List[Dict[str, Any]]):
+    """
+    Async generator producing NDJSON lines for /api/extract/stream.
+
+    Line types:
+        {"type": "requirement", "chunk_index": i, "requirement": {...}}
+        {"type": "chunk", "chunk_index": i, "seconds": ..., "dropped_partial": 0|1, ...}
+        {"type": "summary", "total_extracted": n, "tokens_used": t, ...}
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(max(1, EXTRACTION_MAX_CONCURRENCY))
+    parsers = {chunk["index"]: IncrementalArrayParser() for chunk in chunks}
+    started = {chunk["index"]: time.perf_counter() for chunk in chunks}
+    emitted = {chunk["index"]: 0 for chunk in chunks}
+    seen_texts = set()
+    total_extracted = 0
+    total_tokens = 0
+    duplicates = 0
+    failed_chunks = 0
+
+    tasks = [
+        asyncio.create_task(_stream_extraction_chunk(chunk, queue, semaphore))
+        for chunk in chunks
+    ]
+    pending = len(tasks)
+
+    try:
+        while pending:
+            kind, index, payload = await queue.get()
+
+            if kind == "delta":
+                for item in parsers[index].feed(payload):
+                    try:
+                        req = Requirement(**item)
+                    except Exception:
+                        parsers[index].items_invalid += 1
+                        continue
+                    norm = " ".join(req.requirement_text.lower().split())
+                    if norm in seen_texts:
+                        duplicates += 1
+                        continue
+                    seen_texts.add(norm)
+                    emitted[index] += 1
+                    total_extracted += 1
+                    yield json.dumps({
+                        "type": "requirement",
+                        "chunk_index": index,
+                        "requirement": req.model_dump(),
+                    }) + "\n"
+                continue
+
+            pending -= 1
+            stats = parsers[index].close()
+            line = {
+                "type": "chunk",
+                "chunk_index": index,
+                "seconds": round(time.perf_counter() - started[index], 3),
+                "requirements": emitted[index],
+                "invalid": stats["invalid"],
+                "dropped_partial": stats["dropped_partial"],
+                "tokens_used": payload if kind == "done" else 0,
+                "error": payload if kind == "error" else None,
+            }
+            if kind == "done":
+                total_tokens += payload
+            else:
+                failed_chunks += 1
+            yield json.dumps(line) + "\n"
+
+        yield json.dumps({
+            "type": "summary",
+            "total_extracted": total_extracted,
+            "tokens_used": total_tokens,
+            "chunks_processed": len(chunks),
+            "failed_chunks": failed_chunks,
+            "duplicates_removed": duplicates,
+        }) + "\n"
+    finally:
+        # Client went away or we finished: stop any chunk still waiting on the semaphore
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def _persona_view_prompt(
+    persona_data: Dict[str, Any],
+    requirements: List[Dict[str, Any]],
+    semaphore: asyncio.Semaphore,
+) -> Dict[str, Any]:
+    """Run one packed persona-view prompt; returns views by pack position."""
+    async with semaphore:
+        started = time.perf_counter()
+        prompt, max_tokens = build_batch_prompt(requirements)
+        messages = [
+            {"role": "system", "content": persona_registry.compile(persona_data, "view")},
+            {"role": "user", "content": prompt},
+        ]
+        try:
+            response_text, tokens_used = await asyncio.to_thread(
+                call_groq_chat, messages, max_tokens=max_tokens, temperature=0.7
+            )
+            views = parse_batch_views(parse_json_response(response_text), len(requirements))
+            error = None
+        except Exception as e:
+            views, tokens_used, error = {}, 0, getattr(e, "detail", str(e))
+        return {
+            "views": views,
+            "tokens_used": tokens_used,
+            "error": error,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+
+
+async def _stream_persona_views(requirements: List[Dict[str, Any]], personas: List[Dict[str, Any]]):
+    """
+    Async generator producing NDJSON lines for /api/persona/generate_batch.
+
+    Every persona's requirements are packed into prompts under
+    PERSONA_BATCH_PROMPT_TOKENS; all prompts run concurrently (at most
+    PERSONA_BATCH_MAX_CONCURRENCY at a time across all requests) and
+    results are sent in completion order. A requirement missing from a
+    packed answer is retried once on its own.
+
+    Line types:
+        {"type": "view", "requirement_id": r, "persona_id": p, "persona_view": "..."}
+        {"type": "error", "requirement_id": r, "persona_id": p, "error": "..."}
+        {"type": "prompt", "persona_id": p, "requirements": n, "seconds": ..., "tokens_used": t, "error": ...}
+        {"type": "summary", "views": n, "failed": n, "prompts": n, "tokens_used": t}
+    """
+    packs = pack_requirements(requirements, PERSONA_BATCH_PROMPT_TOKENS, max(1, PERSONA_BATCH_MAX_REQUIREMENTS))
+    tasks: Dict[asyncio.Task, Tuple[int, List[int], bool]] = {}
+
+    def submit(persona_index: int, members: List[int], retry: bool):
+        task = asyncio.create_task(_persona_view_prompt(
+            personas[persona_index], [requirements[i] for i in members], _persona_llm_slots
+        ))
+        tasks[task] = (persona_index, members, retry)
+
+    for persona_index in range(len(personas)):
+        for members in packs:
+            submit(persona_index, members, False)
+
+    views = failed = prompts = tokens_total = 0
+    try:
+        while tasks:
+            done, _ = await asyncio.wait(list(tasks), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                persona_index, members, retry = tasks.pop(task)
+                result = task.result()
+                persona_id = personas[persona_index]["id"]
+                prompts += 1
+                tokens_total += result["tokens_used"]
+                yield json.dumps({
+                    "type": "prompt",
+                    "persona_id": persona_id,
+                    "requirements": len(members),
+                    "seconds": result["seconds"],
+                    "tokens_used": result["tokens_used"],
+                    "error": result["error"],
+                }) + "\n"
+
+                for position, i in enumerate(members):
+                    requirement_id = requirements[i]["id"]
+                    view = result["views"].get(position)
+                    if view is not None:
+                        views += 1
+                        yield json.dumps({
+                            "type": "view",
+                            "requirement_id": requirement_id,
+                            "persona_id": persona_id,
+                            "persona_view": view,
+                        }) + "\n"
+                    elif not retry and len(members) > 1:
+                        submit(persona_index, [i], True)
+                    else:
+                        failed += 1
+                        yield json.dumps({
+                            "type": "error",
+                            "requirement_id": requirement_id,
+                            "persona_id": persona_id,
+                            "error": result["error"] or "No view returned for this requirement",
+                        }) + "\n"
+
+        yield json.dumps({
+            "type": "summary",
+            "views": views,
+            "failed": failed,
+            "prompts": prompts,
+            "tokens_used": tokens_total,
+        }) + "\n"
+    finally:
+        # Client went away or we finished: stop any prompt still waiting on the semaphore
+        for task in tasks:
+            task.cancel()
+
+
+async def _analyze_as_persona(
+    persona_data: Dict[str, Any],
+    task_type: str,
+    prompt: str,
+    semaphore: asyncio.Semaphore,
+) -> PersonaAnalysis:
+    """One persona's analysis with its compiled system prompt, timed."""
+    async with semaphore:
+        started = time.perf_counter()
+        messages = [
+            {"role": "system", "content": persona_registry.compile(persona_data, task_type)},
+            {"role": "user", "content": prompt},
+        ]
+        try:
+            analysis, tokens_used = await asyncio.to_thread(
+                call_groq_chat, messages, max_tokens=PERSONA_ANALYSIS_MAX_TOKENS, temperature=0.5
+            )
+            error = None
+        except Exception as e:
+            analysis, tokens_used, error = "", 0, getattr(e, "detail", str(e))
+        return PersonaAnalysis(
+            persona_id=persona_data["id"],
+            persona_name=str(persona_data.get("name") or persona_data["id"]),
+            analysis=(analysis or "").strip(),
+            tokens_used=tokens_used,
+            seconds=round(time.perf_counter() - started, 3),
+            error=error,
+        )
+
+
+async def _merge_persona_analyses(analyses: List[PersonaAnalysis]) -> Tuple[Dict[str, Any], int]:
+    """Cheap merge pass over per-persona analyses; returns (parsed JSON, tokens)."""
+    share = max(100, PERSONA_MERGE_INPUT_TOKENS // max(1, len(analyses)))
+    sections = "\n\n".join(
+        f"### {a.persona_name}\n{truncate_to_tokens(a.analysis, share)}" for a in analyses
+    )
+    response_text, tokens_used = await asyncio.to_thread(
+        call_groq_chat,
+        [
+            {"role": "system", "content": "You compare stakeholder analyses of requirements. Always return valid JSON."},
+            {"role": "user", "content": PERSONA_MERGE_PROMPT.format(analyses=sections)},
+        ],
+        max_tokens=PERSONA_MERGE_MAX_TOKENS,
+        temperature=0.2,
+        model=PERSONA_MERGE_MODEL,
+    )
+    return parse_json_response(response_text), tokens_used
+
+
 def _get_rag_manager():
-    """Get or create a RagManager instance."""
+    """Get the shared KB RagManager (the embedding model is loaded once)."""
+    global _kb_manager
     if RagManager is None:
         raise HTTPException(
             status_code=500,
             detail="RAG dependencies not installed. Install sentence-transformers and faiss-cpu.",
         )
-    return RagManager(model_name=KB_MODEL)
+    if _kb_manager is None:
+        with _kb_manager_lock:
+            if _kb_manager is None:
+                _kb_manager = RagManager(model_name=KB_MODEL)
+    return _kb_manager
+
+
+async def _get_project_kb(project_id: str):
+    """
+    A project's KB index and chunks, from memory while the KB version is unchanged.
+
+    Concurrent first loads of the same KB version share one disk read.
+
+    Returns:
+        (index, chunks), or None if the project has no KB
+    """
+    # The first call loads the embedding model, which must not block the loop
+    rag = await asyncio.to_thread(_get_rag_manager)
+    index_path, meta_path = rag.get_project_paths(KB_BASE_DIR, project_id)
+    if not os.path.exists(index_path):
+        return None
+    version = kb_version_token(index_path, meta_path)
+    cached = _kb_indexes.get(project_id, version)
+    if cached is None:
+        def _load():
+            index, chunks = rag.load_index_and_meta(index_path, meta_path)
+            return _kb_indexes.put(project_id, version, index, chunks)
+
+        cached = await get_group("kb_load").do(
+            make_key("kb_load", project_id, version), lambda: asyncio.to_thread(_load)
+        )
+    return cached.index, cached.chunks
 
 
 async def _detect_conflicts_simple(request: ConflictDetectionRequest) -> ConflictDetectionResponse:
     """
-    Simple LLM-only conflict detection (fallback when semantic libraries unavailable).
+    Simple LLM-only conflict detection (fallback when no embedding model is available).
+
+    Without hdbscan the semantic path still runs with leader clustering, so
+    this single-prompt path is only used when sentence-transformers is missing.
     """
     requirements_text = "\n".join(
         [f"ID {req.get('id')}: {req.get('text')}" for req in request.requirements]
@@ -623,8 +1389,8 @@ async def _detect_conflicts_simple(request: ConflictDetectionRequest) -> Conflic
         {"role": "user", "content": prompt},
     ]
 
-    response_text, tokens_used = call_groq_chat(
-        messages, max_tokens=2000, temperature=0.3
+    response_text, tokens_used = await asyncio.to_thread(
+        call_groq_chat, messages, max_tokens=2000, temperature=0.3
     )
     parsed_data = parse_json_response(response_text)
 
@@ -653,47 +1419,56 @@ async def _detect_conflicts_semantic(request: ConflictDetectionRequest) -> Confl
     
     Process:
     1. Generate embeddings for all requirements
-    2. Cluster similar requirements using HDBSCAN
+    2. Cluster similar requirements (HDBSCAN, partitioned HDBSCAN or leader fallback)
     3. Remove near-duplicates within clusters
     4. Check each cluster for conflicts using LLM
     """
-    global _embedding_model_cache
-    
     # Extract requirements data
     req_ids = [str(req.get('id', f'REQ_{i}')) for i, req in enumerate(request.requirements)]
     req_texts = [req.get('text', '') for req in request.requirements]
     
     # Step 1: Generate embeddings (with model caching)
-    print(f"🧮 Generating embeddings for {len(req_texts)} requirements...")
-    if _embedding_model_cache is None:
-        _embedding_model_cache = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-    embeddings = _embedding_model_cache.encode(req_texts, normalize_embeddings=True)
+    logger.info(f"Generating embeddings for {len(req_texts)} requirements...")
+    stage_start = time.perf_counter()
+    embedding_model = await asyncio.to_thread(_get_embedding_model)
+    # Run blocking model work off the event loop so duplicate requests can coalesce
+    with span("embed", EMBED_SECONDS, "conflicts"):
+        embeddings = await asyncio.to_thread(
+            embedding_model.encode, req_texts, normalize_embeddings=True
+        )
+    _emit_conflict_event("stage", stage="embed", seconds=round(time.perf_counter() - stage_start, 3),
+                         requirements=len(req_texts))
+    
+    if request.candidate_strategy == "knn":
+        return await _detect_conflicts_knn(request, req_ids, req_texts, embeddings)
     
     # Step 2: Cluster requirements
-    print(f"🔍 Clustering requirements...")
-    clusterer = hdbscan.HDBSCAN(
+    logger.info("Clustering requirements...")
+    clustering = await asyncio.to_thread(
+        cluster_embeddings,
+        embeddings,
         min_cluster_size=request.min_cluster_size,
-        min_samples=1,
-        metric='euclidean',
-        cluster_selection_method='eom',
-        allow_single_cluster=False
+        backend=request.clustering_backend or CONFLICT_CLUSTER_BACKEND,
+        reduce_dims=request.reduce_dims if request.reduce_dims is not None else CONFLICT_REDUCE_DIMS,
+        n_jobs=CONFLICT_CLUSTER_N_JOBS,
     )
-    cluster_labels = clusterer.fit_predict(embeddings)
-    
-    n_clusters = len(set(cluster_labels)) - (1 if -1 in cluster_labels else 0)
-    n_noise = list(cluster_labels).count(-1)
+    cluster_labels = clustering.labels
+    n_clusters = clustering.n_clusters
+    _emit_conflict_event("stage", stage="cluster", **clustering.summary())
     
-    print(f"✅ Found {n_clusters} clusters ({n_noise} outliers)")
+    logger.info(
+        f"Found {n_clusters} clusters ({clustering.n_noise} outliers, "
+        f"{clustering.noise_ratio:.0%} noise) with {clustering.backend} in {clustering.seconds:.2f}s"
+    )
     
-    # Step 3: Detect conflicts within each cluster
-    all_conflicts = []
+    # Step 3: Remove near-duplicates within each cluster
+    stage_start = time.perf_counter()
+    duplicate_groups: List[List[int]] = []
+    clusters_to_check: List[Tuple[int, List[int]]] = []
     
-    for cluster_id in set(cluster_labels):
-        if cluster_id == -1:  # Skip noise/outliers
-            continue
-            
+    for cluster_id in sorted(set(cluster_labels.tolist()) - {-1}):  # Skip noise/outliers
         # Get requirements in this cluster
-        cluster_indices = [i for i, label in enumerate(cluster_labels) if label == cluster_id]
+        cluster_indices = np.flatnonzero(cluster_labels == cluster_id).tolist()
         
         if len(cluster_indices) < 2:
             continue
@@ -702,104 +1477,369 @@ async def _detect_conflicts_semantic(request: ConflictDetectionRequest) -> Confl
         cluster_indices = _remove_near_duplicates(
             cluster_indices, 
             embeddings, 
-            request.similarity_threshold
+            request.similarity_threshold,
+            groups_out=duplicate_groups
         )
         
-        if len(cluster_indices) < 2:
-            continue
-        
-        # Get requirements for this cluster
-        cluster_requirements = [
-            (req_ids[i], req_texts[i]) for i in cluster_indices
-        ]
-        
-        # Split into batches if needed
-        max_batch = request.max_batch_size
-        if len(cluster_requirements) <= max_batch:
-            conflicts = await _check_conflicts_in_batch(
-                cluster_requirements, 
-                cluster_id
-            )
-            all_conflicts.extend(conflicts)
-        else:
-            # Process in batches
-            for batch_start in range(0, len(cluster_requirements), max_batch):
-                batch = cluster_requirements[batch_start:batch_start + max_batch]
-                conflicts = await _check_conflicts_in_batch(batch, cluster_id)
-                all_conflicts.extend(conflicts)
+        if len(cluster_indices) >= 2:
+            clusters_to_check.append((cluster_id, cluster_indices))
+    
+    _emit_conflict_event(
+        "stage", stage="dedupe", seconds=round(time.perf_counter() - stage_start, 3),
+        duplicate_groups=len(duplicate_groups), clusters_to_check=len(clusters_to_check),
+    )
+    
+    # Step 4: Detect conflicts within each cluster; small clusters share prompts
+    cache_project = _verdict_cache_project(request)
+    groups = [
+        ConflictGroup(int(cluster_id), [(req_ids[i], req_texts[i]) for i in cluster_indices])
+        for cluster_id, cluster_indices in clusters_to_check
+    ]
+    completed = 0
     
-    print(f"✅ Found {len(all_conflicts)} conflicts")
+    def cluster_done(index: int, conflicts: List[Conflict]):
+        nonlocal completed
+        completed += 1
+        _emit_conflict_event(
+            "cluster", cluster_id=groups[index].group_id, completed=completed,
+            total=len(groups), conflicts=len(conflicts),
+        )
+    
+    per_cluster = await _check_conflict_groups(
+        groups,
+        project_id=cache_project,
+        max_requirements=request.max_batch_size,
+        on_group_done=cluster_done,
+    )
+    all_conflicts = [conflict for conflicts in per_cluster for conflict in conflicts]
+    
+    logger.info(f"Found {len(all_conflicts)} conflicts")
+    
+    # Keep this run's embeddings and clusterer so the next run can be incremental
+    if request.project_id is not None:
+        state = ProjectConflictState(
+            req_ids=req_ids,
+            text_hashes=[text_hash(t) for t in req_texts],
+            embeddings=embeddings,
+            labels=np.asarray(cluster_labels),
+            clusterer=clustering.model,
+        )
+        await asyncio.to_thread(_conflict_states.put, request.project_id, state)
     
     return ConflictDetectionResponse(
         conflicts=all_conflicts,
         total_conflicts=len(all_conflicts),
         total_requirements=len(request.requirements),
         clusters_found=n_clusters,
-        method="semantic_clustering"
+        method="semantic_clustering",
+        new_requirements=len(request.requirements),
+        duplicate_groups=[[req_ids[i] for i in group] for group in duplicate_groups] or None,
+        clustering=clustering.summary(),
+    )
+
+
+async def _detect_conflicts_knn(
+    request: ConflictDetectionRequest,
+    req_ids: List[str],
+    req_texts: List[str],
+    embeddings,
+) -> ConflictDetectionResponse:
+    """
+    Conflict detection over ranked kNN candidate pairs instead of clusters.
+
+    Pairs come from a kNN graph over the embeddings, restricted to a
+    similarity band (related but not near-duplicate) and ranked by a cheap
+    contradiction score. Only the top pairs are sent to the LLM, so cost is
+    O(n·k) and nothing is skipped for being HDBSCAN noise.
+    """
+    logger.info(f"Building kNN candidate pairs (k={request.knn_k})...")
+    stage_start = time.perf_counter()
+    pairs = await asyncio.to_thread(
+        generate_candidate_pairs,
+        embeddings,
+        req_texts,
+        request.knn_k,
+        request.min_pair_similarity,
+        request.similarity_threshold,
+        request.max_pairs_per_requirement,
+    )
+    batches = await asyncio.to_thread(
+        pack_pairs,
+        pairs,
+        max_requirements=request.max_batch_size,
+        max_pairs=CONFLICT_MAX_PAIRS_PER_PROMPT,
+    )
+    logger.info(f"{len(pairs)} candidate pairs packed into {len(batches)} prompt(s)")
+    _emit_conflict_event("stage", stage="candidate_pairs", seconds=round(time.perf_counter() - stage_start, 3),
+                         pairs=len(pairs), batches=len(batches))
+
+    groups = [
+        ConflictGroup(
+            -1,
+            [(req_ids[r], req_texts[r]) for r in batch["rows"]],
+            [(req_ids[i], req_ids[j]) for i, j in batch["pairs"]],
+        )
+        for batch in batches
+    ]
+    per_batch = await _check_conflict_groups(
+        groups,
+        project_id=_verdict_cache_project(request),
+        max_requirements=request.max_batch_size,
+    )
+    all_conflicts = [conflict for conflicts in per_batch for conflict in conflicts]
+
+    logger.info(f"Found {len(all_conflicts)} conflicts")
+
+    return ConflictDetectionResponse(
+        conflicts=all_conflicts,
+        total_conflicts=len(all_conflicts),
+        total_requirements=len(req_ids),
+        clusters_found=0,
+        method="knn_pairs",
+        new_requirements=len(req_ids),
+    )
+
+
+def _incremental_neighbors(
+    row: int,
+    embeddings,
+    labels,
+    candidate_rows: List[int],
+    k: int,
+    min_sim: float,
+    duplicate_threshold: float,
+) -> List[int]:
+    """
+    Pick the rows a new requirement should be checked against.
+
+    Prefers members of the requirement's own cluster; noise points fall back
+    to the most similar requirements overall above `min_sim`. Near-duplicates
+    (similarity above `duplicate_threshold`) are skipped.
+    """
+    if not candidate_rows:
+        return []
+    candidates = np.asarray(candidate_rows)
+    sims = embeddings[candidates] @ embeddings[row]
+
+    if labels[row] != -1:
+        mask = labels[candidates] == labels[row]
+    else:
+        mask = sims >= min_sim
+    mask &= sims <= duplicate_threshold
+
+    candidates, sims = candidates[mask], sims[mask]
+    order = np.argsort(-sims)[:k]
+    return candidates[order].tolist()
+
+
+async def _detect_conflicts_incremental(request: ConflictDetectionRequest) -> ConflictDetectionResponse:
+    """
+    Check only new or changed requirements against the project's previous run.
+
+    New requirements are embedded, assigned to existing clusters with the stored
+    cluster model (HDBSCAN approximate_predict or nearest centroid) and checked against their nearest neighbours, so the
+    number of LLM calls scales with the change rather than the project size.
+    Falls back to a full run when there is no previous state or the change
+    is too large.
+
+    Returned conflicts always involve at least one new/changed requirement;
+    conflicts among unchanged requirements were reported by earlier runs.
+    """
+    state = await asyncio.to_thread(_conflict_states.get, request.project_id)
+    if state is None or state.clusterer is None:
+        logger.info("No previous conflict state for this project - running full detection")
+        return await _detect_conflicts_semantic(request)
+
+    req_ids = [str(req.get('id', f'REQ_{i}')) for i, req in enumerate(request.requirements)]
+    req_texts = [req.get('text', '') for req in request.requirements]
+    text_by_id = dict(zip(req_ids, req_texts))
+
+    changed, _, removed = state.diff(req_ids, req_texts)
+    if len(changed) > CONFLICT_RECLUSTER_RATIO * len(req_ids):
+        logger.info(f"{len(changed)} of {len(req_ids)} requirements changed - re-clustering from scratch")
+        return await _detect_conflicts_semantic(request)
+
+    # Drop removed requirements and the stale rows of changed ones
+    changed_ids = [req_ids[i] for i in changed]
+    state = state.without(removed + changed_ids)
+    n_clusters = len(set(state.labels.tolist()) - {-1})
+
+    if not changed:
+        if removed:
+            await asyncio.to_thread(_conflict_states.put, request.project_id, state)
+        return ConflictDetectionResponse(
+            conflicts=[],
+            total_conflicts=0,
+            total_requirements=len(req_ids),
+            clusters_found=n_clusters,
+            method="incremental",
+            new_requirements=0,
+        )
+
+    logger.info(f"Embedding {len(changed)} new/changed requirements...")
+    stage_start = time.perf_counter()
+    embedding_model = await asyncio.to_thread(_get_embedding_model)
+    changed_texts = [req_texts[i] for i in changed]
+    with span("embed", EMBED_SECONDS, "conflicts"):
+        new_embeddings = await asyncio.to_thread(
+            embedding_model.encode, changed_texts, normalize_embeddings=True
+        )
+    _emit_conflict_event("stage", stage="embed", seconds=round(time.perf_counter() - stage_start, 3),
+                         requirements=len(changed))
+    stage_start = time.perf_counter()
+    new_labels = await asyncio.to_thread(predict_labels, state.clusterer, new_embeddings)
+    _emit_conflict_event("stage", stage="cluster", seconds=round(time.perf_counter() - stage_start, 3),
+                         backend="assign_existing")
+
+    all_ids = state.req_ids + changed_ids
+    embeddings = np.vstack([state.embeddings, new_embeddings]) if len(state.req_ids) else new_embeddings
+    labels = np.concatenate([state.labels, np.asarray(new_labels)])
+    n_old = len(state.req_ids)
+    new_rows = list(range(n_old, len(all_ids)))
+
+    # Group new requirements by assigned cluster; noise points are checked individually
+    groups: Dict[Any, List[int]] = {}
+    for row in new_rows:
+        key = int(labels[row]) if labels[row] != -1 else f"noise_{row}"
+        groups.setdefault(key, []).append(row)
+
+    all_conflicts = []
+    new_id_set = set(changed_ids)
+    cache_project = _verdict_cache_project(request)
+    max_batch = max(2, request.max_batch_size)
+
+    for completed, (key, rows) in enumerate(groups.items(), start=1):
+        cluster_id = key if isinstance(key, int) else -1
+        found_before = len(all_conflicts)
+        batch_rows: List[int] = []
+        for row in rows:
+            # Candidates: everything except this requirement itself
+            candidates = [r for r in range(len(all_ids)) if r != row]
+            neighbors = _incremental_neighbors(
+                row, embeddings, labels, candidates,
+                CONFLICT_INCREMENTAL_NEIGHBORS, CONFLICT_NEIGHBOR_MIN_SIM,
+                request.similarity_threshold,
+            )
+            additions = [r for r in [row] + neighbors if r not in batch_rows]
+            if batch_rows and len(batch_rows) + len(additions) > max_batch:
+                await _check_incremental_batch(
+                    batch_rows, all_ids, text_by_id, cluster_id, new_id_set, all_conflicts, cache_project
+                )
+                batch_rows = []
+                additions = [row] + neighbors
+            batch_rows.extend(additions[:max_batch])
+        if len(batch_rows) >= 2:
+            await _check_incremental_batch(
+                batch_rows, all_ids, text_by_id, cluster_id, new_id_set, all_conflicts, cache_project
+            )
+        _emit_conflict_event(
+            "cluster", cluster_id=cluster_id, completed=completed,
+            total=len(groups), conflicts=len(all_conflicts) - found_before,
+        )
+
+    logger.info(f"Incremental run: {len(changed)} new/changed, {len(all_conflicts)} conflicts")
+
+    new_state = ProjectConflictState(
+        req_ids=all_ids,
+        text_hashes=state.text_hashes + [text_hash(t) for t in changed_texts],
+        embeddings=embeddings,
+        labels=labels,
+        clusterer=state.clusterer,
+    )
+    await asyncio.to_thread(_conflict_states.put, request.project_id, new_state)
+
+    return ConflictDetectionResponse(
+        conflicts=all_conflicts,
+        total_conflicts=len(all_conflicts),
+        total_requirements=len(req_ids),
+        clusters_found=n_clusters,
+        method="incremental",
+        new_requirements=len(changed),
     )
 
 
+async def _check_incremental_batch(
+    rows: List[int],
+    all_ids: List[str],
+    text_by_id: Dict[str, str],
+    cluster_id: int,
+    new_id_set: set,
+    out: List[Conflict],
+    project_id: Optional[Any] = None,
+):
+    """Check one batch and keep only conflicts touching a new requirement."""
+    if len(rows) < 2:
+        return
+    batch = [(all_ids[r], text_by_id.get(all_ids[r], "")) for r in rows]
+    new_texts = {text_by_id.get(rid, "") for rid in new_id_set}
+    conflicts = await _check_conflicts_in_batch(
+        batch, cluster_id, project_id=project_id, max_requirements=len(batch)
+    )
+    kept = []
+    for conflict in conflicts:
+        touches_new = (
+            str(conflict.requirement_id_1) in new_id_set
+            or str(conflict.requirement_id_2) in new_id_set
+            or conflict.req_text_1 in new_texts
+            or conflict.req_text_2 in new_texts
+        )
+        if touches_new:
+            kept.append(conflict)
+    _emit_batch_conflicts(cluster_id, kept)
+    out.extend(kept)
+
+
 def _remove_near_duplicates(
     indices: List[int], 
     embeddings, 
-    threshold: float = 0.95
+    threshold: float = 0.95,
+    groups_out: Optional[List[List[int]]] = None
 ) -> List[int]:
-    """Remove near-duplicate requirements from a cluster."""
-    if len(indices) <= 1:
-        return indices
-    
-    cluster_embeddings = embeddings[indices]
-    sim_matrix = cosine_similarity(cluster_embeddings)
-    
-    # Keep first occurrence, remove duplicates
-    to_keep = set(range(len(indices)))
-    for i in range(len(indices)):
-        if i not in to_keep:
-            continue
-        for j in range(i + 1, len(indices)):
-            if j in to_keep and sim_matrix[i, j] > threshold:
-                to_keep.discard(j)
-    
-    kept_indices = [indices[i] for i in sorted(to_keep)]
+    """
+    Remove near-duplicate requirements from a cluster.
+
+    Keeps the first occurrence of each duplicate group. If `groups_out` is
+    given, each group ([kept_index, duplicate_index, ...]) is appended to it.
+    """
+    kept_indices, groups = remove_near_duplicates(indices, embeddings, threshold)
+    if groups_out is not None:
+        groups_out.extend(groups)
     removed = len(indices) - len(kept_indices)
     if removed > 0:
-        print(f"   📝 Removed {removed} near-duplicate(s) from cluster")
+        logger.info(f"Removed {removed} near-duplicate(s) from cluster")
     
     return kept_indices
 
 
-async def _check_conflicts_in_batch(
-    requirements: List[Tuple[str, str]], 
-    cluster_id: int
-) -> List[Conflict]:
+async def _ask_llm_for_conflicts(
+    groups: List[ConflictGroup],
+) -> Optional[List[Tuple[int, Dict[str, Any]]]]:
     """
-    Use LLM to check for conflicts in a batch of requirements.
+    Send one conflict-check prompt covering one or more groups to the LLM.
+    
+    Requirement IDs are replaced by short aliases in the prompt and mapped
+    back afterwards; pairs are only compared within a group (and only the
+    listed pairs for groups that have them).
     
     Args:
-        requirements: List of (req_id, req_text) tuples
-        cluster_id: Cluster ID for tracking
+        groups: Groups packed into this prompt
         
     Returns:
-        List of detected conflicts
+        (group index, raw conflict dict with req_a, req_b, reason, confidence,
+        severity) tuples, or None if the call or JSON parsing failed
     """
-    if len(requirements) < 2:
-        return []
-    
-    # Build structured prompt
-    req_list = "\n".join([
-        f"{i+1}. [{req_id}] {text}"
-        for i, (req_id, text) in enumerate(requirements)
-    ])
+    aliased = AliasedPrompt(groups)
+    pair_rule = " Where a group lists pairs, check ONLY those pairs." if aliased.has_pair_lists else ""
     
     prompt = f"""You are analyzing requirements for logical conflicts.
 
-Requirements to analyze:
-{req_list}
+Requirements to analyze, in {len(groups)} independent group(s):
+{aliased.listing()}
 
-Task: Identify any pairs of requirements that CANNOT both be true or would create a logical contradiction.
+Task: Identify pairs of requirements from the SAME group that CANNOT both be true or would create a logical contradiction. Never pair requirements from different groups.{pair_rule}
 
 Return your analysis as a JSON array. For each conflict found, include:
-- req_a: ID of first requirement (use the exact ID from the brackets, e.g., "1", "REQ_0001")
+- req_a: ID of first requirement (the exact ID from the brackets, e.g., "R1")
 - req_b: ID of second requirement
 - reason: Brief explanation of the conflict
 - confidence: "high", "medium", or "low"
@@ -809,16 +1849,23 @@ If no conflicts exist, return an empty array: []
 
 Response format:
 [
-  {{"req_a": "1", "req_b": "3", "reason": "...", "confidence": "high", "severity": "high"}},
+  {{"req_a": "R1", "req_b": "R3", "reason": "...", "confidence": "high", "severity": "high"}},
   ...
 ]
 
 JSON output only:"""
 
+    counter = _conflict_llm_calls.get()
+    if counter is not None:
+        counter[0] += 1
+    
+    response_text = ""
     try:
-        response = groq_client.chat.completions.create(
-            model=DEFAULT_MODEL,
-            messages=[{"role": "user", "content": prompt}],
+        response = await asyncio.to_thread(
+            create_completion,
+            groq_client,
+            DEFAULT_MODEL,
+            [{"role": "user", "content": prompt}],
             temperature=0.3,
             max_tokens=2000,
         )
@@ -835,41 +1882,242 @@ JSON output only:"""
         conflicts_data = json.loads(response_text)
         
         if not isinstance(conflicts_data, list):
-            print(f"⚠️ Expected list of conflicts, got {type(conflicts_data)}")
-            return []
+            logger.warning(f"Expected list of conflicts, got {type(conflicts_data)}")
+            return None
         
-        # Create Conflict objects
-        req_map = {req_id: text for req_id, text in requirements}
-        conflicts = []
+        return aliased.resolve(conflicts_data)
         
-        for conflict in conflicts_data:
-            req_a = str(conflict.get("req_a", ""))
-            req_b = str(conflict.get("req_b", ""))
+    except json.JSONDecodeError as e:
+        logger.warning(f"JSON parsing error in conflict detection: {e} (response preview: {response_text[:200]!r})")
+        return None
+    except Exception as e:
+        logger.warning(f"Error checking batch for conflicts: {str(e)}")
+        return None
+
+
+def _conflict_id(req_id: str) -> Union[int, str]:
+    """Requirement ID as reported on a Conflict (int when numeric)."""
+    return int(req_id) if req_id.isdigit() else req_id
+
+
+def _to_conflict(raw: Dict[str, Any], req_map: Dict[str, str], cluster_id: int) -> Conflict:
+    """Build a Conflict from a raw LLM/verdict dict."""
+    req_a, req_b = raw["req_a"], raw["req_b"]
+    
+    return Conflict(
+        requirement_id_1=_conflict_id(req_a),
+        requirement_id_2=_conflict_id(req_b),
+        conflict_description=raw.get("reason") or "No reason provided",
+        severity=raw.get("severity", "medium"),
+        req_text_1=req_map.get(req_a, ""),
+        req_text_2=req_map.get(req_b, ""),
+        confidence=raw.get("confidence", "medium"),
+        cluster_id=cluster_id
+    )
+
+
+async def _check_conflict_groups(
+    groups: List[ConflictGroup],
+    project_id: Optional[Any] = None,
+    max_requirements: int = 30,
+    emit_batches: bool = True,
+    on_group_done: Optional[Callable[[int, List[Conflict]], None]] = None,
+) -> List[List[Conflict]]:
+    """
+    Check several groups (clusters or pair batches) for conflicts with as
+    few LLM calls as possible.
+    
+    Groups larger than CONFLICT_PROMPT_TOKEN_BUDGET are split into pieces;
+    with a project_id, pairs already judged (same texts, same model) are
+    answered from the verdict cache and only requirements that still take
+    part in an unjudged pair are kept. The remaining pieces are bin-packed
+    into prompts by estimated tokens, so small clusters share one call.
+    
+    Args:
+        groups: Groups to check; pairs are only compared within a group
+        project_id: Project whose verdict cache to use (None disables caching)
+        max_requirements: Upper bound on requirements per prompt
+        emit_batches: Publish a "batch" progress event per prompt
+        on_group_done: Called as on_group_done(index, conflicts) once the last
+            prompt covering a group has been answered
+        
+    Returns:
+        Conflicts per input group, aligned with `groups`
+    """
+    results: List[List[Conflict]] = [[] for _ in groups]
+    cache = await _get_verdict_cache(project_id)
+    pending: List[Tuple[int, ConflictGroup]] = []
+    
+    for index, group in enumerate(groups):
+        for piece in split_group(group, CONFLICT_PROMPT_TOKEN_BUDGET, max_requirements):
+            if len(piece.requirements) < 2:
+                continue
+            if cache is None:
+                pending.append((index, piece))
+                continue
             
-            # Convert ID to integer (handle both numeric and string IDs)
-            id_a = int(req_a) if req_a.isdigit() else abs(hash(req_a)) % 100000
-            id_b = int(req_b) if req_b.isdigit() else abs(hash(req_b)) % 100000
+            req_map = dict(piece.requirements)
+            unjudged = []
+            for a, b in piece.candidate_pairs():
+                verdict = cache.get(req_map[a], req_map[b], DEFAULT_MODEL)
+                if verdict is None:
+                    unjudged.append((a, b))
+                elif verdict["conflict"]:
+                    results[index].append(
+                        _to_conflict({"req_a": a, "req_b": b, **verdict}, req_map, group.group_id)
+                    )
+            if not unjudged:
+                continue
             
-            conflicts.append(Conflict(
-                requirement_id_1=id_a,
-                requirement_id_2=id_b,
-                conflict_description=conflict.get("reason", "No reason provided"),
-                severity=conflict.get("severity", "medium"),
-                req_text_1=req_map.get(req_a, ""),
-                req_text_2=req_map.get(req_b, ""),
-                confidence=conflict.get("confidence", "medium"),
-                cluster_id=cluster_id
+            # Only requirements that still take part in an unjudged pair go into the prompt
+            keep = {req_id for pair in unjudged for req_id in pair}
+            prompt_requirements = [(req_id, text) for req_id, text in piece.requirements if req_id in keep]
+            all_pairs_count = len(prompt_requirements) * (len(prompt_requirements) - 1) // 2
+            explicit = piece.pairs is not None or (
+                len(unjudged) < all_pairs_count and len(unjudged) <= CONFLICT_MAX_PAIRS_PER_PROMPT
+            )
+            pending.append((
+                index,
+                ConflictGroup(group.group_id, prompt_requirements, unjudged if explicit else None),
             ))
+    
+    prompts = pack_groups(
+        [piece for _, piece in pending], CONFLICT_PROMPT_TOKEN_BUDGET, max(2, max_requirements)
+    )
+    if len(prompts) < len(pending):
+        logger.info(f"Packed {len(pending)} group(s) into {len(prompts)} prompt(s)")
+    
+    # Prompts still outstanding per input group
+    remaining = [0] * len(groups)
+    for members in prompts:
+        for index in {pending[m][0] for m in members}:
+            remaining[index] += 1
+    if on_group_done is not None:
+        for index, count in enumerate(remaining):
+            if count == 0:
+                on_group_done(index, results[index])
+    
+    for completed, members in enumerate(prompts, start=1):
+        pieces = [pending[m][1] for m in members]
+        raw = await _ask_llm_for_conflicts(pieces)
+        found_by_group: Dict[int, List[Conflict]] = {}
+        if raw is not None:
+            flagged = [{} for _ in pieces]
+            for position, conflict in raw:
+                flagged[position][frozenset((conflict["req_a"], conflict["req_b"]))] = conflict
+            for position, m in enumerate(members):
+                index, piece = pending[m]
+                req_map = dict(piece.requirements)
+                for a, b in piece.candidate_pairs():
+                    found = flagged[position].get(frozenset((a, b)))
+                    if found is None:
+                        if cache is not None:
+                            cache.record(req_map[a], req_map[b], DEFAULT_MODEL, conflict=False)
+                        continue
+                    if cache is not None:
+                        cache.record(
+                            req_map[a], req_map[b], DEFAULT_MODEL,
+                            conflict=True,
+                            reason=found.get("reason", ""),
+                            confidence=found.get("confidence", "medium"),
+                            severity=found.get("severity", "medium"),
+                        )
+                    conflict = _to_conflict(found, req_map, piece.group_id)
+                    results[index].append(conflict)
+                    found_by_group.setdefault(piece.group_id, []).append(conflict)
+        # A failed call judges nothing, so its pairs are retried next run
+        if emit_batches:
+            for group_id in sorted({pending[m][1].group_id for m in members}):
+                _emit_batch_conflicts(
+                    group_id, found_by_group.get(group_id, []), completed=completed, total=len(prompts)
+                )
+        for index in {pending[m][0] for m in members}:
+            remaining[index] -= 1
+            if remaining[index] == 0 and on_group_done is not None:
+                on_group_done(index, results[index])
+    
+    return results
+
+
+async def _check_conflicts_in_batch(
+    requirements: List[Tuple[str, str]], 
+    cluster_id: int,
+    pairs: Optional[List[Tuple[str, str]]] = None,
+    project_id: Optional[Any] = None,
+    max_requirements: int = 30,
+) -> List[Conflict]:
+    """
+    Use LLM to check for conflicts in a batch of requirements.
+    
+    Args:
+        requirements: List of (req_id, req_text) tuples
+        cluster_id: Cluster ID for tracking
+        pairs: Optional (req_id, req_id) pairs; when given, only these pairs
+            are asked about and returned
+        project_id: Project whose verdict cache to use (None disables caching)
+        max_requirements: Upper bound on requirements per prompt
         
-        return conflicts
-        
-    except json.JSONDecodeError as e:
-        print(f"⚠️ JSON parsing error in conflict detection: {e}")
-        print(f"   Response preview: {response_text[:200]}...")
-        return []
-    except Exception as e:
-        print(f"⚠️ Error checking batch for conflicts: {str(e)}")
-        return []
+    Returns:
+        List of detected conflicts
+    """
+    results = await _check_conflict_groups(
+        [ConflictGroup(cluster_id, requirements, pairs)],
+        project_id=project_id,
+        max_requirements=max_requirements,
+        emit_batches=False,
+    )
+    return results[0]
+
+
+def _verdict_cache_project(request: ConflictDetectionRequest) -> Optional[Any]:
+    """Project whose verdict cache a detection request may use (None = no caching)."""
+    return request.project_id if request.use_verdict_cache else None
+
+
+def _emit_conflict_event(event_type: str, **data):
+    """Publish a progress event for the current conflict run (no-op outside a run)."""
+    run_key = _conflict_event_run.get()
+    if run_key is not None:
+        _job_events.publish(run_key, event_type, **data)
+
+
+def _emit_batch_conflicts(cluster_id: int, conflicts: List[Conflict], **data):
+    """Publish the conflicts verified by one LLM batch as soon as they are known."""
+    _emit_conflict_event(
+        "batch",
+        cluster_id=int(cluster_id),
+        conflicts=[c.model_dump() for c in conflicts],
+        **data,
+    )
+
+
+async def _run_conflict_detection(request: ConflictDetectionRequest) -> ConflictDetectionResponse:
+    """Dispatch to the right detection mode, count LLM calls and persist verdicts."""
+    counter = [0]
+    _conflict_llm_calls.set(counter)
+    mode = "incremental" if request.incremental and request.project_id is not None else "semantic"
+    _emit_conflict_event("started", mode=mode, requirements=len(request.requirements))
+    
+    if request.incremental and request.project_id is not None:
+        result = await _detect_conflicts_incremental(request)
+    else:
+        result = await _detect_conflicts_semantic(request)
+    
+    result.llm_calls = counter[0]
+    cache = await _get_verdict_cache(_verdict_cache_project(request))
+    if cache is not None:
+        await asyncio.to_thread(cache.save)
+    return result
+
+
+async def _get_verdict_cache(project_id: Optional[Any]) -> Optional[PairVerdictCache]:
+    """Get the pair-verdict cache for a project (loaded off the event loop on first use)."""
+    if project_id is None:
+        return None
+    cache = _verdict_caches.cached(project_id)
+    if cache is None:
+        cache = await asyncio.to_thread(_verdict_caches.get, project_id)
+    return cache
 
 
 def _prepare_document_chunks(documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -916,9 +2164,114 @@ async def _build_kb_async(job_id: str, project_id: str, chunks: List[Dict[str, A
             _build_jobs[job_id]["completed_at"] = datetime.utcnow().isoformat()
 
 
+# ==================== METRICS & TRACING ====================
+
+
+# Polled endpoints: their request lines are only logged at debug level
+_QUIET_PATHS = {"/metrics", "/health"}
+
+
+def _log_request(trace, request, status: int):
+    level = logging.DEBUG if request.url.path in _QUIET_PATHS else logging.INFO
+    logger.log(level, "request", extra={"trace": trace.finish(method=request.method, status=status)})
+
+
+def _endpoint_label(request) -> str:
+    """
+    Route template the request matches (e.g. /api/kb/{project_id}/search).
+
+    Metric labels must come from a fixed set, so paths that match no route
+    (scanners, typos) share the "other" label.
+    """
+    for route in app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "other")
+    return "other"
+
+
+@app.middleware("http")
+async def _request_context(request, call_next):
+    """
+    Label LLM metrics with the endpoint's route template, and trace the request.
+
+    The response carries the stage timings in Server-Timing and the request
+    id in X-Request-ID. The request's JSON log line is written once the body
+    has been sent, so streamed responses are logged with their full duration.
+    """
+    current_endpoint.set(_endpoint_label(request))
+    trace = start_trace(request_id_from(request.headers.get(REQUEST_ID_HEADER)), request.url.path)
+    try:
+        response = await call_next(request)
+    except Exception:
+        _log_request(trace, request, 500)
+        raise
+    response.headers[REQUEST_ID_HEADER] = trace.request_id
+    response.headers["Server-Timing"] = trace.server_timing()
+
+    body = response.body_iterator
+
+    async def logged_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            _log_request(trace, request, response.status_code)
+
+    response.body_iterator = logged_body()
+    return response
+
+
+def _service_stats():
+    """Cache sizes and hit/miss counters, read when /metrics is scraped."""
+    caches = {
+        "turn_embeddings": _turn_embeddings.stats(),
+        "persona_prompts": persona_registry.stats(),
+        "kb_indexes": _kb_indexes.stats(),
+        "conflict_verdicts": {
+            key: value for key, value in _verdict_caches.stats().items() if key != "projects"
+        },
+    }
+    flights = get_all_stats()
+    gauges = {
+        "kb_cached_projects": len(_kb_indexes),
+        "kb_build_jobs": len(_build_jobs),
+        "conflict_event_streams": len(_job_events),
+        "chat_sessions": len(_chat_sessions),
+        "conflict_verdict_projects": len(_verdict_caches),
+        "single_flight_in_flight": sum(f["in_flight"] for f in flights.values()),
+    }
+    counters = {
+        "cache_hits": ("cache", {name: stats["hits"] for name, stats in caches.items()}),
+        "cache_misses": ("cache", {name: stats["misses"] for name, stats in caches.items()}),
+        "single_flight_calls": ("group", {name: f["calls"] for name, f in flights.items()}),
+        "single_flight_executions": ("group", {name: f["executions"] for name, f in flights.items()}),
+        "single_flight_collapsed": ("group", {name: f["collapsed"] for name, f in flights.items()}),
+        "single_flight_failures": ("group", {name: f["failures"] for name, f in flights.items()}),
+    }
+    return gauges, counters
+
+
+register_stats(_service_stats)
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics (text exposition format)."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
 # ==================== API ENDPOINTS ====================
 
 
+@app.on_event("startup")
+async def _start_rag_watcher():
+    """Pick up rebuilt global RAG indexes (build_faiss.py) without a restart."""
+    if RAG_ENABLED and RAG_RELOAD_SECONDS > 0:
+        _rag_watcher.start()
+
+
 @app.get("/")
 def read_root():
     return {
@@ -936,9 +2289,24 @@ def health_check():
         "status": "healthy",
         "groq_configured": bool(os.getenv("GROQ_API_KEY")),
         "model": DEFAULT_MODEL,
+        "single_flight": get_all_stats(),
+        "persona_prompts": persona_registry.stats(),
+        "rag_router": {model: router.stats() for model, router in _rag_routers.items()},
+        "kb_indexes": _kb_indexes.stats(),
+        "rag_index": _rag_watcher.stats(),
     }
 
 
+def _build_chat_system_prompt(persona_data: Dict[str, Any], persona_id: Optional[int] = None) -> str:
+    """Chat system prompt with the compiled persona section appended."""
+    if not persona_data or not isinstance(persona_data, dict):
+        return CHAT_SYSTEM_PROMPT
+    if persona_data.get('id') is None and persona_id is not None:
+        persona_data = {**persona_data, 'id': persona_id}
+    logger.info(f"Using persona: {persona_data.get('name', 'Unknown')} (ID: {persona_id})")
+    return f"{CHAT_SYSTEM_PROMPT}\n\n{persona_registry.compile(persona_data, 'chat')}"
+
+
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """
@@ -952,113 +2320,172 @@ async def chat(request: ChatRequest):
             {"role": "user", "content": "Hello"},
             {"role": "assistant", "content": "Hi! How can I help?"}
         ],
-        "context": "Optional context about the project"
+        "context": "Optional context about the project",
+        "conversation_id": "42"
     }
+
+    With a conversation_id the response carries a session_version. The next
+    turn may then send only {"message", "conversation_id", "session_version"}
+    (plus persona_id, and context or, while it is unchanged, its SHA-256 as
+    context_hash); a 409 means the session is gone or stale, or its context
+    differs, and the full conversation_history must be sent again.
     """
     try:
-        # Build system prompt with persona if provided
-        system_prompt = CHAT_SYSTEM_PROMPT
-        
-        # Apply persona context if provided
-        if request.persona_data and isinstance(request.persona_data, dict):
-            persona_name = request.persona_data.get('name', 'Unknown')
-            persona_role = request.persona_data.get('role', '')
-            persona_description = request.persona_data.get('description', '')
-            persona_priorities = request.persona_data.get('priorities', [])
-            persona_concerns = request.persona_data.get('concerns', [])
-            persona_comm_style = request.persona_data.get('communication_style', '')
-            persona_tech_level = request.persona_data.get('technical_level', '')
-            persona_focus_areas = request.persona_data.get('focus_areas', [])
-            
-            # Build enhanced system prompt with persona details
-            persona_context = f"\n\nYou are now responding as '{persona_name}'"
-            if persona_role:
-                persona_context += f", a {persona_role}"
-            persona_context += "."
-            
-            if persona_description:
-                persona_context += f"\n\nPersona Description: {persona_description}"
-            
-            if persona_priorities:
-                persona_context += f"\n\nYour Priorities: {', '.join(persona_priorities) if isinstance(persona_priorities, list) else persona_priorities}"
-            
-            if persona_concerns:
-                persona_context += f"\n\nYour Key Concerns: {', '.join(persona_concerns) if isinstance(persona_concerns, list) else persona_concerns}"
-            
-            if persona_focus_areas:
-                persona_context += f"\n\nYour Focus Areas: {', '.join(persona_focus_areas) if isinstance(persona_focus_areas, list) else persona_focus_areas}"
-            
-            if persona_tech_level:
-                persona_context += f"\n\nTechnical Level: {persona_tech_level}"
-            
-            if persona_comm_style:
-                persona_context += f"\n\nCommunication Style: {persona_comm_style}"
-            
-            persona_context += "\n\nRespond to all messages from this persona's perspective, focusing on their priorities, concerns, and expertise level."
-            
-            system_prompt += persona_context
-            
-            # Log persona usage
-            print(f"🎭 Using persona: {persona_name} (ID: {request.persona_id})")
-            print(f"   Role: {persona_role}")
-            print(f"   Tech Level: {persona_tech_level}")
-        
-        messages = [{"role": "system", "content": system_prompt}]
-
-        # Add context if provided
-        if request.context:
-            messages.append(
-                {"role": "system", "content": f"Project Context: {request.context}"}
+        # Delta protocol: continue a server-side session from its last version
+        session = None
+        if request.session_version:
+            if not request.conversation_id:
+                raise HTTPException(status_code=400, detail="session_version requires conversation_id")
+            session = _chat_sessions.get(request.conversation_id, request.session_version)
+            persona_changed = session is not None and request.persona_id != session.persona_id
+            context_changed = (
+                session is not None
+                and request.context is None
+                and request.context_hash is not None
+                and request.context_hash != session.context_hash
             )
+            if session is None or (persona_changed and not request.persona_data) or context_changed:
+                raise HTTPException(
+                    status_code=409,
+                    detail="Chat session expired or out of date; resend conversation_history",
+                )
 
-        # Normalize conversation history (avoid None) and limit to last 10 messages to save tokens
-        history = request.conversation_history or []
-        for msg in history[-10:]:
-            # Accept either ChatMessage Pydantic models or plain dicts
-            if isinstance(msg, dict):
-                role = msg.get("role")
-                content = msg.get("content")
-            else:
-                role = getattr(msg, "role", None)
-                content = getattr(msg, "content", None)
-
-            if role and content:
-                messages.append({"role": role, "content": content})
+        # An unchanged context is sent as its hash and taken from the session
+        context = request.context
+        if context is None and request.context_hash is not None and session is not None:
+            context = session.context
 
-        # Add current message
-        messages.append({"role": "user", "content": request.message})
+        # Build system prompt with persona if provided (a session keeps the compiled one)
+        if request.persona_data and isinstance(request.persona_data, dict):
+            system_prompt = _build_chat_system_prompt(request.persona_data, request.persona_id)
+        elif session is not None and session.system_prompt:
+            system_prompt = session.system_prompt
+        else:
+            system_prompt = CHAT_SYSTEM_PROMPT
+        
+        if session is not None:
+            history = list(session.history)
+        else:
+            # Normalize conversation history (avoid None); the prompt budget decides how much fits
+            history = []
+            for msg in request.conversation_history or []:
+                # Accept either ChatMessage Pydantic models or plain dicts
+                if isinstance(msg, dict):
+                    role = msg.get("role")
+                    content = msg.get("content")
+                else:
+                    role = getattr(msg, "role", None)
+                    content = getattr(msg, "content", None)
+
+                if role and content:
+                    history.append({"role": role, "content": content})
+            # Clients may include the message being sent as the last history turn
+            if history and history[-1]["role"] == "user" and history[-1]["content"] == request.message:
+                history.pop()
+
+        # Same message retried within a session: reuse its retrieval results
+        message_key = turn_hash("user", request.message)
+        cached_retrieval = session.retrieval.get(message_key) if session is not None else None
+
+        # RAG source: the project's KB (cached index) or the global legacy index
+        project_kb = None
+        if cached_retrieval is None and request.project_id is not None:
+            try:
+                project_kb = await _get_project_kb(str(request.project_id))
+            except Exception as e:
+                logger.warning(f"Project KB load failed: {e}")
+
+        retrieved = cached_retrieval or []
+        route = None
+        if cached_retrieval is None and project_kb is not None:
+            # A ready project KB is always searched (top KB_CHAT_TOP_K), whatever
+            # RAG_ENABLED and the router say: Laravel tells the model it is provided
+            try:
+                rag = await asyncio.to_thread(_get_rag_manager)
+                index, chunks = project_kb
+                query_embedding = await asyncio.to_thread(rag.embed_texts, [request.message])
+                retrieved = await asyncio.to_thread(rag.search, query_embedding, index, chunks, KB_CHAT_TOP_K)
+            except Exception as e:
+                logger.warning(f"Project KB retrieval failed: {e}")
+        elif cached_retrieval is None:
+            # Legacy index: the semantic router decides from the message embedding
+            query_embedding = None
+            try:
+                route, query_embedding = await asyncio.to_thread(needs_rag, request.message)
+            except Exception as e:
+                # If RAG check fails for any reason, fall back to no RAG
+                logger.warning(f"RAG decision error: {e}")
+            if route is not None and route.use_rag:
+                avail, index, chunks = _load_rag_artifacts()
+                if avail and _rag_manager is not None:
+                    try:
+                        results = await asyncio.to_thread(_rag_manager.search, query_embedding, index, chunks, RAG_TOP_K)
+                        retrieved = [r for r in results if r.get("score", 0.0) >= RAG_SIM_THRESHOLD]
+                    except Exception as e:
+                        logger.warning(f"RAG retrieval failed: {e}")
+                        # continue without RAG
+
+        # Older turns covered by the rolling summary are replaced by it; the next
+        # fold (if due) runs in the background and never delays this request
+        summary, covered = None, 0
+        prompt_history = history
+        if CHAT_SUMMARY_TRIGGER_TOKENS > 0:
+            summary_key = conversation_key(request.conversation_id, history)
+            summary, covered = _chat_summaries.get(summary_key, history)
+            _chat_summaries.schedule(summary_key, history)
+            prompt_history = history[covered:]
+
+        # Long histories: recent turns first, then the most relevant older ones
+        history_order = None
+        if CHAT_HISTORY_RELEVANT > 0 and len(prompt_history) > CHAT_HISTORY_RECENT:
+            history_order = await asyncio.to_thread(
+                _select_history, request.conversation_id, prompt_history, request.message
+            )
 
-        # RAG decision: decide whether to enrich with retrieved context
-        try:
-            use_rag = needs_rag(request.message, use_model=True)
-        except Exception as e:
-            # If RAG check fails for any reason, fall back to no RAG
-            print(f"RAG decision error: {e}")
-            use_rag = False
-
-        if use_rag:
-            avail, index, chunks = _load_rag_artifacts()
-            if avail and _rag_manager is not None:
-                try:
-                    retrieved = _rag_manager.query(
-                        request.message, index, chunks, top_k=RAG_TOP_K
-                    )
-                    rag_system = _build_rag_context_message(retrieved)
-                    if rag_system:
-                        # Prepend retrieved context as a system instruction to guide the model
-                        messages.insert(1, {"role": "system", "content": rag_system})
-                except Exception as e:
-                    print(f"RAG retrieval failed: {e}")
-                    # continue without RAG
+        # Fill the context budget: system/persona, then RAG, then history
+        prompt = assemble_chat_prompt(
+            system_prompt,
+            request.message,
+            history=prompt_history,
+            rag_chunks=retrieved,
+            context=context,
+            history_order=history_order,
+            summary=summary,
+            budget=CHAT_PROMPT_TOKEN_BUDGET,
+            dedupe_threshold=CHAT_RAG_DEDUP_THRESHOLD,
+        )
 
         # Call Groq
         response_text, tokens_used = call_groq_chat(
-            messages, max_tokens=2000, temperature=0.7
+            prompt.messages, max_tokens=2000, temperature=0.7
         )
 
+        # Keep the conversation server-side so the next turn can send only its message
+        session_version = None
+        if request.conversation_id and CHAT_SESSIONS_ENABLED:
+            session = _chat_sessions.record_turn(
+                request.conversation_id,
+                history + [
+                    {"role": "user", "content": request.message},
+                    {"role": "assistant", "content": response_text},
+                ],
+                system_prompt,
+                request.persona_id,
+                retrieval={message_key: retrieved},
+                context=context,
+            )
+            session_version = session.version
+
         return ChatResponse(
-            response=response_text, tokens_used=tokens_used, model=DEFAULT_MODEL
+            response=response_text,
+            tokens_used=tokens_used,
+            model=DEFAULT_MODEL,
+            prompt_tokens=prompt.breakdown,
+            session_version=session_version,
+            rag_route=route.as_dict() if route is not None else None,
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1076,33 +2503,45 @@ async def extract_requirements(request: ExtractionRequest):
     }
     """
     try:
-        prompt = EXTRACTION_PROMPT.format(text=request.text)
+        # Long documents are split by section and extracted concurrently
+        return await _extract_requirements_chunked(request.text)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        messages = [
-            {
-                "role": "system",
-                "content": "You are Fishy, a requirements extraction expert. Always return valid JSON.",
-            },
-            {"role": "user", "content": prompt},
-        ]
 
-        # Use lower temperature for more consistent JSON output
-        response_text, tokens_used = call_groq_chat(
-            messages, max_tokens=3000, temperature=0.3
-        )
-        parsed_data = parse_json_response(response_text)
+@app.post("/api/extract/stream")
+async def extract_requirements_stream(request: ExtractionRequest):
+    """
+    Extract requirements and stream each one as an NDJSON line as soon as it is parsed.
 
-        requirements = [
-            Requirement(**req) for req in parsed_data.get("requirements", [])
-        ]
+    A truncated or malformed completion only loses the item that was open
+    when the stream broke; every earlier requirement has already been sent.
 
-        return ExtractionResponse(
-            requirements=requirements,
-            total_extracted=len(requirements),
-            tokens_used=tokens_used,
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    Usage:
+    POST /api/extract/stream
+    {
+        "text": "The app should allow users to login. It must be fast and secure.",
+        "document_type": "meeting_notes"
+    }
+    """
+    chunks = split_document(request.text, max_tokens=EXTRACTION_CHUNK_TOKENS)
+    return StreamingResponse(_stream_extraction(chunks), media_type="application/x-ndjson")
+
+
+def _persona_generation_data(request: PersonaGenerationRequest) -> Dict[str, Any]:
+    """Persona fields for a generation request (name + prompt if no profile is given)."""
+    if request.persona_data:
+        persona_data = dict(request.persona_data)
+        if persona_data.get('id') is None:
+            persona_data['id'] = request.persona_id
+        persona_data.setdefault('name', request.persona_name)
+        return persona_data
+    return {
+        'id': request.persona_id,
+        'name': request.persona_name,
+        'role': request.persona_name,
+        'description': request.persona_prompt,
+    }
 
 
 @app.post("/api/persona/generate", response_model=PersonaGenerationResponse)
@@ -1117,14 +2556,17 @@ async def generate_persona_view(request: PersonaGenerationRequest):
         "persona_name": "Developer",
         "persona_prompt": "Focus on technical implementation, architecture, and scalability"
     }
+
+    Instead of persona_prompt, a full persona profile can be sent as
+    persona_data (same fields as for /api/chat).
     """
     try:
         prompt = PERSONA_PROMPT_TEMPLATE.format(
             persona_name=request.persona_name, requirement_text=request.requirement_text
         )
 
-        # Add persona-specific guidance
-        system_prompt = f"You are a {request.persona_name} analyzing requirements. {request.persona_prompt}"
+        # Persona system prompt from the shared registry (compiled once per persona)
+        system_prompt = persona_registry.compile(_persona_generation_data(request), "view")
 
         messages = [
             {"role": "system", "content": system_prompt},
@@ -1142,6 +2584,100 @@ async def generate_persona_view(request: PersonaGenerationRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/persona/generate_batch")
+async def generate_persona_views_batch(request: PersonaBatchRequest):
+    """
+    Generate persona views for many requirements x personas, streamed as NDJSON.
+
+    Results arrive in completion order, keyed by (requirement_id, persona_id);
+    see _stream_persona_views for the line types.
+
+    Usage:
+    POST /api/persona/generate_batch
+    {
+        "requirements": [{"id": 1, "text": "The system must process 1000 transactions per second"}],
+        "personas": [{"id": 3, "name": "Developer", "role": "Backend developer", "priorities": ["performance"]}]
+    }
+    """
+    requirements = [
+        {**req, "id": req.get("id", i), "text": str(req.get("text") or req.get("requirement_text") or "")}
+        for i, req in enumerate(request.requirements)
+    ]
+    personas = []
+    for persona in request.personas:
+        if persona.get("id") is None and not persona.get("name"):
+            raise HTTPException(status_code=400, detail="Every persona needs an id or a name")
+        personas.append({**persona, "id": persona["id"] if persona.get("id") is not None else persona["name"]})
+    return StreamingResponse(_stream_persona_views(requirements, personas), media_type="application/x-ndjson")
+
+
+@app.post("/api/persona/analyze", response_model=MultiPersonaAnalysisResponse)
+async def analyze_multi_persona(request: MultiPersonaAnalysisRequest):
+    """
+    Analyze requirements from several persona perspectives at once.
+
+    Each persona gets its own focused call (compiled persona prompt), all
+    running concurrently, so wall time is close to the slowest persona
+    rather than growing with the number of personas. A final merge pass on
+    a small model lists cross-persona conflicts.
+
+    Usage:
+    POST /api/persona/analyze
+    {
+        "requirements": [{"id": 1, "text": "Must work offline"}],
+        "personas": [{"id": 3, "name": "Developer"}, {"id": 4, "name": "Manager"}],
+        "task_type": "analyze"
+    }
+    """
+    if not request.requirements or not request.personas:
+        raise HTTPException(status_code=400, detail="requirements and personas must not be empty")
+    personas = []
+    for persona in request.personas:
+        if persona.get("id") is None and not persona.get("name"):
+            raise HTTPException(status_code=400, detail="Every persona needs an id or a name")
+        personas.append({**persona, "id": persona["id"] if persona.get("id") is not None else persona["name"]})
+
+    started = time.perf_counter()
+    listing = "\n".join(
+        f"[{req.get('id', i)}] {req.get('text') or req.get('requirement_text') or ''}"
+        for i, req in enumerate(request.requirements)
+    )
+    prompt = PERSONA_ANALYSIS_PROMPT.format(
+        requirements=listing,
+        context=f"\nProject Context: {request.context}\n" if request.context else "",
+    )
+    analyses = await asyncio.gather(*[
+        _analyze_as_persona(persona, request.task_type, prompt, _persona_llm_slots) for persona in personas
+    ])
+
+    succeeded = [a for a in analyses if not a.error]
+    if not succeeded:
+        raise HTTPException(status_code=500, detail=analyses[0].error)
+
+    merge_started = time.perf_counter()
+    conflicts: List[Dict[str, Any]] = []
+    merged_summary, merge_tokens, merge_error = "", 0, None
+    if len(succeeded) > 1:
+        try:
+            merged, merge_tokens = await _merge_persona_analyses(succeeded)
+            conflicts = [c for c in merged.get("conflicts", []) if isinstance(c, dict)]
+            merged_summary = str(merged.get("summary") or "")
+        except Exception as e:
+            merge_error = getattr(e, "detail", str(e))
+    else:
+        merged_summary = succeeded[0].analysis
+
+    return MultiPersonaAnalysisResponse(
+        analyses=analyses,
+        conflicts=conflicts,
+        merged_summary=merged_summary,
+        tokens_used=sum(a.tokens_used for a in analyses) + merge_tokens,
+        seconds=round(time.perf_counter() - started, 3),
+        merge_seconds=round(time.perf_counter() - merge_started, 3),
+        merge_error=merge_error,
+    )
+
+
 @app.post("/api/conflicts/detect", response_model=ConflictDetectionResponse)
 async def detect_conflicts(request: ConflictDetectionRequest):
     """
@@ -1165,6 +2701,9 @@ async def detect_conflicts(request: ConflictDetectionRequest):
     """
     try:
         if not request.requirements or len(request.requirements) < 2:
+            if request.job_id:
+                _job_events.link(request.job_id, request.job_id)
+                _job_events.publish(request.job_id, "done", total_conflicts=0, method="none_required")
             return ConflictDetectionResponse(
                 conflicts=[],
                 total_conflicts=0,
@@ -1173,20 +2712,59 @@ async def detect_conflicts(request: ConflictDetectionRequest):
                 method="none_required"
             )
         
+        payload = request.model_dump(exclude={"job_id"})
+        
         # Check if advanced conflict detection is available
         if not CONFLICT_DETECTION_AVAILABLE:
-            print("ℹ️ Using simple LLM-only conflict detection (semantic libraries unavailable)")
-            return await _detect_conflicts_simple(request)
+            logger.info("Using simple LLM-only conflict detection (sentence-transformers unavailable)")
+            key = make_key("conflicts_detect_simple", request.project_id, payload=payload)
+            run = lambda: _detect_conflicts_simple(request)
+        else:
+            # Use semantic clustering approach
+            key = make_key("conflicts_detect", request.project_id, payload=payload)
+            run = lambda: _run_conflict_detection(request)
+            mode = "incremental" if request.incremental and request.project_id is not None else "semantic"
+            logger.info(f"Starting {mode} conflict detection for {len(request.requirements)} requirements")
         
-        # Use semantic clustering approach
-        print(f"🔍 Starting semantic conflict detection for {len(request.requirements)} requirements")
-        return await _detect_conflicts_semantic(request)
+        # Identical concurrent requests share one run and one event stream;
+        # the job id only names the subscription
+        if request.job_id:
+            _job_events.link(request.job_id, key)
+        _conflict_event_run.set(key)
+        try:
+            result = await get_group("conflicts_detect").do(key, run)
+        except Exception as e:
+            _job_events.publish(key, "error", error=str(e))
+            raise
+        _job_events.publish(
+            key, "done", total_conflicts=result.total_conflicts,
+            clusters_found=result.clusters_found, llm_calls=result.llm_calls, method=result.method,
+        )
+        return result
         
     except Exception as e:
-        print(f"❌ Conflict detection error: {str(e)}")
+        logger.error(f"Conflict detection error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Conflict detection failed: {str(e)}")
 
 
+@app.get("/api/conflicts/events/{job_id}")
+async def conflict_events(job_id: str):
+    """
+    Server-Sent Events for a conflict detection run started with this job_id.
+
+    Events (SSE event name = "type"):
+    - started: {mode, requirements}
+    - stage: {stage: embed|cluster|dedupe|candidate_pairs, seconds, ...}
+    - batch: {cluster_id, conflicts: [...]} as soon as an LLM batch is verified
+    - cluster: {cluster_id, completed, total, conflicts}
+    - done: {total_conflicts, clusters_found, llm_calls, method} / error: {error}
+
+    The stream replays earlier events, so it can be opened before or after
+    POST /api/conflicts/detect.
+    """
+    return sse_response(_job_events, job_id)
+
+
 @app.post("/api/conflicts/resolve", response_model=ConflictResolutionResponse)
 async def resolve_conflict(request: ConflictResolutionRequest):
     """
@@ -1263,28 +2841,10 @@ async def process_document(
         # Use document_content (document_url fetching can be added later)
         content = request.document_content or ""
 
-        # Extract requirements using existing extraction endpoint logic
-        extraction_req = ExtractionRequest(
-            text=content, document_type=request.document_type
-        )
-        prompt = EXTRACTION_PROMPT.format(text=extraction_req.text)
-
-        messages = [
-            {
-                "role": "system",
-                "content": "You are Fishy, a requirements extraction expert. Always return valid JSON.",
-            },
-            {"role": "user", "content": prompt},
-        ]
-
-        response_text, tokens_used = call_groq_chat(
-            messages, max_tokens=3000, temperature=0.3
-        )
-        parsed_data = parse_json_response(response_text)
-
-        requirements = [
-            Requirement(**req) for req in parsed_data.get("requirements", [])
-        ]
+        # Extract requirements using the same map-reduce pipeline as /api/extract
+        extraction = await _extract_requirements_chunked(content)
+        requirements = extraction.requirements
+        tokens_used = extraction.tokens_used
 
         # Create chunks from requirements
         chunks = []
@@ -1412,7 +2972,7 @@ async def incremental_kb_update(
                 status_code=400, detail="Documents list cannot be empty"
             )
 
-        rag = _get_rag_manager()
+        rag = await asyncio.to_thread(_get_rag_manager)
         index_path, meta_path = rag.get_project_paths(KB_BASE_DIR, request.project_id)
 
         # Check if index exists
@@ -1471,19 +3031,28 @@ async def query_kb(request: QueryKBRequest, api_key: str = Depends(verify_api_ke
     }
     """
     try:
-        rag = _get_rag_manager()
+        rag = await asyncio.to_thread(_get_rag_manager)
         index_path, meta_path = rag.get_project_paths(KB_BASE_DIR, request.project_id)
 
-        # Check if index exists
-        if not os.path.exists(index_path):
+        # Loaded index is cached per project and KB version
+        kb = await _get_project_kb(request.project_id)
+        if kb is None:
             raise HTTPException(
                 status_code=404,
                 detail=f"Knowledge base not found for project {request.project_id}",
             )
-
-        # Load index and query
-        index, chunks = rag.load_index_and_meta(index_path, meta_path)
-        results = rag.query(request.query, index, chunks, top_k=request.top_k)
+        index, chunks = kb
+
+        # Identical concurrent queries against the same KB version share one search
+        key = make_key(
+            "kb_query",
+            request.project_id,
+            kb_version_token(index_path, meta_path),
+            payload={"query": request.query.strip(), "top_k": request.top_k},
+        )
+        results = await get_group("kb_query").do(
+            key, lambda: asyncio.to_thread(rag.query, request.query, index, chunks, request.top_k)
+        )
 
         return QueryKBResponse(
             project_id=request.project_id,
@@ -1491,10 +3060,32 @@ async def query_kb(request: QueryKBRequest, api_key: str = Depends(verify_api_ke
             results=results,
             total_results=len(results),
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/kb/prefetch/{project_id}")
+async def prefetch_kb(project_id: str, background_tasks: BackgroundTasks, api_key: str = Depends(verify_api_key)):
+    """
+    Load a project's KB into the index cache ahead of its first query
+    (called when a conversation is opened).
+
+    Usage:
+    POST /kb/prefetch/proj_123
+    Headers: X-API-Key: your-api-key
+    """
+    rag = await asyncio.to_thread(_get_rag_manager)
+    index_path, meta_path = rag.get_project_paths(KB_BASE_DIR, project_id)
+    if not os.path.exists(index_path):
+        return {"project_id": project_id, "status": "not_found"}
+    if _kb_indexes.peek(project_id, kb_version_token(index_path, meta_path)) is not None:
+        return {"project_id": project_id, "status": "cached"}
+    background_tasks.add_task(_get_project_kb, project_id)
+    return {"project_id": project_id, "status": "loading"}
+
+
 @app.get("/kb/status/{project_id}", response_model=KBStatusResponse)
 async def get_kb_status(project_id: str, api_key: str = Depends(verify_api_key)):
     """
@@ -1505,10 +3096,13 @@ async def get_kb_status(project_id: str, api_key: str = Depends(verify_api_key))
     Headers: X-API-Key: your-api-key
     """
     try:
-        rag = _get_rag_manager()
+        rag = await asyncio.to_thread(_get_rag_manager)
         index_path, meta_path = rag.get_project_paths(KB_BASE_DIR, project_id)
 
-        status = rag.get_kb_status(index_path, meta_path)
+        key = make_key("kb_status", project_id, kb_version_token(index_path, meta_path))
+        status = await get_group("kb_status").do(
+            key, lambda: asyncio.to_thread(rag.get_kb_status, index_path, meta_path)
+        )
 
         return KBStatusResponse(
             project_id=project_id,
@@ -1547,9 +3141,10 @@ async def get_job_status(job_id: str, api_key: str = Depends(verify_api_key)):
 async def test_groq():
     """Simple test endpoint to verify Groq connection"""
     try:
-        chat_completion = groq_client.chat.completions.create(
-            messages=[{"role": "user", "content": "Say 'Hello, FastAPI with Groq!'"}],
-            model=DEFAULT_MODEL,
+        chat_completion = create_completion(
+            groq_client,
+            DEFAULT_MODEL,
+            [{"role": "user", "content": "Say 'Hello, FastAPI with Groq!'"}],
             max_tokens=50,
         )
         return {
@@ -1587,6 +3182,8 @@ LLM_API_KEY=dev-secret-key-12345
 # Knowledge Base Configuration
 KB_BASE_DIR=faiss_store                    # Base directory for all project indexes
 KB_MODEL=all-MiniLM-L6-v2                  # SentenceTransformer model for embeddings
+KB_CACHE_PROJECTS=16                       # Loaded project indexes kept in memory
+KB_CHAT_TOP_K=5                            # Project KB chunks added to every chat message
 
 # Legacy RAG Configuration (for existing chat endpoint)
 RAG_ENABLED=true
@@ -1595,5 +3192,7 @@ RAG_META_PATH=faiss_store/faiss_meta.pkl
 RAG_MODEL=all-MiniLM-L6-v2
 RAG_TOP_K=5
 RAG_SIM_THRESHOLD=0.35
-RAG_KEYWORDS=requirement,requirements,specification,standard,security,privacy,compliance,regulation,payment,billing
+RAG_ROUTER_EXAMPLES=                       # JSON file of "retrieve"/"chitchat" example messages (empty = built-in)
+RAG_ROUTER_PATH=data/rag_router.npz        # Cached router centroids
+RAG_ROUTER_MARGIN=0.0                      # Score margin above which a message uses retrieval
 """
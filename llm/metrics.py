@@ -0,0 +1,126 @@
+"""
+metrics.py
+Prometheus instrumentation for the service (exposed on /metrics).
+
+Hot paths only touch pre-created histograms and gauges, which is a lock
+and a few additions per observation. Cache sizes and hit/miss counts that
+the caches already track are read when /metrics is scraped, through a
+collector, instead of being counted twice on the request path.
+
+prometheus_client is optional: without it every metric is a no-op and
+/metrics reports that metrics are unavailable.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Tuple
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+except ImportError:
+    CollectorRegistry = None
+
+METRICS_AVAILABLE = CollectorRegistry is not None
+REGISTRY = CollectorRegistry() if METRICS_AVAILABLE else None
+
+# Endpoint an LLM call is made for (set per request by the HTTP middleware;
+# background work keeps the value of the request that started it)
+current_endpoint: ContextVar[str] = ContextVar("metrics_endpoint", default="background")
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+
+def _histogram(name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=SECONDS_BUCKETS):
+    if not METRICS_AVAILABLE:
+        return _NoopMetric()
+    return Histogram(name, documentation, labelnames, buckets=buckets, registry=REGISTRY)
+
+
+def _counter(name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+    if not METRICS_AVAILABLE:
+        return _NoopMetric()
+    return Counter(name, documentation, labelnames, registry=REGISTRY)
+
+
+def _gauge(name: str, documentation: str):
+    if not METRICS_AVAILABLE:
+        return _NoopMetric()
+    return Gauge(name, documentation, registry=REGISTRY)
+
+
+EMBED_SECONDS = _histogram("embed_seconds", "Time to embed a batch of texts", ("source",))
+INDEX_LOAD_SECONDS = _histogram("index_load_seconds", "Time to read a FAISS index and its metadata")
+SEARCH_SECONDS = _histogram("faiss_search_seconds", "Time of one FAISS index search")
+CLUSTERING_SECONDS = _histogram("clustering_seconds", "Time to cluster requirement embeddings", ("backend",))
+LLM_SECONDS = _histogram("llm_request_seconds", "LLM completion latency", ("endpoint", "model"))
+LLM_TOKENS = _histogram("llm_tokens", "Total tokens of one LLM completion", ("endpoint", "model"), TOKEN_BUCKETS)
+LLM_ERRORS = _counter("llm_errors", "Failed LLM completions", ("endpoint", "model"))
+LLM_IN_FLIGHT = _gauge("llm_in_flight", "LLM completions currently running")
+
+
+@contextmanager
+def timed(metric, *labels: str):
+    """Observe the duration of the block on `metric` (with label values)."""
+    if labels:
+        metric = metric.labels(*labels)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric.observe(time.perf_counter() - start)
+
+
+# A stats source returns (gauges, counters):
+#   gauges   {metric name: value}
+#   counters {metric name: (label name, {label value: count})}
+StatsSource = Callable[[], Tuple[Dict[str, float], Dict[str, Tuple[str, Dict[str, float]]]]]
+
+
+class _StatsCollector:
+    """Turns stats dicts into metric families at scrape time."""
+
+    def __init__(self, source: StatsSource):
+        self.source = source
+
+    def collect(self) -> Iterable:
+        gauges, counters = self.source()
+        for name, value in gauges.items():
+            yield GaugeMetricFamily(name, name.replace("_", " "), value=value)
+        for name, (label, values) in counters.items():
+            family = CounterMetricFamily(name, name.replace("_", " "), labels=[label])
+            for label_value, value in values.items():
+                family.add_metric([label_value], value)
+            yield family
+
+    def describe(self) -> List:
+        return []
+
+
+def register_stats(source: StatsSource):
+    """Expose values the service already tracks, read on every scrape."""
+    if METRICS_AVAILABLE:
+        REGISTRY.register(_StatsCollector(source))
+
+
+def render() -> Tuple[bytes, str]:
+    """Current metrics in the Prometheus text format, and its content type."""
+    if not METRICS_AVAILABLE:
+        return b"# prometheus_client is not installed\n", "text/plain; charset=utf-8"
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,106 @@
+"""
+persona_batch.py
+Prompt packing for batch persona-view generation.
+
+Rewriting every requirement for every persona one HTTP call at a time
+costs requirements x personas round-trips. Instead, each persona's
+requirements are packed into prompts under a token budget and the model
+returns one view per requirement. Requirements are addressed by short
+aliases (R1, R2, ...) so the model never has to echo arbitrary ids.
+"""
+
+import re
+from typing import Any, Dict, List, Tuple
+
+from token_utils import count_tokens
+
+# Per-requirement scaffolding (alias, separators) in the listing
+LINE_OVERHEAD_TOKENS = 6
+# Completion tokens reserved per requirement in a packed prompt
+VIEW_RESPONSE_TOKENS = 350
+MAX_RESPONSE_TOKENS = 4000
+
+BATCH_VIEW_PROMPT = """Rewrite each of the following requirements from your perspective.
+
+Requirements:
+{listing}
+
+Return ONLY valid JSON, one entry per requirement, using the ids given above:
+{{
+  "views": [
+    {{"id": "R1", "view": "The rewritten requirement"}}
+  ]
+}}"""
+
+_ALIAS_RE = re.compile(r"R(\d+)$")
+
+
+def pack_requirements(
+    requirements: List[Dict[str, Any]],
+    token_budget: int,
+    max_requirements: int,
+) -> List[List[int]]:
+    """
+    Split requirements into consecutive prompt-sized packs.
+
+    Args:
+        requirements: {"id", "text"} dicts
+        token_budget: Maximum listing tokens per prompt; a single larger
+            requirement gets a pack of its own
+        max_requirements: Maximum requirements per prompt
+
+    Returns:
+        Lists of requirement indices, in input order
+    """
+    packs: List[List[int]] = []
+    current: List[int] = []
+    used = 0
+    for i, req in enumerate(requirements):
+        size = count_tokens(str(req.get("text", ""))) + LINE_OVERHEAD_TOKENS
+        if current and (used + size > token_budget or len(current) >= max_requirements):
+            packs.append(current)
+            current, used = [], 0
+        current.append(i)
+        used += size
+    if current:
+        packs.append(current)
+    return packs
+
+
+def build_batch_prompt(requirements: List[Dict[str, Any]]) -> Tuple[str, int]:
+    """
+    User prompt for one pack.
+
+    Returns:
+        (prompt, max_tokens to request for the completion)
+    """
+    listing = "\n".join(
+        f"R{position}: {req.get('text', '')}" for position, req in enumerate(requirements, start=1)
+    )
+    max_tokens = min(MAX_RESPONSE_TOKENS, VIEW_RESPONSE_TOKENS * len(requirements) + 100)
+    return BATCH_VIEW_PROMPT.format(listing=listing), max_tokens
+
+
+def parse_batch_views(raw: Dict[str, Any], count: int) -> Dict[int, str]:
+    """
+    Map a parsed model response back to pack positions.
+
+    Args:
+        raw: Parsed JSON response ({"views": [{"id": "R1", "view": ...}]})
+        count: Number of requirements in the pack
+
+    Returns:
+        {position (0-based): view}; unknown aliases and empty views are dropped
+    """
+    views: Dict[int, str] = {}
+    for item in raw.get("views", []) if isinstance(raw, dict) else []:
+        if not isinstance(item, dict):
+            continue
+        match = _ALIAS_RE.match(str(item.get("id", "")).strip())
+        view = item.get("view")
+        if not match or not isinstance(view, str) or not view.strip():
+            continue
+        position = int(match.group(1)) - 1
+        if 0 <= position < count and position not in views:
+            views[position] = view.strip()
+    return views
@@ -1,9 +1,17 @@
 """
 Persona Manager for LLM Service
 Generates dynamic system prompts based on persona profiles.
+
+PersonaPromptRegistry compiles each persona once per task type and keeps
+the result in an LRU cache, so every endpoint sends the same stable prompt
+prefix for a persona (which also lets provider-side prompt caching apply).
 """
 
-from typing import Dict, Optional, List
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, List, Tuple
 from dataclasses import dataclass
 from enum import Enum
 
@@ -50,9 +58,15 @@ class PersonaManager:
     Manages persona profiles and generates persona-specific prompts for LLM.
     """
     
-    def __init__(self):
-        """Initialize persona manager."""
-        self.personas: Dict[int, PersonaProfile] = {}
+    def __init__(self, max_personas: int = 256):
+        """
+        Initialize persona manager.
+        
+        Args:
+            max_personas: Loaded personas kept (least recently used go first)
+        """
+        self.max_personas = max_personas
+        self.personas: "OrderedDict[int, PersonaProfile]" = OrderedDict()
     
     def load_persona(self, persona_data: Dict) -> PersonaProfile:
         """
@@ -64,29 +78,43 @@ class PersonaManager:
         Returns:
             PersonaProfile object
         """
+        # Database rows may carry nulls or plain strings where lists are expected
+        def as_list(value) -> List[str]:
+            if not value:
+                return []
+            return [str(v) for v in value] if isinstance(value, (list, tuple)) else [str(value)]
+        
+        name = persona_data.get('name') or 'Unknown'
         persona = PersonaProfile(
             id=persona_data.get('id'),
-            name=persona_data.get('name'),
-            type=persona_data.get('type', 'custom'),
-            role=persona_data.get('role'),
-            description=persona_data.get('description', ''),
-            priorities=persona_data.get('priorities', []),
-            concerns=persona_data.get('concerns', []),
-            typical_requirements=persona_data.get('typical_requirements', []),
-            communication_style=persona_data.get('communication_style', 'Professional'),
-            technical_level=persona_data.get('technical_level', 'medium'),
-            focus_areas=persona_data.get('focus_areas', []),
-            example_questions=persona_data.get('example_questions', []),
-            custom_attributes=persona_data.get('custom_attributes', {})
+            name=name,
+            type=persona_data.get('type') or 'custom',
+            role=persona_data.get('role') or name,
+            description=persona_data.get('description') or '',
+            priorities=as_list(persona_data.get('priorities')),
+            concerns=as_list(persona_data.get('concerns')),
+            typical_requirements=as_list(persona_data.get('typical_requirements')),
+            communication_style=persona_data.get('communication_style') or 'Professional',
+            technical_level=persona_data.get('technical_level') or 'medium',
+            focus_areas=as_list(persona_data.get('focus_areas')),
+            example_questions=as_list(persona_data.get('example_questions')),
+            custom_attributes=persona_data.get('custom_attributes') or {}
         )
         
-        # Cache the persona
-        self.personas[persona.id] = persona
+        # Cache the persona (bounded, least recently used evicted first)
+        if persona.id is not None:
+            self.personas[persona.id] = persona
+            self.personas.move_to_end(persona.id)
+            while len(self.personas) > self.max_personas:
+                self.personas.popitem(last=False)
         return persona
     
     def get_persona(self, persona_id: int) -> Optional[PersonaProfile]:
         """Get a cached persona by ID."""
-        return self.personas.get(persona_id)
+        persona = self.personas.get(persona_id)
+        if persona is not None:
+            self.personas.move_to_end(persona_id)
+        return persona
     
     def generate_system_prompt(
         self, 
@@ -99,7 +127,7 @@ class PersonaManager:
         
         Args:
             persona: PersonaProfile object
-            task_type: Type of task (generate, analyze, review, refine)
+            task_type: Type of task (generate, analyze, review, refine, chat, view)
             context: Optional context to include in prompt
             
         Returns:
@@ -221,6 +249,22 @@ Refine the requirements to better align with your {persona.role} perspective:
 5. Ensure technical level is appropriate
 
 Provide improved versions of the requirements with explanations of changes.
+""",
+            'chat': f"""
+**Your Task: Discuss Requirements**
+
+You are now responding as '{persona.name}'. Respond to all messages from
+this persona's perspective, focusing on your priorities, concerns, and
+{persona.technical_level} technical level.
+""",
+            'view': f"""
+**Your Task: Rewrite Requirements**
+
+Rewrite each requirement you are given from your {persona.role} perspective:
+- Focus on what matters most to you in this role
+- Be specific and detailed
+- Use language appropriate to your {persona.technical_level} technical level
+- Highlight key concerns and considerations
 """
         }
         
@@ -234,6 +278,10 @@ Provide improved versions of the requirements with explanations of changes.
         """
         Generate a prompt that considers multiple personas simultaneously.
         
+        One completion then covers every persona, so it gets longer and slower
+        with each persona added; the service's /api/persona/analyze endpoint
+        instead runs one call per persona concurrently and merges the results.
+        
         Args:
             personas: List of PersonaProfile objects
             task_type: Type of task
@@ -314,8 +362,70 @@ Provide a comprehensive multi-stakeholder analysis.
             return 'generate'  # Default
 
 
-# Global instance
+def persona_fingerprint(persona_data: Dict[str, Any]) -> str:
+    """Content hash of a persona's fields (key order independent)."""
+    canonical = json.dumps(persona_data, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class PersonaPromptRegistry:
+    """
+    LRU cache of compiled persona system prompts.
+    
+    Entries are keyed by (persona id, content hash, task type), so an edited
+    persona compiles to a new entry while unchanged personas always get the
+    byte-identical prompt.
+    
+    Args:
+        manager: PersonaManager used to compile prompts
+        max_entries: Compiled prompts kept (least recently used go first)
+    """
+    
+    def __init__(self, manager: Optional[PersonaManager] = None, max_entries: int = 512):
+        self.manager = manager or PersonaManager()
+        self.max_entries = max_entries
+        self._prompts: "OrderedDict[Tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def key(self, persona_data: Dict[str, Any], task_type: str) -> Tuple:
+        return (persona_data.get('id'), persona_fingerprint(persona_data), task_type)
+    
+    def compile(self, persona_data: Dict[str, Any], task_type: str = 'generate') -> str:
+        """
+        Compiled system prompt of a persona for a task type.
+        
+        Args:
+            persona_data: Persona fields as sent by the backend
+            task_type: generate, analyze, review, refine, chat or view
+            
+        Returns:
+            The persona system prompt (compiled on first use)
+        """
+        key = self.key(persona_data, task_type)
+        with self._lock:
+            prompt = self._prompts.get(key)
+            if prompt is not None:
+                self._prompts.move_to_end(key)
+                self.hits += 1
+                return prompt
+            self.misses += 1
+            persona = self.manager.load_persona(persona_data)
+            prompt = self.manager.generate_system_prompt(persona, task_type)
+            self._prompts[key] = prompt
+            while len(self._prompts) > self.max_entries:
+                self._prompts.popitem(last=False)
+            return prompt
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._prompts), "hits": self.hits, "misses": self.misses}
+
+
+# Global instances
 persona_manager = PersonaManager()
+persona_registry = PersonaPromptRegistry(persona_manager)
 
 
 def get_persona_prompt(persona_data: Dict, user_message: str, task_type: str = None) -> Dict[str, str]:
@@ -335,7 +445,7 @@ def get_persona_prompt(persona_data: Dict, user_message: str, task_type: str = N
     if task_type is None:
         task_type = persona_manager._infer_task_type(user_message)
     
-    system_prompt = persona_manager.generate_system_prompt(persona, task_type)
+    system_prompt = persona_registry.compile(persona_data, task_type)
     
     return {
         'system_prompt': system_prompt,
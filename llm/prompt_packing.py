@@ -0,0 +1,202 @@
+"""
+prompt_packing.py
+Token-budget packing of conflict-check prompts.
+
+Requirements are sized with the local tokenizer (token_utils). Large groups
+(clusters) are split into token-bounded pieces, and small pieces are
+bin-packed so several clusters share one prompt and one instruction
+preamble. Each piece keeps its own pair rules: the model is told to compare
+only inside a group (or only the listed pairs), and answers that cross
+groups are dropped when parsing.
+
+Requirement IDs are replaced by short aliases (R1, R2, ...) in the prompt
+and mapped back when the answer is parsed, so arbitrary ID strings cost few
+tokens and the model cannot return IDs that were never sent.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from token_utils import count_tokens
+
+# Numbering, alias and separators around each requirement line ("12. [R12] ")
+LINE_OVERHEAD_TOKENS = 6
+# Group header and its pair list separators
+GROUP_OVERHEAD_TOKENS = 8
+# One "[R1] vs [R2]" entry in a group's pair list
+PAIR_TOKENS = 10
+
+
+@dataclass
+class ConflictGroup:
+    """
+    Requirements that may be compared with each other in one prompt.
+
+    Args:
+        group_id: Cluster id reported on conflicts found in this group
+        requirements: (req_id, req_text) tuples
+        pairs: (req_id, req_id) pairs to check; None means every pair
+            inside the group
+    """
+    group_id: int
+    requirements: List[Tuple[str, str]]
+    pairs: Optional[List[Tuple[str, str]]] = None
+
+    def tokens(self) -> int:
+        """Estimated prompt tokens for this group's listing."""
+        total = GROUP_OVERHEAD_TOKENS + sum(requirement_tokens(text) for _, text in self.requirements)
+        if self.pairs is not None:
+            total += PAIR_TOKENS * len(self.pairs)
+        return total
+
+    def candidate_pairs(self) -> List[Tuple[str, str]]:
+        """The pairs this group asks about."""
+        if self.pairs is not None:
+            return list(self.pairs)
+        ids = [req_id for req_id, _ in self.requirements]
+        return [(ids[i], ids[j]) for i in range(len(ids)) for j in range(i + 1, len(ids))]
+
+
+def requirement_tokens(text: str) -> int:
+    """Estimated tokens one requirement line takes in a prompt."""
+    return count_tokens(text) + LINE_OVERHEAD_TOKENS
+
+
+def split_group(group: ConflictGroup, token_budget: int, max_requirements: int) -> List[ConflictGroup]:
+    """
+    Split a group into consecutive pieces that fit the budget.
+
+    Groups with explicit pairs are returned unchanged (they are already
+    sized by pack_pairs, and splitting would separate pair members). The
+    split is deterministic, so the same cluster yields the same pieces on
+    every run and cached verdicts line up.
+    """
+    if group.pairs is not None or not group.requirements:
+        return [group]
+
+    pieces: List[ConflictGroup] = []
+    current: List[Tuple[str, str]] = []
+    used = GROUP_OVERHEAD_TOKENS
+    for req in group.requirements:
+        size = requirement_tokens(req[1])
+        if current and (used + size > token_budget or len(current) >= max_requirements):
+            pieces.append(ConflictGroup(group.group_id, current))
+            current, used = [], GROUP_OVERHEAD_TOKENS
+        current.append(req)
+        used += size
+    pieces.append(ConflictGroup(group.group_id, current))
+    return pieces
+
+
+def pack_groups(
+    groups: List[ConflictGroup], token_budget: int, max_requirements: int
+) -> List[List[int]]:
+    """
+    Bin-pack groups into prompts (first-fit decreasing by token size).
+
+    Args:
+        groups: Groups to pack; each should already fit the budget
+            (see split_group) - an oversized group gets a prompt of its own
+        token_budget: Maximum estimated tokens of requirement listings per prompt
+        max_requirements: Maximum requirements per prompt
+
+    Returns:
+        Prompts as lists of indices into `groups`, in first-seen order
+    """
+    sizes = [g.tokens() for g in groups]
+    order = sorted(range(len(groups)), key=lambda i: -sizes[i])
+    bins: List[Dict[str, Any]] = []
+    for i in order:
+        count = len(groups[i].requirements)
+        for b in bins:
+            if b["tokens"] + sizes[i] <= token_budget and b["count"] + count <= max_requirements:
+                b["members"].append(i)
+                b["tokens"] += sizes[i]
+                b["count"] += count
+                break
+        else:
+            bins.append({"members": [i], "tokens": sizes[i], "count": count})
+
+    prompts = [sorted(b["members"]) for b in bins]
+    prompts.sort(key=lambda members: members[0])
+    return prompts
+
+
+class AliasedPrompt:
+    """
+    Requirement listing for one prompt, with short aliases per group member.
+
+    The same requirement may appear in several groups of one prompt; each
+    occurrence gets its own alias so pair rules stay scoped to the group.
+    """
+
+    def __init__(self, groups: List[ConflictGroup]):
+        self.groups = groups
+        self._alias_to_member: Dict[str, Tuple[int, str]] = {}
+        self._aliases: List[Dict[str, str]] = []
+        n = 0
+        for g, group in enumerate(groups):
+            aliases = {}
+            for req_id, _ in group.requirements:
+                if req_id in aliases:
+                    continue
+                n += 1
+                aliases[req_id] = f"R{n}"
+                self._alias_to_member[f"R{n}"] = (g, req_id)
+            self._aliases.append(aliases)
+
+    @property
+    def has_pair_lists(self) -> bool:
+        return any(group.pairs is not None for group in self.groups)
+
+    def listing(self) -> str:
+        """Requirements grouped by cluster piece, with per-group pair lists."""
+        blocks = []
+        line = 0
+        for g, group in enumerate(self.groups):
+            aliases = self._aliases[g]
+            if group.pairs is not None:
+                pair_list = ", ".join(f"[{aliases[a]}] vs [{aliases[b]}]" for a, b in group.pairs)
+                header = f"Group {g + 1} (check ONLY these pairs: {pair_list}):"
+            else:
+                header = f"Group {g + 1}:"
+            lines = [header]
+            for req_id, text in group.requirements:
+                line += 1
+                lines.append(f"{line}. [{aliases[req_id]}] {text}")
+            blocks.append("\n".join(lines))
+        return "\n\n".join(blocks)
+
+    def resolve(self, raw_conflicts: List[Any]) -> List[Tuple[int, Dict[str, Any]]]:
+        """
+        Map aliased answers back to real IDs and enforce the pair rules.
+
+        Answers naming unknown aliases, pairs across groups, or pairs not in
+        a group's explicit list are dropped; duplicates are collapsed.
+
+        Returns:
+            (group index, conflict dict with real req_a/req_b) tuples
+        """
+        allowed = [
+            {frozenset(p) for p in group.pairs} if group.pairs is not None else None
+            for group in self.groups
+        ]
+        seen = set()
+        results = []
+        for conflict in raw_conflicts:
+            if not isinstance(conflict, dict):
+                continue
+            a = self._alias_to_member.get(_normalize_alias(conflict.get("req_a")))
+            b = self._alias_to_member.get(_normalize_alias(conflict.get("req_b")))
+            if a is None or b is None or a[0] != b[0] or a[1] == b[1]:
+                continue
+            g, pair = a[0], frozenset((a[1], b[1]))
+            if (allowed[g] is not None and pair not in allowed[g]) or (g, pair) in seen:
+                continue
+            seen.add((g, pair))
+            results.append((g, {**conflict, "req_a": a[1], "req_b": b[1]}))
+        return results
+
+
+def _normalize_alias(value: Any) -> str:
+    return str(value or "").strip().strip("[]").strip().upper()
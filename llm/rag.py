@@ -10,6 +10,9 @@ import numpy as np
 import hashlib
 import logging
 
+from metrics import EMBED_SECONDS, INDEX_LOAD_SECONDS, SEARCH_SECONDS
+from tracing import span
+
 try:
     from sentence_transformers import SentenceTransformer
 except Exception:
@@ -34,13 +37,19 @@ def get_project_lock(project_id: str) -> threading.Lock:
 
 
 class RagManager:
-    def __init__(self, model_name: str = 'all-MiniLM-L6-v2'):
-        if SentenceTransformer is None:
+    def __init__(self, model_name: str = 'all-MiniLM-L6-v2', model: Any = None):
+        """
+        Args:
+            model_name: SentenceTransformer model to load
+            model: Already-loaded encoder to use instead (anything with a
+                SentenceTransformer-compatible encode(), e.g. in benchmarks)
+        """
+        if model is None and SentenceTransformer is None:
             raise RuntimeError('sentence-transformers not installed. pip install sentence-transformers')
         if faiss is None:
             raise RuntimeError('faiss not installed. pip install faiss-cpu')
 
-        self.model = SentenceTransformer(model_name)
+        self.model = model if model is not None else SentenceTransformer(model_name)
 
     def prepare_chunks(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
         """Turn each row into a single text chunk and return list of dicts with id,text,meta."""
@@ -90,7 +99,8 @@ class RagManager:
 
     def embed_texts(self, texts: List[str]) -> np.ndarray:
         """Return numpy array of embeddings."""
-        embs = self.model.encode(texts, show_progress_bar=True, convert_to_numpy=True)
+        with span('embed', EMBED_SECONDS, 'rag'):
+            embs = self.model.encode(texts, show_progress_bar=True, convert_to_numpy=True)
         # ensure 2D
         if embs.ndim == 1:
             embs = np.expand_dims(embs, 0)
@@ -123,9 +133,10 @@ class RagManager:
         if not os.path.exists(index_path) or not os.path.exists(meta_path):
             raise FileNotFoundError(f"Index or metadata file not found: {index_path}, {meta_path}")
         
-        index = faiss.read_index(index_path)
-        with open(meta_path, 'rb') as f:
-            metadata = pickle.load(f)
+        with span('index_load', INDEX_LOAD_SECONDS):
+            index = faiss.read_index(index_path)
+            with open(meta_path, 'rb') as f:
+                metadata = pickle.load(f)
         
         # Handle both old format (list) and new format (dict with version)
         if isinstance(metadata, list):
@@ -284,9 +295,14 @@ class RagManager:
         return status
 
     def query(self, query_text: str, index, chunks: List[Dict[str, Any]], top_k: int = 5) -> List[Dict[str, Any]]:
-        q_emb = self.embed_texts([query_text])
+        return self.search(self.embed_texts([query_text]), index, chunks, top_k=top_k)
+
+    def search(self, q_emb: np.ndarray, index, chunks: List[Dict[str, Any]], top_k: int = 5) -> List[Dict[str, Any]]:
+        """Query with an already computed embedding (1 x d)."""
+        q_emb = np.array(q_emb, dtype='float32').reshape(1, -1)
         faiss.normalize_L2(q_emb)
-        D, I = index.search(q_emb, top_k)
+        with span('search', SEARCH_SECONDS):
+            D, I = index.search(q_emb, top_k)
         results = []
         for score, idx in zip(D[0], I[0]):
             if idx < 0 or idx >= len(chunks):
@@ -306,4 +322,5 @@ def save_index_artifacts(index_path: str, meta_path: str, chunks: List[Dict[str,
 
 
 if __name__ == '__main__':
-    print('Use build_faiss.py to build/run the RAG pipeline')
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    logging.getLogger(__name__).info('Use build_faiss.py to build/run the RAG pipeline')
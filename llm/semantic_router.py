@@ -0,0 +1,179 @@
+"""
+semantic_router.py
+Embedding-based routing of chat messages: retrieve or answer directly.
+
+Each route is represented by the centroid of a few example utterances.
+Since there are only two routes, the decision reduces to one dot product
+of the (normalized) query embedding with the difference of the two
+centroids: positive means the message is closer to "retrieve".
+
+Centroids are persisted next to a fingerprint of the embedding model and
+the example utterances, so they are only recomputed when either changes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+RETRIEVE = "retrieve"
+CHITCHAT = "chitchat"
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXAMPLES: Dict[str, List[str]] = {
+    RETRIEVE: [
+        "What does the specification say about user authentication?",
+        "Which requirements cover payment processing?",
+        "What are the security requirements for storing personal data?",
+        "List the non-functional requirements for performance",
+        "Is there a requirement about GDPR compliance?",
+        "How should the system handle billing and invoices?",
+        "What standard do we follow for accessibility?",
+        "Find requirements similar to offline mode support",
+        "What did the SRS define for password policies?",
+        "Show me the regulations that apply to data retention",
+    ],
+    CHITCHAT: [
+        "Hi there!",
+        "Thanks, that was helpful",
+        "Can you rephrase that more concisely?",
+        "Who are you?",
+        "Good morning",
+        "Make the previous answer shorter",
+        "Translate your last answer into Vietnamese",
+        "What can you help me with?",
+        "OK, sounds good",
+        "Explain that again in simpler words",
+    ],
+}
+
+
+@dataclass
+class RouteDecision:
+    """Routing result for one message."""
+    route: str
+    # centroid similarity difference (retrieve - chitchat), before the margin
+    score: float
+    use_rag: bool
+
+    def as_dict(self) -> Dict[str, object]:
+        return {"route": self.route, "score": round(self.score, 4), "use_rag": self.use_rag}
+
+
+def load_examples(path: Optional[str]) -> Dict[str, List[str]]:
+    """Example utterances from a JSON file ({"retrieve": [...], "chitchat": [...]}), or the defaults."""
+    if not path:
+        return DEFAULT_EXAMPLES
+    with open(path, "r", encoding="utf-8") as fh:
+        data = json.load(fh)
+    examples = {route: [str(u) for u in data.get(route, []) if str(u).strip()] for route in (RETRIEVE, CHITCHAT)}
+    if not examples[RETRIEVE] or not examples[CHITCHAT]:
+        raise ValueError(f"{path} needs non-empty '{RETRIEVE}' and '{CHITCHAT}' lists")
+    return examples
+
+
+class SemanticRouter:
+    """
+    Two-route semantic router with centroids cached on disk.
+
+    Args:
+        model_name: Embedding model the centroids (and queries) come from
+        examples: Example utterances per route
+        path: .npz file the centroids are persisted to (None: memory only)
+        margin: Score above which a message is routed to retrieval
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        examples: Optional[Dict[str, List[str]]] = None,
+        path: Optional[str] = None,
+        margin: float = 0.0,
+    ):
+        self.model_name = model_name
+        self.examples = examples or DEFAULT_EXAMPLES
+        self.path = path
+        self.margin = margin
+        self._direction: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        self.decisions = {RETRIEVE: 0, CHITCHAT: 0}
+
+    def fingerprint(self) -> str:
+        payload = json.dumps({"model": self.model_name, "examples": self.examples}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def ensure(self, encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Centroid difference vector, loading it from disk or building it once.
+
+        Args:
+            encode: Batch encoder for the example utterances (same model as queries)
+        """
+        if self._direction is not None:
+            return self._direction
+        with self._lock:
+            if self._direction is None:
+                direction = self._load()
+                if direction is None:
+                    centroids = {route: _centroid(encode(utterances)) for route, utterances in self.examples.items()}
+                    direction = (centroids[RETRIEVE] - centroids[CHITCHAT]).astype("float32")
+                    self._save(direction)
+                self._direction = direction
+        return self._direction
+
+    def decide(self, query_embedding: np.ndarray, encode: Callable[[List[str]], np.ndarray]) -> RouteDecision:
+        """
+        Route one message from its embedding.
+
+        Args:
+            query_embedding: Embedding of the message (normalized here)
+            encode: Encoder used only if the centroids still need building
+        """
+        direction = self.ensure(encode)
+        query = np.asarray(query_embedding, dtype="float32").reshape(-1)
+        norm = float(np.linalg.norm(query)) or 1.0
+        score = float(direction @ query) / norm
+        use_rag = score > self.margin
+        route = RETRIEVE if use_rag else CHITCHAT
+        self.decisions[route] += 1
+        return RouteDecision(route=route, score=score, use_rag=use_rag)
+
+    def stats(self) -> Dict[str, object]:
+        return {"ready": self._direction is not None, "margin": self.margin, "decisions": dict(self.decisions)}
+
+    def _load(self) -> Optional[np.ndarray]:
+        if not self.path or not os.path.exists(self.path):
+            return None
+        try:
+            with np.load(self.path) as data:
+                if str(data["fingerprint"]) != self.fingerprint():
+                    return None
+                return data["direction"].astype("float32")
+        except Exception as e:
+            logger.warning(f"Semantic router cache unreadable, rebuilding: {e}")
+            return None
+
+    def _save(self, direction: np.ndarray):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp.npz"
+            np.savez(tmp_path, direction=direction, fingerprint=np.array(self.fingerprint()))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Semantic router cache not saved: {e}")
+
+
+def _centroid(embeddings: np.ndarray) -> np.ndarray:
+    """Normalized mean of row-normalized embeddings."""
+    embeddings = np.asarray(embeddings, dtype="float32")
+    embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    mean = embeddings.mean(axis=0)
+    return mean / max(float(np.linalg.norm(mean)), 1e-12)
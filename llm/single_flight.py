@@ -0,0 +1,110 @@
+"""
+single_flight.py
+Request coalescing for identical concurrent operations.
+
+When several callers ask for the same expensive result at the same time
+(e.g. many users opening the same project), only the first caller runs the
+computation. The others await the in-flight result and share it.
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+def make_key(*parts: Any, payload: Any = None) -> str:
+    """
+    Build a normalized single-flight key.
+
+    Args:
+        parts: Scalar key components (endpoint name, project_id, KB version...)
+        payload: Optional request payload; hashed with sorted keys so that
+            logically identical requests map to the same key
+
+    Returns:
+        Stable string key
+    """
+    key = ":".join(str(p) for p in parts)
+    if payload is not None:
+        normalized = json.dumps(payload, sort_keys=True, default=str, separators=(",", ":"))
+        key += ":" + hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+    return key
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls that share a key into one computation.
+
+    The computation runs as its own task, so a caller disconnecting does not
+    cancel the work other callers are waiting on. Nothing is cached once the
+    computation finishes: the next call with the same key starts fresh.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._calls = 0
+        self._executions = 0
+        self._collapsed = 0
+        self._failures = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run `fn` once per key among concurrent callers.
+
+        Args:
+            key: Normalized request key (see make_key)
+            fn: Zero-argument coroutine function producing the result
+
+        Returns:
+            Result of the (possibly shared) computation
+        """
+        self._calls += 1
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self._collapsed += 1
+            return await asyncio.shield(task)
+
+        self._executions += 1
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda t, k=key: self._on_done(k, t))
+        return await asyncio.shield(task)
+
+    def _on_done(self, key: str, task: asyncio.Task):
+        """Drop the finished task and mark its exception as retrieved."""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is not None:
+            self._failures += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return counters describing how many calls were collapsed."""
+        return {
+            "calls": self._calls,
+            "executions": self._executions,
+            "collapsed": self._collapsed,
+            "failures": self._failures,
+            "in_flight": len(self._inflight),
+            "collapse_ratio": round(self._collapsed / self._calls, 4) if self._calls else 0.0,
+        }
+
+
+# Registry of named groups so metrics can be reported in one place
+_groups: Dict[str, SingleFlight] = {}
+
+
+def get_group(name: str) -> SingleFlight:
+    """Get or create the single-flight group for an operation name."""
+    group: Optional[SingleFlight] = _groups.get(name)
+    if group is None:
+        group = SingleFlight(name)
+        _groups[name] = group
+    return group
+
+
+def get_all_stats() -> Dict[str, Dict[str, Any]]:
+    """Return stats for every registered group."""
+    return {name: group.stats() for name, group in _groups.items()}
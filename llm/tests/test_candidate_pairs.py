@@ -0,0 +1,33 @@
+import random
+
+from candidate_pairs import pack_pairs
+
+
+def test_pack_pairs_respects_limits_and_places_every_pair():
+    rng = random.Random(0)
+    pairs = []
+    for _ in range(5000):
+        i, j = rng.sample(range(1000), 2)
+        pairs.append({"i": min(i, j), "j": max(i, j)})
+
+    batches = pack_pairs(pairs, max_requirements=30, max_pairs=40)
+
+    assert sorted(p for b in batches for p in b["pairs"]) == sorted((p["i"], p["j"]) for p in pairs)
+    for batch in batches:
+        assert len(batch["rows"]) <= 30
+        assert len(batch["pairs"]) <= 40
+        assert {r for pair in batch["pairs"] for r in pair} == set(batch["rows"])
+
+
+def test_pack_pairs_keeps_pairs_of_a_requirement_together():
+    # A hub requirement with its neighbours, interleaved with unrelated pairs
+    pairs = []
+    for n in range(10):
+        pairs.append({"i": 0, "j": 100 + n})
+        pairs.append({"i": 200 + 2 * n, "j": 201 + 2 * n})
+
+    batches = pack_pairs(pairs, max_requirements=30, max_pairs=40)
+
+    hub = [b for b in batches if 0 in b["rows"]]
+    assert len(hub) == 1
+    assert len([p for p in hub[0]["pairs"] if 0 in p]) == 10
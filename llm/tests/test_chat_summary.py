@@ -0,0 +1,68 @@
+import asyncio
+
+from chat_summary import RollingSummaries
+
+
+def make_history(n):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i} " + "word " * 50}
+        for i in range(n)
+    ]
+
+
+async def drain(summaries):
+    while summaries._tasks:
+        await asyncio.gather(*list(summaries._tasks))
+
+
+def test_summary_survives_sliding_window():
+    calls = []
+
+    async def summarize(previous, turns):
+        calls.append(len(turns))
+        return f"{previous}+{len(turns)}"
+
+    async def run():
+        summaries = RollingSummaries(summarize, trigger_tokens=100, keep_recent=6, fold_tokens=100000)
+        full = make_history(80)
+
+        # First 40 messages: one fold covering all but the recent turns
+        assert summaries.schedule("c", full[:40])
+        await drain(summaries)
+        assert calls == [34]
+        summary, covered = summaries.get("c", full[:40])
+        assert (summary, covered) == ("+34", 34)
+
+        # The client slides its 40-message window by one exchange per turn
+        for start in range(2, 20, 2):
+            window = full[start:start + 40]
+            summary, covered = summaries.get("c", window)
+            # Two turns dropped off the front, two new ones not yet folded
+            assert summary is not None and covered == 32
+            summaries.schedule("c", window)
+            await drain(summaries)
+
+        # Every fold only extended the summary with the two new turns
+        assert calls == [34] + [2] * 9
+        summary, covered = summaries.get("c", full[18:58])
+        assert covered == 34
+
+    asyncio.run(run())
+
+
+def test_edited_covered_turn_invalidates_summary():
+    async def summarize(previous, turns):
+        return "summary"
+
+    async def run():
+        summaries = RollingSummaries(summarize, trigger_tokens=100, keep_recent=6)
+        history = make_history(40)
+        summaries.schedule("c", history)
+        await drain(summaries)
+        assert summaries.get("c", history)[1] == 34
+
+        edited = [dict(turn) for turn in history]
+        edited[10]["content"] = "changed"
+        assert summaries.get("c", edited) == (None, 0)
+
+    asyncio.run(run())
@@ -0,0 +1,58 @@
+import pytest
+
+from incremental_json import IncrementalArrayParser
+
+
+def parse(text, step=None):
+    parser = IncrementalArrayParser()
+    items = []
+    if step is None:
+        items.extend(parser.feed(text))
+    else:
+        for start in range(0, len(text), step):
+            items.extend(parser.feed(text[start:start + step]))
+    return items, parser.close()
+
+
+@pytest.mark.parametrize("step", [None, 1, 7])
+def test_chatter_with_brackets_before_the_object(step):
+    items, stats = parse('Sure! [note] {"requirements":[{"a":1},{"b":2}]} Hope this helps [1].', step)
+    assert items == [{"a": 1}, {"b": 2}]
+    assert stats == {"emitted": 2, "invalid": 0, "dropped_partial": 0}
+
+
+def test_requirements_key_after_another_array_field():
+    items, _ = parse('{"notes": ["x", {"y": 1}], "meta": {"tags": []}, "requirements": [{"a": 1}]}')
+    assert items == [{"a": 1}]
+
+
+def test_top_level_array_at_start_or_after_code_fence():
+    assert parse('  [{"a": 1}, {"b": 2}]')[0] == [{"a": 1}, {"b": 2}]
+    assert parse('Here you go:\n```json\n[{"a": 1}]\n```')[0] == [{"a": 1}]
+
+
+def test_top_level_array_after_chatter_is_not_the_target():
+    assert parse('See [1] and [{"a": 1}]')[0] == []
+
+
+def test_truncated_tail_loses_only_the_open_item():
+    items, stats = parse('{"requirements": [{"a": 1}, {"b": 2}, {"c": "cut o', 5)
+    assert items == [{"a": 1}, {"b": 2}]
+    assert stats["dropped_partial"] == 1
+
+
+def test_trailing_commas_are_tolerated():
+    items, stats = parse('{"requirements": [{"a": 1, "b": [1, 2,],}, {"c": 3},]}')
+    assert items == [{"a": 1, "b": [1, 2]}, {"c": 3}]
+    assert stats["invalid"] == 0
+
+
+def test_escaped_quotes_and_brackets_inside_strings():
+    text = r'{"requirements": [{"t": "a [b] {c} \"d]\" e"}, {"u": "\\"}]}'
+    items, _ = parse(text, 3)
+    assert items == [{"t": 'a [b] {c} "d]" e'}, {"u": "\\"}]
+
+
+def test_brackets_in_keys_and_values_before_the_target():
+    items, _ = parse('{"title": "see [draft]", "requirements": [{"a": 1}]}')
+    assert items == [{"a": 1}]
@@ -0,0 +1,45 @@
+import os
+import pickle
+import threading
+
+from verdict_cache import PairVerdictCache, VerdictCacheStore
+
+
+def test_overlapping_saves_leave_a_complete_file(tmp_path):
+    path = str(tmp_path / "pair_verdicts.pkl")
+    caches = [PairVerdictCache(path) for _ in range(4)]
+
+    def writer(cache, n):
+        for i in range(50):
+            cache.record(f"a{n}-{i}", f"b{n}-{i}", "model", conflict=bool(i % 2))
+            cache.save()
+
+    threads = [threading.Thread(target=writer, args=(cache, n)) for n, cache in enumerate(caches)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with open(path, "rb") as f:
+        assert len(pickle.load(f)) == 50
+    assert os.listdir(tmp_path) == ["pair_verdicts.pkl"]
+    assert len(PairVerdictCache(path)) == 50
+
+
+def test_store_shares_one_cache_per_project_and_saves_evicted(tmp_path):
+    store = VerdictCacheStore(base_dir=str(tmp_path), max_projects=2)
+
+    first = store.get(1)
+    assert store.get("1") is first
+    assert store.cached(2) is None
+
+    first.record("a", "b", "model", conflict=True)
+    store.get(2)
+    store.get(3)  # evicts project 1, which is saved on the way out
+
+    assert store.cached(1) is None
+    assert len(store) == 2
+    reloaded = store.get(1)
+    assert reloaded is not first
+    assert reloaded.get("b", "a", "model")["conflict"] is True
+    assert os.path.exists(os.path.join(str(tmp_path), "1", "pair_verdicts.pkl"))
@@ -0,0 +1,62 @@
+"""
+token_utils.py
+Local token counting for prompt budgeting.
+
+Uses tiktoken when it is installed; otherwise falls back to a character
+based estimate (~4 characters per token for English text), which is close
+enough for sizing prompts against a budget.
+"""
+
+import math
+from functools import lru_cache
+from typing import Optional
+
+try:
+    import tiktoken
+except Exception:
+    tiktoken = None
+
+CHARS_PER_TOKEN = 4
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=4)
+def _get_encoding(name: str = DEFAULT_ENCODING):
+    """Load (once) a tiktoken encoding, or None if unavailable."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception:
+        return None
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """
+    Count tokens in a piece of text.
+
+    Args:
+        text: Text to measure
+
+    Returns:
+        Token count (exact with tiktoken, estimated otherwise)
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return int(math.ceil(len(text) / CHARS_PER_TOKEN))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text so that it fits within `max_tokens`."""
+    if max_tokens <= 0 or not text:
+        return ""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * CHARS_PER_TOKEN]
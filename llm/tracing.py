@@ -0,0 +1,199 @@
+"""
+tracing.py
+Per-request stage timings and structured logs.
+
+Every request gets a trace, held in a ContextVar, under the request id
+Laravel sent in X-Request-ID (or a generated one). Code on the request
+path wraps its stages in span("name"); durations of spans with the same
+name are summed. The HTTP middleware returns them in a Server-Timing
+header and writes one JSON log line per request, so a slow request can
+be found in the logs by the id Laravel logged for it.
+
+Spans are a perf_counter pair and a dict update, and do nothing outside
+a trace (CLI runs, background loops). Worker threads started with
+asyncio.to_thread see the trace of the request that started them.
+"""
+
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+logger = logging.getLogger("trace")
+
+# Request ids are echoed into headers and logs, so only simple tokens are accepted
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+
+class RequestTrace:
+    """Stage durations of one request (or background job)."""
+
+    def __init__(self, request_id: str, name: str):
+        self.request_id = request_id
+        self.name = name
+        self.start = time.perf_counter()
+        self.stages: Dict[str, list] = {}  # name -> [seconds, count]
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        # Work that outlives its request (background tasks) is not attributed to it
+        if self.finished:
+            return
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        """Server-Timing header value (stage and total durations in ms)."""
+        with self._lock:
+            parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, (seconds, _) in self.stages.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+    def finish(self, **fields: Any) -> Dict[str, Any]:
+        """Close the trace and return its log record."""
+        total = self.elapsed()
+        with self._lock:
+            self.finished = True
+            stages = {
+                stage: {"ms": round(seconds * 1000, 1), "count": count}
+                for stage, (seconds, count) in self.stages.items()
+            }
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            **fields,
+            "duration_ms": round(total * 1000, 1),
+            "stages": stages,
+        }
+
+
+_current: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+def request_id_from(header_value: Optional[str]) -> str:
+    """The caller's request id if it is usable, otherwise a new one."""
+    if header_value and _REQUEST_ID_RE.match(header_value):
+        return header_value
+    return uuid.uuid4().hex
+
+
+def start_trace(request_id: str, name: str) -> RequestTrace:
+    """Make a new trace current for this context (and tasks/threads started from it)."""
+    trace = RequestTrace(request_id, name)
+    _current.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current.get()
+
+
+def current_request_id() -> Optional[str]:
+    trace = _current.get()
+    return trace.request_id if trace is not None else None
+
+
+@contextmanager
+def span(name: str, metric=None, *labels: str):
+    """
+    Time a stage of the current request.
+
+    Args:
+        name: Stage name (Server-Timing metric name, no spaces)
+        metric: Optional Prometheus histogram observing the same duration
+        labels: Label values for the histogram
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        trace = _current.get()
+        if trace is not None:
+            trace.add(name, seconds)
+        if metric is not None:
+            (metric.labels(*labels) if labels else metric).observe(seconds)
+
+
+def record(name: str, seconds: float):
+    """Add an already measured stage duration to the current request."""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+@contextmanager
+def traced(name: str, request_id: Optional[str] = None, **fields: Any):
+    """
+    Trace work outside an HTTP request (e.g. a queued job) and log it on exit.
+
+    Args:
+        name: What is being traced (logged as "name")
+        request_id: Id to log under (generated if None)
+        fields: Extra fields for the log line
+    """
+    trace = RequestTrace(request_id or uuid.uuid4().hex, name)
+    token = _current.set(trace)
+    status = "ok"
+    try:
+        yield trace
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        logger.info("job finished", extra={"trace": trace.finish(status=status, **fields)})
+        _current.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, tagged with the current request id.
+
+    Structured values passed as extra={"fields": {...}} become keys of the line.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        trace_fields = getattr(record, "trace", None)
+        if trace_fields:
+            entry.update(trace_fields)
+        else:
+            request_id = current_request_id()
+            if request_id:
+                entry["request_id"] = request_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level: Optional[str] = None):
+    """Send service logs to stderr as JSON lines (LOG_LEVEL, default INFO)."""
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    root = logging.getLogger()
+    root.handlers = [h for h in root.handlers if not isinstance(getattr(h, "formatter", None), JsonFormatter)]
+    root.addHandler(handler)
+    root.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
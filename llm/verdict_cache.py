@@ -0,0 +1,213 @@
+"""
+verdict_cache.py
+Persistent store of LLM verdicts for requirement pairs.
+
+Once the LLM has judged whether requirements A and B conflict, that verdict
+stays valid until one of the texts changes. Verdicts are keyed by the hashes
+of both texts (order-independent) plus the model name, so a project that has
+not changed can re-run detection without asking the LLM again.
+
+The API endpoints and the background conflict jobs share one store
+(shared_verdict_caches), so a verdict judged by either is reused by both.
+"""
+
+import logging
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from conflict_state import text_hash
+
+logger = logging.getLogger(__name__)
+
+PairKey = Tuple[str, str, str]
+
+# Writers of the same file (several cache instances, or saves overlapping
+# on one instance) take turns, so the newest snapshot is the one left on disk
+_save_locks: Dict[str, threading.Lock] = {}
+_save_locks_guard = threading.Lock()
+
+
+def _save_lock(path: str) -> threading.Lock:
+    key = os.path.abspath(path)
+    with _save_locks_guard:
+        lock = _save_locks.get(key)
+        if lock is None:
+            lock = _save_locks[key] = threading.Lock()
+        return lock
+
+
+def pair_key(text_a: str, text_b: str, model: str) -> PairKey:
+    """Order-independent key for a pair of requirement texts judged by `model`."""
+    ha, hb = text_hash(text_a), text_hash(text_b)
+    return (ha, hb, model) if ha <= hb else (hb, ha, model)
+
+
+class PairVerdictCache:
+    """
+    Verdicts for one project, persisted as a pickle file.
+
+    Each verdict is a dict: {conflict, reason, confidence, severity, judged_at}.
+
+    Args:
+        path: Pickle file holding the verdicts
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._verdicts: Dict[PairKey, Dict] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                self._verdicts = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load pair verdicts from {self.path}: {e}")
+            self._verdicts = {}
+
+    def get(self, text_a: str, text_b: str, model: str) -> Optional[Dict]:
+        """Return the stored verdict for a pair, or None if it was never judged."""
+        verdict = self._verdicts.get(pair_key(text_a, text_b, model))
+        if verdict is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return verdict
+
+    def record(
+        self,
+        text_a: str,
+        text_b: str,
+        model: str,
+        conflict: bool,
+        reason: str = "",
+        confidence: str = "medium",
+        severity: str = "medium",
+    ):
+        """Store the verdict for a pair (overwrites any previous one)."""
+        with self._lock:
+            self._verdicts[pair_key(text_a, text_b, model)] = {
+                "conflict": conflict,
+                "reason": reason,
+                "confidence": confidence,
+                "severity": severity,
+                "judged_at": datetime.utcnow().isoformat(),
+            }
+            self._dirty = True
+
+    def save(self):
+        """Write verdicts to disk if anything changed (safe to call from several threads)."""
+        with _save_lock(self.path):
+            with self._lock:
+                if not self._dirty:
+                    return
+                snapshot = dict(self._verdicts)
+                self._dirty = False
+            directory = os.path.dirname(self.path) or "."
+            os.makedirs(directory, exist_ok=True)
+            # A temp file per write: a reader only ever sees a complete pickle
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".pair_verdicts.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(snapshot, f)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                with self._lock:
+                    self._dirty = True
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    def __len__(self) -> int:
+        return len(self._verdicts)
+
+
+class VerdictCacheStore:
+    """
+    LRU of per-project verdict caches ({base_dir}/{project_id}/pair_verdicts.pkl).
+
+    get() may read a pickle and save an evicted cache: call it off the event loop.
+
+    Args:
+        base_dir: Directory holding one subdirectory per project
+        max_projects: Number of project caches kept in memory
+    """
+
+    def __init__(self, base_dir: str = "data/conflict_state", max_projects: int = 32):
+        self.base_dir = base_dir
+        self.max_projects = max_projects
+        self._caches: "OrderedDict[str, PairVerdictCache]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, project_id) -> str:
+        return os.path.join(self.base_dir, str(project_id), "pair_verdicts.pkl")
+
+    def cached(self, project_id) -> Optional[PairVerdictCache]:
+        """The project's cache if it is already in memory (never blocks on disk)."""
+        key = str(project_id)
+        with self._lock:
+            cache = self._caches.get(key)
+            if cache is not None:
+                self._caches.move_to_end(key)
+            return cache
+
+    def get(self, project_id) -> PairVerdictCache:
+        """Get the project's cache, loading it from disk on first use."""
+        cache = self.cached(project_id)
+        if cache is not None:
+            return cache
+        loaded = PairVerdictCache(self.path(project_id))
+        key = str(project_id)
+        with self._lock:
+            # Another thread may have loaded it meanwhile: keep the first one
+            cache = self._caches.setdefault(key, loaded)
+            self._caches.move_to_end(key)
+            evicted = []
+            while len(self._caches) > self.max_projects:
+                evicted.append(self._caches.popitem(last=False)[1])
+        for old in evicted:
+            old.save()
+        return cache
+
+    def __len__(self) -> int:
+        return len(self._caches)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            caches = list(self._caches.values())
+        return {
+            "projects": len(caches),
+            "hits": sum(c.hits for c in caches),
+            "misses": sum(c.misses for c in caches),
+        }
+
+
+_shared_store: Optional[VerdictCacheStore] = None
+_shared_store_lock = threading.Lock()
+
+
+def shared_verdict_caches() -> VerdictCacheStore:
+    """
+    The process-wide store (CONFLICT_STATE_DIR, CONFLICT_VERDICT_CACHE_PROJECTS).
+
+    Created on first use, so the environment (.env) is read by then.
+    """
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            _shared_store = VerdictCacheStore(
+                base_dir=os.getenv("CONFLICT_STATE_DIR", "data/conflict_state"),
+                max_projects=int(os.getenv("CONFLICT_VERDICT_CACHE_PROJECTS", "32")),
+            )
+        return _shared_store